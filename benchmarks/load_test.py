@@ -0,0 +1,334 @@
+"""
+============
+load_test.py
+============
+
+Load test of `NetcdfConverterService`, to estimate how many concurrent
+Harmony requests a node can sustain.
+
+Synthetic NetCDF granules are written once. Then a Harmony message and STAC
+catalog are generated for each request, modeled on the test message in
+`tests/data`. The requests are run end to end by a pool of worker processes,
+one request per worker at a time, as separate service containers on a node
+would run them. Staged COGs are copied to a local directory standing in for
+S3, with their size and checksum computed as when uploading.
+
+Reported are the throughput, the request latency percentiles, the peak RSS
+of each worker and the peak disk usage of the work and staging directories.
+Inputs are `file://` URLs, so download time is not included.
+
+Service settings such as `ITEM_CONCURRENCY` or `SCRATCH_BACKEND` are read
+from the environment, as by the service.
+
+Usage::
+
+    python benchmarks/load_test.py --requests 32 --concurrency 4 --granules 2 --size 2048
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from os.path import dirname, join
+from unittest.mock import patch
+
+import netCDF4
+import numpy as np
+from harmony_service_lib.message import Message
+from harmony_service_lib.util import config
+from pystac import Catalog
+
+from net2cog.netcdf_convert_harmony import NetcdfConverterService
+from net2cog.staging import DEFAULT_CHECKSUM_ALGORITHM, READ_SIZE, ChecksumReader, StagedFile, staging_destination
+
+MESSAGE_TEMPLATE = join(dirname(__file__), '..', 'tests', 'data', 'SMAP_RSS_L3_SSS_SMI_8DAY-RUNNINGMEAN_V4',
+                        'data_operation_message.json')
+
+STAGING_BUCKET = 'load-test'
+
+# Environment of each worker, as in the service container
+WORKER_ENVIRONMENT = {
+    'ENV': 'test',
+    'USE_LOCALSTACK': 'false',
+    'STAGING_BUCKET': STAGING_BUCKET,
+    'STAGING_PATH': '',
+    'AWS_DEFAULT_REGION': 'us-west-2',
+    'AWS_ACCESS_KEY_ID': 'load-test',
+    'AWS_SECRET_ACCESS_KEY': 'load-test',
+    'SHARED_SECRET_KEY': '_load_test_shared_secret_key_32_',
+}
+
+
+def _write_granule(path: str, size: int, variable_names: list[str], seed: int):
+    """A global granule with `size` rows, twice as many columns, and a
+    compressed, chunked float variable for each name.
+    """
+    rng = np.random.default_rng(seed)
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('lat', size)
+        dataset.createDimension('lon', 2 * size)
+        latitude = dataset.createVariable('lat', 'f4', ('lat',))
+        latitude.standard_name = 'latitude'
+        latitude[:] = np.linspace(90, -90, size, endpoint=False) - 90 / size
+        longitude = dataset.createVariable('lon', 'f4', ('lon',))
+        longitude.standard_name = 'longitude'
+        longitude[:] = np.linspace(-180, 180, 2 * size, endpoint=False) + 90 / size
+        chunk = min(size, 512)
+        for variable_name in variable_names:
+            variable = dataset.createVariable(variable_name, 'f4', ('lat', 'lon'), zlib=True,
+                                              chunksizes=(chunk, chunk), fill_value=-9999.0)
+            for row in range(0, size, chunk):
+                rows = min(chunk, size - row)
+                variable[row:row + rows, :] = rng.normal(20, 5, (rows, 2 * size)).astype('f4')
+
+
+def _stac_item(granule_id: str, granule_file: str, temporal: dict) -> dict:
+    """A STAC item for a global granule, as in the Harmony STAC catalog."""
+    return {
+        'type': 'Feature',
+        'stac_version': '1.0.0',
+        'id': granule_id,
+        'properties': {
+            'start_datetime': temporal['start'],
+            'end_datetime': temporal['end'],
+            'datetime': None,
+        },
+        'geometry': None,
+        'bbox': [-180, -90, 180, 90],
+        'links': [
+            {'rel': 'root', 'href': './catalog.json', 'type': 'application/json'},
+            {'rel': 'parent', 'href': './catalog.json', 'type': 'application/json'},
+        ],
+        'assets': {'data': {'href': f'file://{granule_file}', 'title': granule_id, 'roles': ['data']}},
+    }
+
+
+def _write_request(request_dir: str, template: dict, granule_files: list[str],
+                   variable_names: list[str]) -> tuple[str, str]:
+    """Write the Harmony message and STAC catalog of one request, returning
+    their paths.
+    """
+    os.makedirs(request_dir)
+    request_id = str(uuid.uuid4())
+    message = json.loads(json.dumps(template))
+    message['requestId'] = request_id
+    message['stagingLocation'] = f's3://{STAGING_BUCKET}/public/load-test/{request_id}/'
+    source = message['sources'][0]
+    source['variables'] = [
+        {'id': f'V{index}-LOADTEST', 'name': variable_name, 'fullPath': variable_name}
+        for index, variable_name in enumerate(variable_names)
+    ]
+    granule_template = source['granules'][0]
+    source['granules'] = []
+
+    catalog = {
+        'type': 'Catalog',
+        'id': request_id,
+        'stac_version': '1.0.0',
+        'description': 'load test',
+        'links': [{'rel': 'root', 'href': './catalog.json', 'type': 'application/json'}],
+    }
+    for index, granule_file in enumerate(granule_files):
+        granule_id = f'granule_{index}'
+        source['granules'].append(dict(granule_template, id=granule_id, url=f'file://{granule_file}'))
+        with open(join(request_dir, f'{granule_id}.json'), 'w', encoding='utf-8') as file_handler:
+            json.dump(_stac_item(granule_id, granule_file, granule_template['temporal']), file_handler)
+        catalog['links'].append({'rel': 'item', 'href': f'./{granule_id}.json', 'type': 'application/json'})
+
+    message_path = join(request_dir, 'message.json')
+    with open(message_path, 'w', encoding='utf-8') as file_handler:
+        json.dump(message, file_handler)
+    catalog_path = join(request_dir, 'catalog.json')
+    with open(catalog_path, 'w', encoding='utf-8') as file_handler:
+        json.dump(catalog, file_handler)
+    return message_path, catalog_path
+
+
+def _local_stage_file(staging_dir: str):
+    """A stand-in for `net2cog.staging.stage_file` that copies files to a
+    local directory, computing their size and checksum as they are copied.
+    """
+    def stage_file(local_filename, remote_filename, mime, location, logger, cfg,  # pylint: disable=too-many-arguments
+                   checksum_algorithm=DEFAULT_CHECKSUM_ALGORITHM, multipart=None):  # pylint: disable=unused-argument
+        bucket, key = staging_destination(remote_filename, location, cfg)
+        destination = join(staging_dir, bucket, key)
+        os.makedirs(dirname(destination), exist_ok=True)
+        with open(local_filename, 'rb') as source, open(destination, 'wb') as target:
+            reader = ChecksumReader(source, checksum_algorithm)
+            while data := reader.read(READ_SIZE):
+                target.write(data)
+        logger.info('Staged %s as %s (%s)', local_filename, destination, mime)
+        return StagedFile(f'file://{destination}', reader.size, reader.checksum)
+
+    return stage_file
+
+
+def _init_worker(data_dir: str, staging_dir: str):
+    os.environ.update(WORKER_ENVIRONMENT)
+    os.environ['DATA_DIRECTORY'] = data_dir
+    patch('net2cog.netcdf_convert_harmony.stage_file', _local_stage_file(staging_dir)).start()
+
+
+def _run_request(message_path: str, catalog_path: str) -> dict:
+    """Run one request end to end in a worker, returning its latency, the
+    number of output assets and the peak RSS of the worker so far.
+    """
+    with open(message_path, 'r', encoding='utf-8') as file_handler:
+        message = Message(json.load(file_handler))
+
+    start = time.perf_counter()
+    service = NetcdfConverterService(message, catalog=Catalog.from_file(catalog_path), config=config(False))
+    _, output_catalog = service.invoke()
+    latency = time.perf_counter() - start
+
+    return {
+        'latency': latency,
+        'assets': sum(len(item.assets) for item in output_catalog.get_all_items()),
+        'pid': os.getpid(),
+        # Kilobytes on Linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+    }
+
+
+def _directory_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(join(root, name))
+            except OSError:
+                # Removed while walking
+                pass
+    return size
+
+
+class _DiskSampler(threading.Thread):
+    """Samples the size of a directory until stopped, keeping the peak."""
+
+    def __init__(self, path: str, interval: float):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            self.peak = max(self.peak, _directory_size(self.path))
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        """Stop sampling, after a final sample."""
+        self._stopped.set()
+        self.join()
+        self.peak = max(self.peak, _directory_size(self.path))
+
+
+def _write_inputs(args: argparse.Namespace, root: str) -> tuple[list[tuple[str, str]], int]:
+    """Write the granules shared by all requests, and the message and
+    catalog of each request. Returns the paths of the message and catalog of
+    each request, and the size of the granules of a request.
+    """
+    variable_names = [f'var_{index}' for index in range(args.variables)]
+    granule_files = [join(root, f'granule_{index}.nc') for index in range(args.granules)]
+    for index, granule_file in enumerate(granule_files):
+        _write_granule(granule_file, args.size, variable_names, index)
+
+    with open(MESSAGE_TEMPLATE, 'r', encoding='utf-8') as file_handler:
+        template = json.load(file_handler)
+    requests = [
+        _write_request(join(root, 'requests', str(index)), template, granule_files, variable_names)
+        for index in range(args.requests)
+    ]
+    return requests, sum(os.path.getsize(granule_file) for granule_file in granule_files)
+
+
+def run_load_test(args: argparse.Namespace, root: str) -> dict:
+    """Generate the inputs and requests, run them and return the results."""
+    requests, input_bytes = _write_inputs(args, root)
+
+    data_dir = join(root, 'data')
+    staging_dir = join(root, 'staging')
+    os.makedirs(data_dir)
+    os.makedirs(staging_dir)
+    work_disk = _DiskSampler(data_dir, args.sample_interval)
+    work_disk.start()
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.concurrency, initializer=_init_worker,
+                             initargs=(data_dir, staging_dir)) as executor:
+        results = list(executor.map(_run_request, *zip(*requests)))
+    elapsed = time.perf_counter() - start
+    work_disk.stop()
+
+    latencies = np.array([result['latency'] for result in results])
+    worker_peaks = {}
+    for result in results:
+        worker_peaks[result['pid']] = max(worker_peaks.get(result['pid'], 0), result['peak_rss'])
+
+    return {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'granules_per_request': args.granules,
+        'variables_per_granule': args.variables,
+        'input_bytes_per_request': input_bytes,
+        'elapsed_seconds': elapsed,
+        'requests_per_second': args.requests / elapsed,
+        'granules_per_second': args.requests * args.granules / elapsed,
+        'input_megabytes_per_second': args.requests * input_bytes / elapsed / 1024 ** 2,
+        'latency_seconds': {
+            f'p{percentile}': float(np.percentile(latencies, percentile)) for percentile in (50, 90, 99)
+        } | {'max': float(latencies.max())},
+        'output_assets': sum(result['assets'] for result in results),
+        'peak_rss_bytes': {
+            'max_worker': max(worker_peaks.values()),
+            'sum_of_workers': sum(worker_peaks.values()),
+        },
+        'peak_work_disk_bytes': work_disk.peak,
+        'staged_bytes': _directory_size(staging_dir),
+    }
+
+
+def main():
+    """Run the load test and print the results."""
+    parser = argparse.ArgumentParser(description='Load test NetcdfConverterService with synthetic requests')
+    parser.add_argument('--requests', type=int, default=16, help='Number of requests to run')
+    parser.add_argument('--concurrency', type=int, default=4, help='Number of requests run at the same time')
+    parser.add_argument('--granules', type=int, default=1, help='Granules in each request')
+    parser.add_argument('--variables', type=int, default=2, help='Variables requested from each granule')
+    parser.add_argument('--size', type=int, default=1024, help='Rows of each granule, with twice as many columns')
+    parser.add_argument('--sample-interval', type=float, default=0.1, help='Seconds between disk usage samples')
+    parser.add_argument('--work-dir', help='Directory for inputs, work directories and staged files')
+    parser.add_argument('-o', '--output', help='Also write the results as JSON to this file')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='net2cog-load-', dir=args.work_dir)
+    try:
+        results = run_load_test(args, root)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+    latency = results['latency_seconds']
+    print(f"{results['requests']} requests, concurrency {results['concurrency']}, "
+          f"{results['granules_per_request']} granule(s) x {results['variables_per_granule']} variable(s)")
+    print(f"throughput: {results['requests_per_second']:.2f} requests/s, "
+          f"{results['granules_per_second']:.2f} granules/s, {results['input_megabytes_per_second']:.1f} MiB/s")
+    print(f"latency: p50 {latency['p50']:.2f}s  p90 {latency['p90']:.2f}s  p99 {latency['p99']:.2f}s  "
+          f"max {latency['max']:.2f}s")
+    print(f"peak RSS: {results['peak_rss_bytes']['max_worker'] / 1024 ** 2:.1f} MiB per worker, "
+          f"{results['peak_rss_bytes']['sum_of_workers'] / 1024 ** 2:.1f} MiB all workers")
+    print(f"disk: {results['peak_work_disk_bytes'] / 1024 ** 2:.1f} MiB peak work directories, "
+          f"{results['staged_bytes'] / 1024 ** 2:.1f} MiB staged")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_handler:
+            json.dump(results, file_handler, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+===============
+quantization.py
+===============
+
+Benchmark the compression gain and error of quantizing floating point
+variables. Each variable of a NetCDF file is converted to a COG without
+quantization, then with each precision given, and for each precision the
+COG size, its gain over the unquantized COG and the largest absolute error
+of the full resolution pixels are reported.
+
+Usage::
+
+    python benchmarks/quantization.py granule.nc --variables sss_smap \
+        --bits 8 12 16 --digits 1 2 3 --compression zstd-predictor
+"""
+import argparse
+import logging
+import pathlib
+import tempfile
+from os.path import getsize
+
+import numpy as np
+import rasterio
+
+from net2cog.compression import CompressionConfig
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.quantize import QuantizeConfig
+
+
+def _max_error(cog_file: str, reference_file: str) -> float:
+    """Largest absolute difference of the valid full resolution pixels."""
+    with rasterio.open(cog_file) as cog, rasterio.open(reference_file) as reference:
+        data = cog.read(masked=True).astype(np.float64)
+        reference_data = reference.read(masked=True).astype(np.float64)
+    errors = np.abs(data - reference_data).compressed()
+    errors = errors[np.isfinite(errors)]
+    return float(errors.max()) if errors.size else 0.0
+
+
+def benchmark(netcdf_file: pathlib.Path, variables: list[str], precisions: list[QuantizeConfig],
+              compression: CompressionConfig) -> dict[str, list[dict]]:
+    """
+    Convert the variables without quantization and with each precision,
+    returning the size, gain and maximum absolute error of each COG.
+    """
+    logger = logging.getLogger('quantization')
+    results = {variable: [] for variable in variables}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        runs = [('none', None)] + [(_precision_name(precision), precision) for precision in precisions]
+        reference_cogs = None
+        for name, precision in runs:
+            output_directory = pathlib.Path(temp_dir) / name
+            output_directory.mkdir()
+            cogs = netcdf_converter(netcdf_file, output_directory, variables, logger,
+                                    compression=compression, quantization=precision)
+            reference_cogs = reference_cogs or cogs
+            for variable, cog, reference_cog in zip(variables, cogs, reference_cogs):
+                results[variable].append({
+                    'precision': name,
+                    'bytes': getsize(cog),
+                    'gain': getsize(reference_cog) / getsize(cog),
+                    'max_error': _max_error(cog, reference_cog),
+                })
+
+    return results
+
+
+def _precision_name(precision: QuantizeConfig) -> str:
+    if precision.significant_bits is not None:
+        return f'{precision.significant_bits} bits'
+    return f'{precision.significant_digits} digits'
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description='Benchmark the compression gain and error of quantization')
+    parser.add_argument('netcdf_file', type=pathlib.Path, help='NetCDF file to convert')
+    parser.add_argument('--variables', nargs='+', required=True, help='Floating point variables to convert')
+    parser.add_argument('--bits', type=int, nargs='*', default=[8, 12, 16], help='Significant bits to keep')
+    parser.add_argument('--digits', type=int, nargs='*', default=[1, 2, 3],
+                        help='Least significant decimal digits to keep')
+    parser.add_argument('--compression', default='deflate', help='Compression setting of the COGs')
+    args = parser.parse_args()
+
+    precisions = ([QuantizeConfig(significant_bits=bits) for bits in args.bits]
+                  + [QuantizeConfig(significant_digits=digits) for digits in args.digits])
+    results = benchmark(args.netcdf_file, args.variables, precisions, CompressionConfig(mode=args.compression))
+
+    print(f'{"variable":<20} {"precision":<10} {"bytes":>10} {"gain":>6} {"max error":>12}')
+    for variable, variable_results in results.items():
+        for result in variable_results:
+            print(f'{variable:<20} {result["precision"]:<10} {result["bytes"]:>10} '
+                  f'{result["gain"]:>6.2f} {result["max_error"]:>12.3g}')
+
+
+if __name__ == '__main__':
+    main()
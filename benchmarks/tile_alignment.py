@@ -0,0 +1,123 @@
+"""
+=================
+tile_alignment.py
+=================
+
+Benchmark the read order used to write the intermediate GeoTIFF for a chunked
+NetCDF variable. Three read orders are compared:
+
+* `whole`: the variable is read at once, as for unchunked variables.
+* `fixed`: the variable is read one 512 pixel tile at a time, the fixed
+  blocksize of the `deflate` COG profile.
+* `aligned`: the variable is read one row of NetCDF chunks at a time, as
+  when COG tiles are aligned with the chunk layout.
+
+The HDF5 chunk cache is disabled, so every chunk intersected by a read is
+decompressed, and the reported decompression counts are exact.
+
+Usage::
+
+    python benchmarks/tile_alignment.py --size 4096 --chunk 384
+"""
+import argparse
+import math
+import tempfile
+import time
+import tracemalloc
+from os.path import join
+from unittest.mock import patch
+
+import netCDF4
+import numpy as np
+import rioxarray  # noqa  # pylint: disable=unused-import
+import xarray as xr
+from xarray.backends.netCDF4_ import NetCDF4ArrayWrapper
+
+
+def _write_chunked_file(path: str, size: int, chunk: int):
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('lat', size)
+        dataset.createDimension('lon', 2 * size)
+        latitude = dataset.createVariable('lat', 'f4', ('lat',))
+        latitude.standard_name = 'latitude'
+        latitude[:] = np.linspace(-90, 90, size)
+        longitude = dataset.createVariable('lon', 'f4', ('lon',))
+        longitude.standard_name = 'longitude'
+        longitude[:] = np.linspace(-180, 180, 2 * size)
+        variable = dataset.createVariable('sst', 'f4', ('lat', 'lon'), zlib=True, chunksizes=(chunk, chunk))
+        for row in range(0, size, chunk):
+            rows = min(chunk, size - row)
+            variable[row:row + rows, :] = np.random.default_rng(row).random((rows, 2 * size), dtype='f4')
+
+
+def _chunks_read(key, shape, chunksizes) -> int:
+    """Number of chunks intersected by a read with the given slices."""
+    count = 1
+    for index, length, chunk in zip(key, shape, chunksizes):
+        if isinstance(index, slice):
+            start, stop, _ = index.indices(length)
+            count *= (stop - 1) // chunk - start // chunk + 1
+    return count
+
+
+def _run(netcdf_file: str, output_file: str, chunk: int, raster_options: dict) -> dict:
+    reads = []
+    original_getitem = NetCDF4ArrayWrapper._getitem  # pylint: disable=protected-access
+
+    def counting_getitem(wrapper, key):
+        if wrapper.variable_name == 'sst':
+            reads.append(_chunks_read(key, wrapper.shape, (chunk, chunk)))
+        return original_getitem(wrapper, key)
+
+    with xr.open_dataset(netcdf_file) as dataset, \
+            patch.object(NetCDF4ArrayWrapper, '_getitem', counting_getitem):
+        tracemalloc.start()
+        start = time.perf_counter()
+        dataset['sst'].rio.to_raster(output_file, **raster_options)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {'reads': len(reads), 'decompressions': sum(reads), 'seconds': elapsed, 'peak_mib': peak / 2 ** 20}
+
+
+def benchmark(size: int, chunk: int) -> dict[str, dict]:
+    """Write the intermediate GeoTIFF with each read order, returning the
+    number of reads, chunk decompressions, wall time and peak memory of each.
+    """
+    # Disable the HDF5 chunk cache for files opened from here on
+    netCDF4.set_chunk_cache(0, 0, 0.0)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        netcdf_file = join(temp_dir, 'chunked.nc')
+        _write_chunked_file(netcdf_file, size, chunk)
+
+        read_orders = {
+            'whole': {},
+            'fixed': {'tiled': True, 'blockxsize': 512, 'blockysize': 512, 'windowed': True},
+            'aligned': {'blockysize': chunk, 'windowed': True},
+        }
+        return {
+            name: _run(netcdf_file, join(temp_dir, f'{name}.tif'), chunk, raster_options)
+            for name, raster_options in read_orders.items()
+        }
+
+
+def main():
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description='Benchmark chunk-aligned reads of a NetCDF variable')
+    parser.add_argument('--size', type=int, default=4096, help='Number of rows, with twice as many columns')
+    parser.add_argument('--chunk', type=int, default=384, help='Square NetCDF chunk size')
+    args = parser.parse_args()
+
+    results = benchmark(args.size, args.chunk)
+    chunks = math.ceil(args.size / args.chunk) * math.ceil(2 * args.size / args.chunk)
+    print(f'{args.size}x{2 * args.size} float32, {args.chunk}x{args.chunk} chunks ({chunks} chunks)')
+    print(f'{"order":<8} {"reads":>6} {"decompressions":>15} {"seconds":>8} {"peak MiB":>9}')
+    for name, result in results.items():
+        print(f'{name:<8} {result["reads"]:>6} {result["decompressions"]:>15} '
+              f'{result["seconds"]:>8.2f} {result["peak_mib"]:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
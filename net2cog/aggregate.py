@@ -0,0 +1,246 @@
+"""
+============
+aggregate.py
+============
+
+Aggregation of the same variables across several NetCDF granules on a shared
+grid into one multi-band COG per variable, with a band for each granule in
+input order.
+
+Each granule is opened and read once, and its band of every requested
+variable is written to that variable's intermediate GeoTIFF before the next
+granule is read, so memory use does not grow with the number of granules.
+
+Swath granules are gridded as for conversion, see `swath.py`, and can only
+be aggregated if they are gridded onto the same grid. Quicklooks are of the
+first band, see `quicklook.py`.
+"""
+
+import pathlib
+from contextlib import ExitStack
+from logging import Logger
+from os.path import basename
+
+import numpy as np
+import rasterio
+import xarray as xr
+from rio_cogeo.profiles import cog_profiles
+from xarray.conventions import encode_cf_variable
+
+from net2cog.compression import CompressionConfig
+from net2cog.masking import Validity
+from net2cog.netcdf_convert import (Net2CogError, _GroupDatasets, _split_variable_path, _translate_intermediate,
+                                    inspect, output_basename)
+from net2cog.overviews import OverviewConfig
+from net2cog.profiling import ProfileConfig, profile
+from net2cog.quantize import QuantizeConfig
+from net2cog.quicklook import QuicklookConfig, quicklook_file, write_quicklook
+from net2cog.scratch import ScratchSpace
+from net2cog.statistics import DEFAULT_HISTOGRAM_BINS
+from net2cog.swath import SwathGridConfig
+
+
+def _granule_band(xds: xr.Dataset, variable_name: str, netcdf_file: str) -> xr.DataArray:
+    """The 2D band of a variable in one granule. Dimensions of length one,
+    such as a single time step, are removed.
+    """
+    _, group_variable_name = _split_variable_path(variable_name)
+    try:
+        variable = xds[group_variable_name]
+    except KeyError as error:
+        raise Net2CogError(variable_name, f'not found in {basename(netcdf_file)}') from error
+
+    band = variable.squeeze(drop=True)
+    if band.ndim != 2:
+        raise Net2CogError(variable_name, f'has dimensions {variable.dims} in {basename(netcdf_file)}, '
+                                          f'only one time step per granule can be aggregated')
+    return band
+
+
+def _granule_time(xds: xr.Dataset) -> str | None:
+    """The time of a granule with a single time step, if it has one."""
+    if 'time' in xds.variables and xds['time'].size == 1:
+        return str(xds['time'].values.flatten()[0])
+    return None
+
+
+class _StackedVariable:  # pylint: disable=too-many-instance-attributes
+    """The intermediate multi-band GeoTIFF for one aggregated variable."""
+
+    def __init__(self, variable_name: str, first_band: xr.DataArray, band_count: int):
+        self.variable_name = variable_name
+        self.validity = Validity.from_variable(first_band)
+        self.dims = first_band.dims
+        self.coords = {dim: first_band[dim].values for dim in first_band.dims}
+        self.band_count = band_count
+        self.encoded_dtype = np.dtype(first_band.encoding.get('dtype', first_band.dtype))
+        self.profile = {
+            'driver': 'GTiff',
+            'width': first_band.rio.width,
+            'height': first_band.rio.height,
+            'count': band_count,
+            'dtype': self.encoded_dtype,
+            'transform': first_band.rio.transform(recalc=True),
+            'interleave': 'band',
+        }
+        if self.validity.nodata is not None:
+            self.profile['nodata'] = self.validity.nodata
+        self.scale = first_band.encoding.get('scale_factor', 1.0)
+        self.offset = first_band.encoding.get('add_offset', 0.0)
+        self.path = None
+        self.dataset = None
+
+    @property
+    def estimated_size(self) -> int:
+        """Estimated size of the intermediate GeoTIFF in bytes."""
+        return self.profile['width'] * self.profile['height'] * self.band_count * self.encoded_dtype.itemsize
+
+    def open(self, path: str):
+        """Create the intermediate GeoTIFF."""
+        self.path = path
+        self.dataset = rasterio.open(path, 'w', **self.profile)
+        self.dataset.scales = [self.scale] * self.band_count
+        self.dataset.offsets = [self.offset] * self.band_count
+
+    def write(self, index: int, band: xr.DataArray, granule_name: str, granule_time: str | None):
+        """Write the band of one granule, which must be on the same grid as
+        the first granule.
+        """
+        if band.dims != self.dims or any(
+                not np.array_equal(band[dim].values, values) for dim, values in self.coords.items()):
+            raise Net2CogError(self.variable_name, f'{granule_name} is not on the same grid as the first granule')
+
+        self.dataset.write(encode_cf_variable(band.variable).values.astype(self.encoded_dtype), index)
+        self.dataset.set_band_description(index, granule_name)
+        tags = {'SOURCE': granule_name}
+        if granule_time is not None:
+            tags['TIME'] = granule_time
+        self.dataset.update_tags(index, **tags)
+
+    def close(self):
+        """Close the intermediate GeoTIFF."""
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+
+
+def netcdf_aggregator(  # pylint: disable=too-many-arguments,too-many-locals
+    input_nc_files: list[pathlib.Path],
+    output_directory: pathlib.Path,
+    var_list: list[str],
+    logger: Logger,
+    scratch: ScratchSpace | None = None,
+    histogram_bins: int = DEFAULT_HISTOGRAM_BINS,
+    compression: CompressionConfig | None = None,
+    overviews: OverviewConfig | None = None,
+    quantization: QuantizeConfig | None = None,
+    sparse: bool = False,
+    quicklook: QuicklookConfig | None = None,
+    swath_grid: SwathGridConfig | None = None,
+    profile_config: ProfileConfig | None = None,
+) -> list[str]:
+    """
+    Combine each requested variable across several NetCDF granules into a
+    multi-band COG, with one band per granule in the order given.
+
+    Parameters
+    ----------
+    input_nc_files : list[pathlib.Path]
+        NetCDF granules on the same grid, e.g. consecutive days.
+    output_directory : pathlib.Path
+        Path to temporary directory into which results will be placed before
+        staging in S3.
+    var_list : list[str]
+        Variables to aggregate, as for `netcdf_converter`. If this list is
+        empty, all variables of the first granule that can be converted are
+        aggregated.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    scratch : net2cog.scratch.ScratchSpace | None
+        Scratch space for intermediate and output files.
+    histogram_bins : int
+        Number of buckets in the histogram written with each band's
+        statistics, or 0 to skip the histogram.
+    compression : net2cog.compression.CompressionConfig | None
+        Compression of each COG, sampled across all its bands in auto mode.
+        Defaults to DEFLATE.
+    overviews : net2cog.overviews.OverviewConfig | None
+        Engine and number of overview levels of each COG. Defaults to GDAL
+        overviews.
+    quantization : net2cog.quantize.QuantizeConfig | None
+        Precision floating point variables are quantized to. Not quantized if
+        None.
+    sparse : bool
+        Whether tiles that are nodata in every band are left unwritten.
+    quicklook : net2cog.quicklook.QuicklookConfig | None
+        If enabled, a quicklook PNG of the first band of each COG is written
+        to `output_directory` as `<variable name>.png`.
+    swath_grid : net2cog.swath.SwathGridConfig | None
+        Gridding of swath variables, as for `netcdf_converter`.
+    profile_config : net2cog.profiling.ProfileConfig | None
+        Profiling of the translation of each variable to a COG, in
+        `variable` scope.
+
+    Returns
+    -------
+    list[str]
+        The COG for each variable, named `<variable name>.tif`.
+    """
+    scratch = scratch or ScratchSpace(logger=logger)
+    netcdf_files = [str(pathlib.Path(netcdf_file).absolute()) for netcdf_file in input_nc_files]
+    if not netcdf_files:
+        return []
+
+    plan = inspect(pathlib.Path(netcdf_files[0]), var_list, logger, swath_grid)
+    for variable_plan in plan.variables:
+        if not variable_plan.found:
+            raise Net2CogError(variable_plan.name, variable_plan.skip_reason)
+    variable_names = plan.convertible_variables
+    logger.info('Aggregating %s across %d granules', variable_names, len(netcdf_files))
+
+    stacked: dict[str, _StackedVariable] = {}
+    output_files = {}
+    with ExitStack() as intermediates:
+        try:
+            for index, netcdf_file in enumerate(netcdf_files, start=1):
+                granule_name = basename(netcdf_file)
+                logger.info('Reading granule %d of %d: %s', index, len(netcdf_files), granule_name)
+                with _GroupDatasets(netcdf_file, logger, swath_grid) as group_datasets:
+                    for variable_name in variable_names:
+                        group_path, _ = _split_variable_path(variable_name)
+                        xds = group_datasets.open(group_path)
+                        band = _granule_band(xds, variable_name, netcdf_file)
+
+                        if variable_name not in stacked:
+                            stacked[variable_name] = _StackedVariable(variable_name, band, len(netcdf_files))
+                            cog_basename = output_basename(variable_name)
+                            cog_size = stacked[variable_name].estimated_size * 4 // 3
+                            output_files[variable_name] = scratch.output_file(str(output_directory),
+                                                                              cog_basename, cog_size)
+                            stacked[variable_name].open(intermediates.enter_context(
+                                scratch.intermediate_file(cog_basename,
+                                                          stacked[variable_name].estimated_size + cog_size)
+                            ))
+
+                        stacked[variable_name].write(index, band, granule_name, _granule_time(xds))
+
+            for variable_name, stacked_variable in stacked.items():
+                stacked_variable.close()
+                profile_name = f'{basename(netcdf_files[0])}-{variable_name}'
+                with profile(profile_config, 'variable', profile_name, logger):
+                    _translate_intermediate(stacked_variable.path, output_files[variable_name], variable_name,
+                                            stacked_variable.validity, cog_profiles.get('deflate'), scratch,
+                                            histogram_bins, logger, compression, overviews, quantization, sparse)
+                    scratch.account_file(output_files[variable_name])
+                    if quicklook and quicklook.enabled:
+                        write_quicklook(output_files[variable_name],
+                                        quicklook_file(str(output_directory), output_files[variable_name]),
+                                        quicklook, logger)
+        except BaseException:
+            for stacked_variable in stacked.values():
+                stacked_variable.close()
+            for output_file in output_files.values():
+                scratch.release(output_file)
+            raise
+
+    return list(output_files.values())
@@ -0,0 +1,196 @@
+"""
+=============
+checkpoint.py
+=============
+
+Checkpoints that let a retried item resume a conversion interrupted part way,
+e.g. when a worker on spot or preemptible capacity is reclaimed.
+
+Checkpointing is enabled by setting `CHECKPOINT_DIRECTORY` to a directory that
+outlives the worker process. Each item is then converted in a work directory
+derived from the request and item IDs, rather than a new temporary directory,
+so a retry of the same item finds the work of the previous attempt. A
+manifest in the work directory records:
+
+* the downloaded input file, which is not downloaded again;
+* each converted COG in the work directory and its checksum, which is not
+  converted again if the file is unchanged;
+* each staged COG with its URL, size, checksum and raster bands, which is
+  neither converted nor staged again.
+
+The work directory is removed once the item succeeds, and kept when it fails.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import re
+import threading
+from logging import Logger
+from os.path import basename
+from os.path import join as path_join
+
+from net2cog.staging import ChecksumReader, StagedFile
+
+CHECKPOINT_DIRECTORY_ENV = 'CHECKPOINT_DIRECTORY'
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def _safe_name(name: str) -> str:
+    """A file name for an ID, which is kept unless it has unsafe characters."""
+    safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', name)
+    if safe_name != name:
+        safe_name = f'{safe_name}-{hashlib.sha256(name.encode()).hexdigest()[:12]}'
+    return safe_name
+
+
+def work_directory(checkpoint_directory: str, request_id: str, item_id: str) -> str:
+    """The work directory of an item, which is the same for every attempt."""
+    path = path_join(checkpoint_directory, _safe_name(request_id), _safe_name(item_id))
+    pathlib.Path(path).mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def file_checksum(path: str, algorithm: str) -> str:
+    """Hex-encoded multihash of a file, as computed while staging it."""
+    with open(path, 'rb') as file_handler:
+        reader = ChecksumReader(file_handler, algorithm)
+        reader.drain()
+    return reader.checksum
+
+
+class CheckpointManifest:  # pylint: disable=too-many-instance-attributes
+    """
+    Record of the work completed for one item, saved in its work directory
+    after every change.
+
+    Parameters
+    ----------
+    directory : str
+        Work directory of the item.
+    input_href : str
+        URL of the input data. A manifest for different input is discarded.
+    checksum_algorithm : str
+        The `hashlib` algorithm for checksums of converted COGs.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+
+    def __init__(self, directory: str, input_href: str, checksum_algorithm: str, logger: Logger):
+        self.directory = directory
+        self.input_href = input_href
+        self.checksum_algorithm = checksum_algorithm
+        self.logger = logger
+        self.input_file: str | None = None
+        self.converted: dict[str, dict] = {}
+        self.staged: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def path(self) -> str:
+        """Path of the manifest file."""
+        return path_join(self.directory, MANIFEST_NAME)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as file_handler:
+                manifest = json.load(file_handler)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as error:
+            self.logger.warning('Ignoring unreadable checkpoint manifest %s: %s', self.path, error)
+            return
+
+        if manifest.get('version') != MANIFEST_VERSION or manifest.get('input_href') != self.input_href:
+            self.logger.info('Ignoring checkpoint manifest %s for different input', self.path)
+            return
+
+        self.input_file = manifest.get('input_file')
+        self.converted = manifest.get('converted', {})
+        self.staged = manifest.get('staged', {})
+        self.logger.info('Resuming from checkpoint %s: %d variable(s) converted, %d staged',
+                         self.path, len(self.converted), len(self.staged))
+
+    def _save(self):
+        """Write the manifest atomically, so an interrupted write leaves the
+        previous manifest in place.
+        """
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'input_href': self.input_href,
+            'input_file': self.input_file,
+            'converted': self.converted,
+            'staged': self.staged,
+        }
+        temporary_path = f'{self.path}.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file_handler:
+            json.dump(manifest, file_handler, indent=2)
+            file_handler.flush()
+            os.fsync(file_handler.fileno())
+        os.replace(temporary_path, self.path)
+
+    def downloaded_file(self) -> str | None:
+        """The input file downloaded by a previous attempt, if it exists."""
+        if self.input_file and os.path.isfile(self.input_file):
+            return self.input_file
+        return None
+
+    def record_download(self, input_file: str):
+        """Record the downloaded input file."""
+        with self._lock:
+            self.input_file = input_file
+            self._save()
+
+    def record_converted(self, variable_name: str, output_file: str):
+        """Record the COG converted for a variable, with its checksum. COGs
+        held in scratch memory, rather than in the work directory, do not
+        outlive the worker and are not recorded.
+        """
+        if pathlib.Path(self.directory).resolve() not in pathlib.Path(output_file).resolve().parents:
+            return
+        checksum = file_checksum(output_file, self.checksum_algorithm)
+        with self._lock:
+            self.converted[variable_name] = {'file': output_file, 'checksum': checksum}
+            self._save()
+
+    def converted_file(self, variable_name: str) -> str | None:
+        """
+        The COG converted for a variable by a previous attempt, if the
+        variable has been staged or the file is unchanged. Staged COGs are
+        not needed, so may no longer exist.
+        """
+        converted = self.converted.get(variable_name)
+        if converted is None:
+            return None
+        if self.staged_file(converted['file']) is not None:
+            return converted['file']
+        if not os.path.isfile(converted['file']):
+            return None
+        if file_checksum(converted['file'], self.checksum_algorithm) != converted['checksum']:
+            self.logger.warning('Checksum of %s does not match the checkpoint, converting %s again',
+                                converted['file'], variable_name)
+            return None
+        return converted['file']
+
+    def record_staged(self, output_file: str, staged_file: StagedFile, raster_bands: list[dict]):
+        """Record a staged COG, and the raster bands of its STAC asset."""
+        with self._lock:
+            self.staged[basename(output_file)] = {
+                'url': staged_file.url,
+                'size': staged_file.size,
+                'checksum': staged_file.checksum,
+                'raster_bands': raster_bands,
+            }
+            self._save()
+
+    def staged_file(self, output_file: str) -> tuple[StagedFile, list[dict]] | None:
+        """The staged file and raster bands of a COG staged by a previous
+        attempt.
+        """
+        staged = self.staged.get(basename(output_file))
+        if staged is None:
+            return None
+        return StagedFile(staged['url'], staged['size'], staged['checksum']), staged['raster_bands']
@@ -0,0 +1,233 @@
+"""
+==============
+compression.py
+==============
+
+Choice of the compression of each COG. By default every COG is compressed
+with DEFLATE. In auto mode, a small random sample of tiles from each
+variable is compressed with a few candidate codec, level and predictor
+settings, and the setting that best meets an objective is used for the COG:
+
+* `size`: the smallest tiles, with ties broken by the fastest encode.
+* `encode`: the fastest encode of the settings whose tiles are within a
+  tolerance of the smallest, e.g. no compression for noisy floats that
+  barely compress.
+* `decode`: as `encode`, for the fastest decode.
+
+The chosen setting is written to the COG metadata as `NET2COG_COMPRESSION`,
+and the size and timings of every candidate are logged.
+
+Compression is configured with environment variables:
+
+* `COMPRESSION`: `auto`, or the name of a setting in `SETTINGS` to use for
+  every COG. Defaults to `deflate`.
+* `COMPRESSION_OBJECTIVE`: `size`, `encode` (the default) or `decode`.
+* `COMPRESSION_SAMPLE_TILES`: number of tiles sampled from each variable.
+  Defaults to 8.
+* `COMPRESSION_SIZE_TOLERANCE`: fraction by which the tiles of the `encode`
+  and `decode` objectives may be larger than the smallest. Defaults to 0.1.
+"""
+
+import os
+import time
+import warnings
+from dataclasses import dataclass
+from logging import Logger
+
+import numpy as np
+import rasterio
+from rasterio.errors import NotGeoreferencedWarning
+from rasterio.io import MemoryFile
+from rasterio.windows import Window
+
+COMPRESSION_ENV = 'COMPRESSION'
+COMPRESSION_OBJECTIVE_ENV = 'COMPRESSION_OBJECTIVE'
+COMPRESSION_SAMPLE_TILES_ENV = 'COMPRESSION_SAMPLE_TILES'
+COMPRESSION_SIZE_TOLERANCE_ENV = 'COMPRESSION_SIZE_TOLERANCE'
+
+AUTO = 'auto'
+OBJECTIVES = ['size', 'encode', 'decode']
+METADATA_KEY = 'NET2COG_COMPRESSION'
+
+# The same tiles are sampled from a variable on every run, so a conversion
+# is reproducible
+SAMPLE_SEED = 0
+
+
+@dataclass(frozen=True)
+class CompressionSetting:
+    """A codec, with its level and whether to use a predictor."""
+
+    name: str
+    codec: str
+    level: int | None = None
+    predictor: bool = False
+
+    def _predictor(self, dtype: str) -> int:
+        """Floating point prediction for floats, and horizontal differencing
+        for integers.
+        """
+        return 3 if np.dtype(dtype).kind == 'f' else 2
+
+    def profile(self, dtype: str) -> dict:
+        """Options of the COG driver for this setting. These are also given
+        to the GTiff driver for rio-cogeo's temporary file, which ignores
+        `level`.
+        """
+        options = {'compress': self.codec}
+        if self.level is not None:
+            options['level'] = self.level
+        if self.predictor:
+            options['predictor'] = self._predictor(dtype)
+        return options
+
+    def gtiff_options(self, dtype: str) -> dict:
+        """Options of the GTiff driver for this setting, to compress samples."""
+        options = {'compress': self.codec}
+        if self.level is not None:
+            options['zstd_level' if self.codec == 'ZSTD' else 'zlevel'] = self.level
+        if self.predictor:
+            options['predictor'] = self._predictor(dtype)
+        return options
+
+
+SETTINGS = {setting.name: setting for setting in [
+    CompressionSetting('none', 'NONE'),
+    CompressionSetting('deflate', 'DEFLATE'),
+    CompressionSetting('deflate-predictor', 'DEFLATE', predictor=True),
+    CompressionSetting('zstd-fast', 'ZSTD', level=1),
+    CompressionSetting('zstd-predictor', 'ZSTD', level=9, predictor=True),
+]}
+
+
+@dataclass
+class CompressionConfig:
+    """How to choose the compression of each COG."""
+
+    mode: str = 'deflate'
+    objective: str = 'encode'
+    sample_tiles: int = 8
+    size_tolerance: float = 0.1
+
+    def __post_init__(self):
+        if self.mode != AUTO and self.mode not in SETTINGS:
+            raise ValueError(f'Unknown compression {self.mode}, expected {AUTO} or one of {list(SETTINGS)}')
+        if self.objective not in OBJECTIVES:
+            raise ValueError(f'Unknown compression objective {self.objective}, expected one of {OBJECTIVES}')
+
+    @classmethod
+    def from_environment(cls) -> 'CompressionConfig':
+        """Build the compression configuration from the environment."""
+        defaults = cls()
+        return cls(
+            mode=os.getenv(COMPRESSION_ENV, defaults.mode),
+            objective=os.getenv(COMPRESSION_OBJECTIVE_ENV, defaults.objective),
+            sample_tiles=int(os.getenv(COMPRESSION_SAMPLE_TILES_ENV, str(defaults.sample_tiles))),
+            size_tolerance=float(os.getenv(COMPRESSION_SIZE_TOLERANCE_ENV, str(defaults.size_tolerance))),
+        )
+
+
+@dataclass
+class CandidateResult:
+    """Size and timings of a setting on the sampled tiles."""
+
+    setting: CompressionSetting
+    size: int
+    encode_seconds: float
+    decode_seconds: float
+
+
+def sample_tiles(dataset: rasterio.io.DatasetReader, blocksize: int, count: int) -> np.ndarray:
+    """
+    Read a random sample of the tiles of a dataset, stacked vertically as an
+    array of shape (bands, count * blocksize, blocksize). Tiles on the right
+    and bottom edges are padded with zeros, as they are in a GeoTIFF.
+    """
+    rows = -(-dataset.height // blocksize)
+    columns = -(-dataset.width // blocksize)
+    rng = np.random.default_rng(SAMPLE_SEED)
+    tiles = sorted(rng.choice(rows * columns, size=min(count, rows * columns), replace=False))
+
+    sample = np.zeros((dataset.count, len(tiles) * blocksize, blocksize), dtype=dataset.dtypes[0])
+    for index, tile in enumerate(tiles):
+        window = Window((tile % columns) * blocksize, (tile // columns) * blocksize, blocksize, blocksize)
+        window = window.intersection(Window(0, 0, dataset.width, dataset.height))
+        sample[:, index * blocksize:index * blocksize + window.height, :window.width] = dataset.read(window=window)
+    return sample
+
+
+def _measure(setting: CompressionSetting, sample: np.ndarray) -> CandidateResult:
+    """Compress the sampled tiles as GeoTIFF tiles, and read them back."""
+    bands, height, blocksize = sample.shape
+    with MemoryFile() as memory_file, warnings.catch_warnings():
+        # The sample has no geotransform
+        warnings.simplefilter('ignore', NotGeoreferencedWarning)
+        start = time.perf_counter()
+        with memory_file.open(driver='GTiff', width=blocksize, height=height, count=bands, dtype=sample.dtype,
+                              tiled=True, blockxsize=blocksize, blockysize=blocksize,
+                              **setting.gtiff_options(sample.dtype)) as dataset:
+            dataset.write(sample)
+        encode_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with memory_file.open() as dataset:
+            dataset.read()
+        decode_seconds = time.perf_counter() - start
+
+        return CandidateResult(setting, memory_file.getbuffer().nbytes, encode_seconds, decode_seconds)
+
+
+def choose(results: list[CandidateResult], objective: str, size_tolerance: float) -> CandidateResult:
+    """The result that best meets the objective."""
+    if objective == 'size':
+        return min(results, key=lambda result: (result.size, result.encode_seconds))
+
+    smallest = min(result.size for result in results)
+    acceptable = [result for result in results if result.size <= smallest * (1 + size_tolerance)]
+    return min(acceptable, key=lambda result: getattr(result, f'{objective}_seconds'))
+
+
+def compression_profile(
+    dataset: rasterio.io.DatasetReader,
+    dst_profile: dict,
+    config: CompressionConfig | None,
+    variable_name: str,
+    logger: Logger,
+) -> tuple[dict, dict | None]:
+    """
+    Return the COG profile with the configured compression, and the metadata
+    recording the chosen setting in auto mode.
+
+    Parameters
+    ----------
+    dataset : rasterio.io.DatasetReader
+        Intermediate GeoTIFF of the variable, from which tiles are sampled.
+    dst_profile : dict
+        COG profile, with the COG blocksize.
+    config : CompressionConfig | None
+        Compression configuration. DEFLATE is used when None.
+    variable_name : str
+        Name of the variable, for log messages.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+    config = config or CompressionConfig()
+    dtype = dataset.dtypes[0]
+    if config.mode != AUTO:
+        return {**dst_profile, **SETTINGS[config.mode].profile(dtype)}, None
+
+    sample = sample_tiles(dataset, dst_profile['blockxsize'], config.sample_tiles)
+    raw_size = sample.nbytes
+    results = []
+    for setting in SETTINGS.values():
+        result = _measure(setting, sample)
+        logger.info('Compression %s of %s: %.1f%% of %d sampled bytes, encode %.1f ms, decode %.1f ms',
+                    setting.name, variable_name, 100 * result.size / raw_size, raw_size,
+                    1000 * result.encode_seconds, 1000 * result.decode_seconds)
+        results.append(result)
+
+    chosen = choose(results, config.objective, config.size_tolerance)
+    logger.info('Using compression %s for %s, for the %s objective', chosen.setting.name, variable_name,
+                config.objective)
+    metadata = {METADATA_KEY: chosen.setting.name, f'{METADATA_KEY}_OBJECTIVE': config.objective}
+    return {**dst_profile, **chosen.setting.profile(dtype)}, metadata
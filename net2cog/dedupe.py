@@ -0,0 +1,257 @@
+"""
+=========
+dedupe.py
+=========
+
+Deduplication of variables that are identical in every granule of a
+collection, such as land fraction, ice masks or distance to coast, so their
+COGs are converted and staged once rather than for every granule.
+
+Deduplication is enabled by setting `DEDUPE_INDEX` to the path of a SQLite
+index that outlives the worker process, and `DEDUPE_VARIABLES` to the
+comma-separated variables to deduplicate, as paths or glob patterns such as
+`gland,fland,*/land_mask`. Hashing a variable decodes all of its values, as
+converting it does, so only variables expected to be identical across
+granules should be listed. Before each listed variable is converted, a
+content hash of the variable is computed from:
+
+* its decoded values, read in windows of whole rows of NetCDF chunks of
+  about `statistics.WINDOW_BYTES`, so memory use is bounded;
+* its name, dimensions, data type and attributes, and the coordinates of its
+  dimensions;
+* the service settings that change the COG, such as compression.
+
+If the index has a staged COG for the hash, its STAC asset refers to that COG,
+with its size, checksum and raster bands, and the variable is neither
+converted nor staged. Otherwise the COG is converted, staged and added to the
+index. Entries older than `DEDUPE_MAX_AGE` seconds, e.g. the retention of the
+staging bucket, are not reused.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from fnmatch import fnmatchcase
+from logging import Logger
+from os.path import basename
+from os.path import join as path_join
+
+import numpy as np
+import xarray as xr
+
+from net2cog.netcdf_convert import _split_variable_path, output_basename
+from net2cog.staging import StagedFile
+from net2cog.statistics import WINDOW_BYTES
+
+DEDUPE_INDEX_ENV = 'DEDUPE_INDEX'
+DEDUPE_MAX_AGE_ENV = 'DEDUPE_MAX_AGE'
+DEDUPE_VARIABLES_ENV = 'DEDUPE_VARIABLES'
+
+# Changed when the content hash changes, so older entries are not reused
+HASH_VERSION = 1
+
+
+def dedupe_variables_from_environment() -> list[str]:
+    """The paths or glob patterns of the variables to deduplicate, from
+    `DEDUPE_VARIABLES`.
+    """
+    return [pattern.strip().strip('/') for pattern in os.getenv(DEDUPE_VARIABLES_ENV, '').split(',')
+            if pattern.strip()]
+
+
+def _json_default(value):
+    """Attribute values that are not JSON types, e.g. NumPy arrays."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return repr(value)
+
+
+def content_hash(dataset: xr.Dataset, variable_name: str, settings: str = '') -> str:
+    """
+    Hash of a variable's decoded values and metadata, and the settings of its
+    conversion.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        Dataset of the group containing the variable.
+    variable_name : str
+        Name of the variable, with its group path.
+    settings : str
+        Conversion settings that change the COG.
+    """
+    _, group_variable_name = _split_variable_path(variable_name)
+    variable = dataset[group_variable_name]
+
+    digest = hashlib.blake2b(digest_size=32)
+    digest.update(json.dumps({
+        'version': HASH_VERSION,
+        'name': variable_name,
+        'dims': list(variable.dims),
+        'shape': list(variable.shape),
+        'dtype': str(variable.dtype),
+        'attrs': variable.attrs,
+        'fill_value': variable.encoding.get('_FillValue'),
+        'settings': settings,
+    }, sort_keys=True, default=_json_default).encode())
+    for dim in variable.dims:
+        if dim in dataset.coords:
+            digest.update(np.ascontiguousarray(dataset[dim].values).tobytes())
+
+    # Hash windows of whole rows along the second last dimension, aligned
+    # with the chunks so each chunk is decompressed once
+    if variable.ndim < 2:
+        digest.update(np.ascontiguousarray(variable.values).tobytes())
+        return digest.hexdigest()
+
+    row_dim = variable.dims[-2]
+    chunksizes = variable.encoding.get('chunksizes')
+    chunk_rows = chunksizes[-2] if chunksizes else 1
+    row_bytes = max(1, variable.nbytes // variable.shape[-2])
+    rows = chunk_rows * max(1, WINDOW_BYTES // (row_bytes * chunk_rows))
+    for start in range(0, variable.shape[-2], rows):
+        block = variable.isel({row_dim: slice(start, start + rows)}).values
+        digest.update(np.ascontiguousarray(block).tobytes())
+    return digest.hexdigest()
+
+
+class DedupeIndex:
+    """
+    Persistent index from the content hash of a variable to its staged COG,
+    shared by every worker with access to the index file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite index, created if it does not exist.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    max_age : float | None
+        Seconds after which an entry is not reused, or None to always reuse.
+    """
+
+    def __init__(self, path: str, logger: Logger, max_age: float | None = None):
+        self.path = path
+        self.logger = logger
+        self.max_age = max_age
+        with closing(self._connect()) as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS outputs ('
+                'key TEXT PRIMARY KEY, url TEXT NOT NULL, size INTEGER NOT NULL, checksum TEXT, '
+                'raster_bands TEXT NOT NULL, created REAL NOT NULL)'
+            )
+            connection.commit()
+
+    @classmethod
+    def from_environment(cls, logger: Logger) -> 'DedupeIndex | None':
+        """Open the index at `DEDUPE_INDEX`, or return None if it is not
+        set.
+        """
+        path = os.getenv(DEDUPE_INDEX_ENV)
+        if not path:
+            return None
+        max_age = os.getenv(DEDUPE_MAX_AGE_ENV)
+        return cls(path, logger, max_age=float(max_age) if max_age else None)
+
+    def _connect(self) -> sqlite3.Connection:
+        # A connection per call, as items are processed in threads and
+        # several workers may share the index
+        return sqlite3.connect(self.path, timeout=30)
+
+    def lookup(self, key: str) -> tuple[StagedFile, list[dict]] | None:
+        """The staged COG and raster bands for a content hash, if any."""
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT url, size, checksum, raster_bands, created FROM outputs WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        url, size, checksum, raster_bands, created = row
+        if self.max_age is not None and time.time() - created > self.max_age:
+            return None
+        return StagedFile(url, size, checksum), json.loads(raster_bands)
+
+    def record(self, key: str, staged_file: StagedFile, raster_bands: list[dict]):
+        """Add, or replace, the staged COG for a content hash."""
+        with closing(self._connect()) as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO outputs (key, url, size, checksum, raster_bands, created) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, staged_file.url, staged_file.size, staged_file.checksum, json.dumps(raster_bands),
+                 time.time()),
+            )
+            connection.commit()
+
+
+class GranuleDeduplicator:  # pylint: disable=too-many-instance-attributes
+    """
+    Deduplication of the variables of one granule against the index.
+
+    Parameters
+    ----------
+    index : DedupeIndex
+        The shared index.
+    output_directory : str
+        Work directory of the granule. Reused COGs are returned by the
+        converter as files in this directory, which are not created.
+    settings : str
+        Conversion settings that change the COG.
+    variables : list[str]
+        Paths or glob patterns of the variables to deduplicate. Other
+        variables are not hashed.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, index: DedupeIndex, output_directory: str, settings: str, variables: list[str], logger: Logger
+    ):
+        self.index = index
+        self.output_directory = output_directory
+        self.settings = settings
+        self.variables = variables
+        self.logger = logger
+        self._keys: dict[str, str] = {}
+        self._reused: dict[str, tuple[StagedFile, list[dict]]] = {}
+        self._lock = threading.Lock()
+
+    def existing_output(self, variable_name: str, dataset: xr.Dataset) -> str | None:
+        """Hash a variable before it is converted, and return the output file
+        standing for its COG if an identical COG was staged. Variables that
+        are not deduplicated are not hashed.
+        """
+        if not any(fnmatchcase(variable_name.strip('/'), pattern) for pattern in self.variables):
+            return None
+
+        start = time.perf_counter()
+        key = content_hash(dataset, variable_name, self.settings)
+        cog_basename = output_basename(variable_name)
+        with self._lock:
+            self._keys[cog_basename] = key
+        entry = self.index.lookup(key)
+        self.logger.info('Content hash of %s is %s, computed in %.2f s', variable_name, key,
+                         time.perf_counter() - start)
+        if entry is None:
+            return None
+
+        self.logger.info('%s is identical to %s, which is reused', variable_name, entry[0].url)
+        output_file = path_join(self.output_directory, cog_basename)
+        with self._lock:
+            self._reused[cog_basename] = entry
+        return output_file
+
+    def reused_file(self, output_file: str) -> tuple[StagedFile, list[dict]] | None:
+        """The staged COG and raster bands reused for an output file."""
+        return self._reused.get(basename(output_file))
+
+    def record_staged(self, output_file: str, staged_file: StagedFile, raster_bands: list[dict]):
+        """Add a newly staged COG to the index."""
+        key = self._keys.get(basename(output_file))
+        if key is not None:
+            self.index.record(key, staged_file, raster_bands)
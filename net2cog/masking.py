@@ -0,0 +1,104 @@
+"""
+==========
+masking.py
+==========
+
+Invalid pixels of a variable, derived from its CF `_FillValue`,
+`missing_value`, `valid_min`, `valid_max` and `valid_range` attributes, are
+set to the nodata value of the output COG. They are then excluded from the
+band statistics and from averaged overviews.
+"""
+
+from dataclasses import dataclass
+
+import netCDF4
+import numpy as np
+import rasterio
+import xarray as xr
+
+from net2cog.statistics import row_windows
+
+
+@dataclass
+class Validity:
+    """
+    Which values of a variable are valid, in the units of the intermediate
+    GeoTIFF. Data packed with `scale_factor` and `add_offset` is written
+    packed, which is also the unit of the CF valid range attributes.
+    """
+
+    nodata: float | None
+    valid_min: float | None
+    valid_max: float | None
+    categorical: bool
+
+    @classmethod
+    def from_variable(cls, variable: xr.DataArray) -> 'Validity':
+        """Read the fill value, valid range and flag attributes of a
+        variable, as decoded by xarray.
+        """
+        nodata = variable.encoding.get('_FillValue')
+        if nodata is None:
+            missing_value = variable.encoding.get('missing_value', variable.attrs.get('missing_value'))
+            if missing_value is not None:
+                nodata = np.atleast_1d(missing_value)[0]
+
+        valid_min = variable.attrs.get('valid_min')
+        valid_max = variable.attrs.get('valid_max')
+        if 'valid_range' in variable.attrs:
+            valid_min, valid_max = variable.attrs['valid_range']
+
+        return cls(
+            nodata=None if nodata is None else float(nodata),
+            valid_min=None if valid_min is None else float(valid_min),
+            valid_max=None if valid_max is None else float(valid_max),
+            categorical='flag_values' in variable.attrs or 'flag_masks' in variable.attrs,
+        )
+
+    @property
+    def overview_resampling(self) -> str:
+        """Resampling for overviews. GDAL excludes nodata pixels when
+        averaging, while categorical data must not be averaged.
+        """
+        return 'nearest' if self.categorical else 'average'
+
+
+def apply_mask(dataset: rasterio.io.DatasetWriter, validity: Validity) -> int:
+    """
+    Set the nodata value of a dataset opened for update, and set pixels
+    outside the valid range to nodata. Fill values were already written as
+    the nodata value when the dataset was created.
+
+    Returns
+    -------
+    int
+        The number of pixels set to nodata because they are out of range.
+    """
+    nodata = validity.nodata
+    if nodata is None:
+        if np.issubdtype(np.dtype(dataset.dtypes[0]), np.floating):
+            nodata = float('nan')
+        elif validity.valid_min is not None or validity.valid_max is not None:
+            nodata = netCDF4.default_fillvals[np.dtype(dataset.dtypes[0]).str[1:]]
+    if nodata is not None:
+        dataset.nodata = nodata
+
+    masked = 0
+    if validity.valid_min is None and validity.valid_max is None:
+        return masked
+
+    for band in dataset.indexes:
+        for window in row_windows(dataset):
+            data = dataset.read(band, window=window)
+            invalid = np.zeros(data.shape, dtype=bool)
+            if validity.valid_min is not None:
+                invalid |= data < validity.valid_min
+            if validity.valid_max is not None:
+                invalid |= data > validity.valid_max
+            invalid &= data != nodata
+            if invalid.any():
+                data[invalid] = nodata
+                dataset.write(data, band, window=window)
+                masked += int(invalid.sum())
+
+    return masked
@@ -0,0 +1,425 @@
+"""
+=========
+memmap.py
+=========
+
+Zero-copy reads of uncompressed variables. When a variable is stored
+contiguously and uncompressed, as every variable of a classic NetCDF-3 file
+and contiguous NetCDF-4 variables are, its bytes in the file are already the
+raster. Such variables are mapped with `numpy.memmap` and the intermediate
+GeoTIFF is written from the map, one block of rows at a time, rather than
+read through the netCDF4 library, decoded by xarray and encoded again by
+rioxarray.
+
+* NetCDF-3 (classic, 64-bit offset and CDF-5) headers are parsed here, so
+  the offset, shape and big-endian type of each variable are known. Record
+  variables, whose records are interleaved, are mapped with a stride of one
+  record.
+* NetCDF-4 variables are located with h5py, an optional dependency. Chunked,
+  compressed and unallocated variables are not mapped.
+
+The grid is normalized as for other reads, see `normalize.py`: flipped rows
+are a view of the map and wrapped longitudes are written as two column
+windows. A block is only copied if it has NaN, which xarray masks and writes
+as the fill value, so the GeoTIFF is the same as the one written through
+xarray.
+"""
+
+import struct
+from dataclasses import dataclass
+from os.path import getsize
+
+import numpy as np
+import rasterio
+import xarray as xr
+from rasterio.windows import Window
+from rioxarray.exceptions import DimensionError
+
+from net2cog.normalize import GridLayout
+from net2cog.statistics import WINDOW_BYTES
+
+# Attributes `rio.to_raster` writes elsewhere than the dataset tags, or not
+# at all
+UNWRITTEN_ATTRIBUTES = (
+    'nodatavals', 'is_tiled', 'res', '_FillValue', 'missing_value', 'fill_value', 'nodata', 'crs', 'transform',
+    'scales', 'scale_factor', 'add_offset', 'offsets', 'grid_mapping',
+)
+
+NETCDF3_MAGIC = b'CDF'
+HDF5_MAGIC = b'\x89HDF\r\n\x1a\n'
+
+# NetCDF-3 external types, all big-endian. Characters are not mapped.
+NETCDF3_TYPES = {1: 'i1', 3: '>i2', 4: '>i4', 5: '>f4', 6: '>f8', 7: 'u1', 8: '>u2', 9: '>u4', 10: '>i8', 11: '>u8'}
+NETCDF3_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8, 7: 1, 8: 2, 9: 4, 10: 8, 11: 8}
+
+_ABSENT, _NC_DIMENSION, _NC_VARIABLE, _NC_ATTRIBUTE = 0, 10, 11, 12
+_STREAMING = 0xFFFFFFFF
+
+
+class _Netcdf3Header:
+    """
+    Reader of a NetCDF-3 header. Counts are 32-bit, except in CDF-5 where
+    they are 64-bit, and variable offsets are 32-bit in the classic format
+    only.
+    """
+
+    def __init__(self, buffer: np.ndarray):
+        self.buffer = buffer
+        self.version = int(buffer[3])
+        self.position = 4
+
+    def _unpack(self, fmt: str) -> int:
+        value, = struct.unpack_from(fmt, self.buffer, self.position)
+        self.position += struct.calcsize(fmt)
+        return value
+
+    def int32(self) -> int:
+        """A 32-bit tag or type."""
+        return self._unpack('>I')
+
+    def count(self) -> int:
+        """A count, length or size."""
+        return self._unpack('>Q' if self.version == 5 else '>I')
+
+    def offset(self) -> int:
+        """The offset of a variable's data."""
+        return self._unpack('>I' if self.version == 1 else '>Q')
+
+    def name(self) -> str:
+        """A name, padded to 4 bytes."""
+        length = self.count()
+        name = bytes(self.buffer[self.position:self.position + length]).decode('utf-8')
+        self.position += -(-length // 4) * 4
+        return name
+
+    def skip_attributes(self):
+        """Skip a list of attributes, which are read by xarray."""
+        tag, count = self.int32(), self.count()
+        if tag not in (_ABSENT, _NC_ATTRIBUTE):
+            raise ValueError(f'Unexpected attribute tag {tag}')
+        for _ in range(count):
+            self.name()
+            nc_type, length = self.int32(), self.count()
+            self.position += -(-length * NETCDF3_TYPE_SIZES[nc_type] // 4) * 4
+
+
+def _netcdf3_variables(header: _Netcdf3Header) -> list[tuple[str, list[int], int, int, int]]:
+    """The name, dimension lengths, type, size and offset of each variable
+    in a NetCDF-3 header. Record dimensions have length 0.
+    """
+    tag, count = header.int32(), header.count()
+    if tag not in (_ABSENT, _NC_DIMENSION):
+        raise ValueError(f'Unexpected dimension tag {tag}')
+    dim_lengths = []
+    for _ in range(count):
+        header.name()
+        dim_lengths.append(header.count())
+    header.skip_attributes()
+
+    variables = []
+    tag, count = header.int32(), header.count()
+    if tag not in (_ABSENT, _NC_VARIABLE):
+        raise ValueError(f'Unexpected variable tag {tag}')
+    for _ in range(count):
+        name = header.name()
+        dim_ids = [header.count() for _ in range(header.count())]
+        header.skip_attributes()
+        nc_type, vsize, begin = header.int32(), header.count(), header.offset()
+        variables.append((name, [dim_lengths[dim_id] for dim_id in dim_ids], nc_type, vsize, begin))
+    return variables
+
+
+def _record_size(record_variables: list[tuple[str, list[int], int, int, int]]) -> int:
+    """Size of a record, one record of every record variable, each padded to
+    4 bytes unless there is a single record variable.
+    """
+    if len(record_variables) == 1:
+        _, shape, nc_type, _, _ = record_variables[0]
+        return int(np.prod(shape[1:], dtype=np.int64)) * NETCDF3_TYPE_SIZES[nc_type]
+    return sum(variable[3] for variable in record_variables)
+
+
+def _netcdf3_arrays(path: str) -> dict[str, np.ndarray]:
+    """Memory map the numeric variables of a NetCDF-3 file."""
+    buffer = np.memmap(path, dtype='u1', mode='r')
+    header = _Netcdf3Header(buffer)
+    numrecs = header.count()
+    variables = _netcdf3_variables(header)
+
+    record_variables = [variable for variable in variables if variable[1] and variable[1][0] == 0]
+    record_size = _record_size(record_variables)
+    if numrecs == _STREAMING and record_variables:
+        numrecs = (getsize(path) - min(variable[4] for variable in record_variables)) // max(record_size, 1)
+
+    arrays = {}
+    for name, shape, nc_type, _, begin in variables:
+        if nc_type not in NETCDF3_TYPES:
+            continue
+        dtype = np.dtype(NETCDF3_TYPES[nc_type])
+        record = bool(shape) and shape[0] == 0
+        if record:
+            shape = [numrecs] + shape[1:]
+        if not np.prod(shape, dtype=np.int64):
+            continue
+        strides = [dtype.itemsize * int(np.prod(shape[index + 1:], dtype=np.int64)) for index in range(len(shape))]
+        if record:
+            # Records of a variable are interleaved with the other record
+            # variables
+            strides[0] = record_size
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buffer, offset=begin, strides=strides)
+    return arrays
+
+
+def _netcdf4_array(path: str, group_path: str, variable_name: str) -> np.ndarray | None:
+    """Memory map a contiguous, uncompressed variable of a NetCDF-4 file."""
+    try:
+        import h5py  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+
+    with h5py.File(path, 'r') as root:
+        dataset = root.get(f'{group_path.rstrip("/")}/{variable_name}')
+        if not isinstance(dataset, h5py.Dataset) or dataset.chunks is not None or dataset.external:
+            return None
+        offset = dataset.id.get_offset()
+        dtype, shape = dataset.dtype, dataset.shape
+    if offset is None or dtype.kind not in 'iuf':
+        return None
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+
+def mapped_array(path: str, group_path: str, variable_name: str) -> np.ndarray | None:
+    """
+    Memory map a variable as it is stored in a NetCDF file.
+
+    Parameters
+    ----------
+    path : str
+        Path of a NetCDF-3 or NetCDF-4 file.
+    group_path : str
+        Path of the group of the variable, `/` for the root group.
+    variable_name : str
+        Name of the variable in its group.
+
+    Returns
+    -------
+    numpy.ndarray | None
+        A read-only view of the variable's bytes in the file, with the
+        file's byte order, or None if the variable is not stored contiguously
+        and uncompressed.
+    """
+    with open(path, 'rb') as file_handler:
+        magic = file_handler.read(8)
+
+    if magic.startswith(NETCDF3_MAGIC) and magic[3] in (1, 2, 5):
+        if group_path != '/':
+            return None
+        try:
+            return _netcdf3_arrays(path).get(variable_name)
+        except (ValueError, KeyError, IndexError, struct.error):
+            # A header this parser does not understand, read through xarray
+            return None
+    if magic == HDF5_MAGIC:
+        return _netcdf4_array(path, group_path, variable_name)
+    return None
+
+
+@dataclass
+class MappedVariable:
+    """
+    A memory mapped variable, and how its grid is normalized.
+
+    Attributes
+    ----------
+    array : numpy.ndarray
+        The variable as stored, of shape ([bands,] rows, columns).
+    flip : bool
+        Whether rows are stored south to north.
+    wrap_shift : int
+        Number of columns east of the antimeridian, moved to the west.
+    """
+
+    array: np.ndarray
+    flip: bool = False
+    wrap_shift: int = 0
+
+    @classmethod
+    def from_variable(cls, array: np.ndarray, variable: xr.DataArray,
+                      layout: GridLayout) -> 'MappedVariable | None':
+        """
+        The mapped variable for the array of a variable, as stored, if it
+        can be written as xarray would write it.
+
+        Parameters
+        ----------
+        array : numpy.ndarray
+            Array returned by `mapped_array`.
+        variable : xarray.DataArray
+            The variable as opened by xarray, before normalization.
+        layout : net2cog.normalize.GridLayout
+            Layout of the variable's group.
+        """
+        dims = variable.dims
+        if (array.shape != variable.shape or variable.ndim not in (2, 3)
+                or '_Unsigned' in variable.encoding
+                or np.dtype(variable.encoding.get('dtype', array.dtype)) != array.dtype.newbyteorder('=')):
+            return None
+        fill_value, missing_values = variable.encoding.get('_FillValue'), variable.encoding.get('missing_value')
+        if fill_value is not None and missing_values is not None and \
+                not np.all(np.atleast_1d(missing_values) == fill_value):
+            # Values xarray would mask and cannot write back
+            return None
+        if (layout.flip_dim in dims and layout.flip_dim != dims[-2]) or \
+                (layout.wrap_dim in dims and layout.wrap_dim != dims[-1]):
+            return None
+
+        return cls(
+            array=array,
+            flip=layout.flip_dim == dims[-2],
+            wrap_shift=layout.wrap_shift if layout.wrap_dim == dims[-1] else 0,
+        )
+
+    def rows(self, start: int, stop: int) -> np.ndarray:
+        """Rows `start:stop` of the normalized grid, as a view of the map."""
+        height = self.array.shape[-2]
+        stop = min(stop, height)
+        if not self.flip:
+            return self.array[..., start:stop, :]
+        return self.array[..., height - stop:height - start, :][..., ::-1, :]
+
+    def columns(self) -> list[tuple[int, int, int]]:
+        """The first column of the normalized grid, first stored column and
+        number of columns of each contiguous range of columns. Columns west
+        of the antimeridian come from the east of the stored grid.
+        """
+        width = self.array.shape[-1]
+        if not self.wrap_shift:
+            return [(0, 0, width)]
+        return [(0, width - self.wrap_shift, self.wrap_shift), (self.wrap_shift, 0, width - self.wrap_shift)]
+
+
+def _fill_value(variable: xr.DataArray):
+    """The value xarray writes for masked pixels, if any."""
+    fill_value = variable.encoding.get('_FillValue')
+    if fill_value is None and variable.encoding.get('missing_value') is not None:
+        fill_value = np.atleast_1d(variable.encoding['missing_value'])[0]
+    return fill_value
+
+
+def write_block(dataset, data: np.ndarray, window: Window, fill_value=None):
+    """Write a block, copied only if it has NaN, which xarray writes as the
+    fill value.
+    """
+    if fill_value is not None and np.issubdtype(data.dtype, np.floating) and not np.isnan(fill_value):
+        nan = np.isnan(data)
+        if nan.any():
+            data = np.where(nan, np.asarray(fill_value, dtype=data.dtype), data)
+
+    if data.ndim == 2:
+        dataset.write(data, 1, window=window)
+    else:
+        dataset.write(data, window=window)
+
+
+def raster_profile(variable: xr.DataArray, shape: tuple[int, ...], dtype: np.dtype,
+                   blockysize: int | None) -> dict | None:
+    """The profile `rio.to_raster` creates the GeoTIFF of a variable with,
+    given the shape and data type it is written with, or None if it does not
+    have spatial dimensions rioxarray recognizes.
+    """
+    try:
+        if variable.dims[-2:] != (variable.rio.y_dim, variable.rio.x_dim):
+            return None
+        transform = variable.rio.transform(recalc=True)
+    except DimensionError:
+        return None
+
+    profile = {
+        'driver': 'GTiff',
+        'height': shape[-2],
+        'width': shape[-1],
+        'count': 1 if len(shape) == 2 else shape[0],
+        'dtype': np.dtype(dtype).newbyteorder('=').name,
+        'crs': variable.rio.crs,
+        'transform': transform,
+        'nodata': variable.rio.encoded_nodata if variable.rio.encoded_nodata is not None else variable.rio.nodata,
+    }
+    if blockysize:
+        profile['blockysize'] = blockysize
+    return profile
+
+
+def write_metadata(dataset: rasterio.io.DatasetWriter, variable: xr.DataArray):
+    """Write the scales, offsets, tags and band descriptions `rio.to_raster`
+    writes for a variable, so the GeoTIFF is the same.
+    """
+    attrs = dict(variable.attrs)
+    scales = attrs.get('scales')
+    if scales is None:
+        scale_factor = attrs.get('scale_factor', variable.encoding.get('scale_factor'))
+        scales = None if scale_factor is None else (scale_factor,) * dataset.count
+    if scales is not None:
+        dataset.scales = scales
+    offsets = attrs.get('offsets')
+    if offsets is None:
+        add_offset = attrs.get('add_offset', variable.encoding.get('add_offset'))
+        offsets = None if add_offset is None else (add_offset,) * dataset.count
+    if offsets is not None:
+        dataset.offsets = offsets
+
+    band_tags = attrs.pop('band_tags', [])
+    long_name = attrs.get('long_name')
+    skipped = UNWRITTEN_ATTRIBUTES + (() if isinstance(long_name, str) else ('long_name',))
+    dataset.update_tags(**{key: value for key, value in attrs.items() if key not in skipped})
+    for band, tags in enumerate(band_tags if isinstance(band_tags, list) else [], start=1):
+        dataset.update_tags(band, **tags)
+
+    if isinstance(long_name, (tuple, list)):
+        descriptions = list(long_name)
+    else:
+        descriptions = [long_name or variable.name] * dataset.count
+    for band, description in enumerate(descriptions, start=1):
+        if description:
+            dataset.set_band_description(band, str(description))
+
+
+def write_raster(variable: xr.DataArray, mapped: MappedVariable, raster_file: str,
+                 blockysize: int | None = None) -> bool:
+    """
+    Write the intermediate GeoTIFF of a variable from its memory map, as
+    `rio.to_raster` would write it.
+
+    Parameters
+    ----------
+    variable : xarray.DataArray
+        The normalized variable, for its coordinates and metadata.
+    mapped : MappedVariable
+        The variable's memory map.
+    raster_file : str
+        Path of the GeoTIFF.
+    blockysize : int | None
+        Rows of each strip of the GeoTIFF, and of each block written, e.g.
+        one row of chunks. Blocks of about `WINDOW_BYTES` if None.
+
+    Returns
+    -------
+    bool
+        False if the variable does not have spatial dimensions rioxarray
+        recognizes, in which case nothing is written.
+    """
+    profile = raster_profile(variable, mapped.array.shape, mapped.array.dtype, blockysize)
+    if profile is None:
+        return False
+
+    rows = blockysize or max(1, WINDOW_BYTES // max(1, mapped.array[..., :1, :].nbytes))
+    fill_value = _fill_value(variable)
+
+    with rasterio.open(raster_file, 'w', **profile) as dataset:
+        write_metadata(dataset, variable)
+        for row in range(0, profile['height'], rows):
+            block = mapped.rows(row, row + rows)
+            for column, source, width in mapped.columns():
+                window = Window(column, row, width, block.shape[-2])
+                write_block(dataset, block[..., source:source + width], window, fill_value)
+
+    return True
@@ -7,22 +7,56 @@ netcdf-convert.py
 Functions related to converting a NetCDF file to other formats.
 """
 
+import argparse
+import json
 import os
 import pathlib
-from logging import Logger
-from os.path import join as path_join, basename
-from tempfile import TemporaryDirectory
-from typing import List
-
+import sys
+import threading
+from dataclasses import asdict, dataclass, field
+from logging import Logger, getLogger
+from os.path import basename
+from typing import Callable, List
+
+import netCDF4
+import numpy as np
 import rasterio
 import rioxarray  # noqa
 import xarray as xr
 from rasterio import CRS
+from rasterio.windows import Window
 from rio_cogeo.cogeo import cog_translate
 from rio_cogeo.profiles import cog_profiles
 from rioxarray.exceptions import DimensionError
+from xarray.conventions import encode_cf_variable
+
+from net2cog.compression import CompressionConfig, compression_profile
+from net2cog.masking import Validity, apply_mask
+from net2cog.memmap import MappedVariable, mapped_array, raster_profile, write_block, write_metadata, write_raster
+from net2cog.normalize import FLIPPED_ENCODING, GridLayout, normalize_grid
+from net2cog.overviews import RESAMPLING_NAMES, OverviewConfig, write_cog
+from net2cog.profiling import ProfileConfig, profile
+from net2cog.quantize import QuantizeConfig, quantize
+from net2cog.quicklook import QuicklookConfig, quicklook_file, write_quicklook
+from net2cog.scratch import ScratchSpace
+from net2cog.sparse import sparse_profile
+from net2cog.statistics import DEFAULT_HISTOGRAM_BINS, write_statistics
+from net2cog.swath import SwathGridConfig, grid_swath, gridded_dtype, swath_coordinates
+from net2cog.zarr_input import group_paths, is_zarr_input, open_group, zarr_store
 
 EXCLUDE_VARS = ['lon', 'lat', 'longitude', 'latitude', 'time']
+SPATIAL_DIMS = [('lon', 'lat'), ('longitude', 'latitude'), ('x', 'y')]
+
+# Range of COG blocksizes that are aligned with NetCDF chunks. GeoTIFF tiles
+# must be multiples of 16 pixels, and the COG driver only writes square tiles.
+MIN_ALIGNED_BLOCKSIZE = 64
+MAX_ALIGNED_BLOCKSIZE = 1024
+
+# The HDF5 library is not thread-safe, so all access to NetCDF files is
+# serialized. Reentrant, as xarray reads coordinates while opening a file.
+# When granules are converted concurrently, NetCDF reads and decoding remain
+# serial across threads; only GeoTIFF/COG encoding and staging overlap.
+NETCDF_LOCK = threading.RLock()
 
 
 class Net2CogError(Exception):
@@ -36,19 +70,572 @@ class Net2CogError(Exception):
         )
 
 
+@dataclass
+class VariablePlan:
+    """
+    Metadata for one variable of a NetCDF file, and whether it can be
+    converted to a COG.
+
+    Attributes
+    ----------
+    name : str
+        Full path of the variable, e.g. `sss_smap` or `data_01/ku/ssha`.
+    shape : list[int]
+        Shape of the variable, empty if it was not found. Swath variables
+        have the shape of the swath, as their grid is only computed when
+        they are converted.
+    dtype : str | None
+        Decoded data type of the variable, gridded if it is a swath
+        variable.
+    chunks : list[int] | None
+        Chunk shape of the variable in the NetCDF file, None if contiguous.
+    estimated_bytes : int
+        Estimated size of the output COG before compression, including
+        overviews.
+    found : bool
+        Whether the variable exists in the file.
+    skip_reason : str | None
+        Why the variable will not be converted, None if it will be.
+    """
+
+    name: str
+    shape: list[int] = field(default_factory=list)
+    dtype: str | None = None
+    chunks: list[int] | None = None
+    estimated_bytes: int = 0
+    found: bool = True
+    skip_reason: str | None = None
+
+
+@dataclass
+class ConversionPlan:
+    """
+    The variables of a NetCDF file that were requested for conversion, as
+    returned by `inspect`. A plan can be passed to `netcdf_converter` so that
+    variables are not discovered and checked again.
+    """
+
+    input_file: str
+    variables: list[VariablePlan]
+
+    @property
+    def convertible_variables(self) -> list[str]:
+        """Names of the variables that will be converted."""
+        return [variable.name for variable in self.variables if variable.skip_reason is None]
+
+    @property
+    def estimated_bytes(self) -> int:
+        """Estimated total size of the output COGs before compression."""
+        return sum(variable.estimated_bytes for variable in self.variables if variable.skip_reason is None)
+
+    def to_json(self) -> str:
+        """Serialize the plan to JSON."""
+        return json.dumps(asdict(self), indent=2)
+
+    @classmethod
+    def from_json(cls, plan_json: str) -> 'ConversionPlan':
+        """Deserialize a plan written by `to_json`."""
+        plan_dict = json.loads(plan_json)
+        return cls(
+            input_file=plan_dict['input_file'],
+            variables=[VariablePlan(**variable) for variable in plan_dict['variables']],
+        )
+
+
+class _GroupDatasets:
+    """
+    Lazily opened `xarray.Dataset` objects for the groups of a NetCDF-4 file.
+
+    Each group is only opened the first time one of its variables is
+    requested. Dimensions that a group inherits from an ancestor group are
+    resolved to the ancestor's coordinate variables once, when the group is
+    opened, so that every variable in the group shares the same coordinates.
+    Swath groups, with 2D latitude and longitude variables, are gridded, see
+    `swath.py`. The grid of each group is then normalized, see `normalize.py`.
+
+    Files are opened, read and closed while holding `NETCDF_LOCK`, allowing
+    several files to be converted concurrently. Kerchunk reference files and
+    Zarr stores are opened with the zarr engine instead, see `zarr_input.py`.
+    Variables stored contiguously and uncompressed can also be memory mapped,
+    see `memmap.py`.
+    """
+
+    def __init__(self, netcdf_file: str, logger: Logger, swath_grid: SwathGridConfig | None = None):
+        self._netcdf_file = netcdf_file
+        self._logger = logger
+        self._swath_grid = swath_grid or SwathGridConfig()
+        self._zarr_store = zarr_store(netcdf_file) if is_zarr_input(netcdf_file) else None
+        self._raw_datasets: dict[str, xr.Dataset] = {}
+        self._datasets: dict[str, xr.Dataset] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Close every group dataset that has been opened."""
+        with NETCDF_LOCK:
+            for dataset in self._raw_datasets.values():
+                dataset.close()
+        self._raw_datasets.clear()
+        self._datasets.clear()
+
+    def open(self, group_path: str) -> xr.Dataset:
+        """Return the dataset for the group, opening it if needed. The grid
+        is normalized to north-up in -180..180 once, for all variables of
+        the group.
+        """
+        if group_path not in self._datasets:
+            dataset = self._open_raw(group_path)
+            coordinates = self.swath(group_path)
+            if coordinates is not None:
+                try:
+                    dataset = grid_swath(dataset, coordinates, self._swath_grid, self._logger)
+                except ValueError as error:
+                    raise Net2CogError(group_path, f'cannot grid swath: {error}') from error
+            self._datasets[group_path] = normalize_grid(dataset, self._logger)
+
+        return self._datasets[group_path]
+
+    @property
+    def swath_grid(self) -> SwathGridConfig:
+        """The gridding of swath groups."""
+        return self._swath_grid
+
+    def swath(self, group_path: str) -> tuple[str, str] | None:
+        """The 2D latitude and longitude variables of a swath group, found
+        from the dimensions of the group without reading its coordinates, or
+        None if the group is not a swath.
+        """
+        dataset = self._open_raw(group_path)
+        if _has_spatial_dims(dataset.dims):
+            return None
+        return swath_coordinates(dataset)
+
+    def stored(self, group_path: str) -> xr.Dataset:
+        """Return the dataset for the group as stored in the file, before
+        any gridding or normalization.
+        """
+        return self._open_raw(group_path)
+
+    def _open_raw(self, group_path: str) -> xr.Dataset:
+        """Return the dataset for the group as stored in the file."""
+        if group_path not in self._raw_datasets:
+            self._logger.debug("Opening group %s", group_path)
+            try:
+                if self._zarr_store is not None:
+                    dataset = open_group(self._zarr_store, group_path)
+                else:
+                    with NETCDF_LOCK:
+                        dataset = xr.open_dataset(
+                            self._netcdf_file,
+                            group=None if group_path == '/' else group_path,
+                            lock=NETCDF_LOCK,
+                        )
+            except OSError as error:
+                raise Net2CogError(group_path, f'cannot open group: {error}') from error
+
+            if group_path != '/':
+                dataset = self._resolve_coordinates(group_path, dataset)
+            self._raw_datasets[group_path] = dataset
+
+        return self._raw_datasets[group_path]
+
+    def _resolve_coordinates(self, group_path: str, dataset: xr.Dataset) -> xr.Dataset:
+        """Attach coordinate variables, defined in ancestor groups, for any
+        dimensions of the group that do not have one of their own. These are
+        the ancestor's coordinates as stored, before normalization.
+        """
+        missing_dims = [dim for dim in dataset.dims if dim not in dataset.coords]
+        inherited = {}
+        ancestor = group_path
+        while missing_dims and ancestor != '/':
+            ancestor = _parent_group(ancestor)
+            ancestor_dataset = self._open_raw(ancestor)
+            for dim in list(missing_dims):
+                if dim in ancestor_dataset.coords and ancestor_dataset.sizes[dim] == dataset.sizes[dim]:
+                    inherited[dim] = ancestor_dataset.coords[dim]
+                    missing_dims.remove(dim)
+
+        return dataset.assign_coords(inherited) if inherited else dataset
+
+    def mapped(self, variable_path: str) -> MappedVariable | None:
+        """The memory map of a variable stored contiguously and uncompressed,
+        or None if it is read through xarray.
+        """
+        if self._zarr_store is not None:
+            return None
+        group_path, variable_name = _split_variable_path(variable_path)
+        dataset = self._open_raw(group_path)
+        # Swath variables are gridded
+        if variable_name not in dataset.data_vars or not _has_spatial_dims(dataset.dims):
+            return None
+        with NETCDF_LOCK:
+            array = mapped_array(self._netcdf_file, group_path, variable_name)
+        if array is None:
+            return None
+        return MappedVariable.from_variable(array, dataset[variable_name], GridLayout.detect(dataset, self._logger))
+
+    def all_variables(self) -> list[str]:
+        """
+        Paths of all data variables in groups with spatial dimensions. Root
+        group variables are returned unqualified, nested ones as
+        `group/subgroup/variable`.
+        """
+        if self._zarr_store is not None:
+            variable_groups = group_paths(self._zarr_store)
+        else:
+            with NETCDF_LOCK, netCDF4.Dataset(self._netcdf_file) as root:
+                variable_groups = [group.path for group in _walk_groups(root) if group.variables]
+
+        variable_paths = []
+        for group_path in variable_groups:
+            dataset = self._open_raw(group_path)
+            if not _has_spatial_dims(dataset.dims) and swath_coordinates(dataset) is None:
+                self._logger.info("Skipping group %s without spatial dimensions", group_path)
+            else:
+                prefix = group_path.strip('/')
+                variable_paths.extend(
+                    f'{prefix}/{name}' if prefix else str(name)
+                    for name in dataset.data_vars.keys()
+                )
+
+        return variable_paths
+
+
+def _walk_groups(group: netCDF4.Group):
+    """Yield the group and all of its descendants, depth first."""
+    yield group
+    for child in group.groups.values():
+        yield from _walk_groups(child)
+
+
+def _parent_group(group_path: str) -> str:
+    parent = group_path.rstrip('/').rsplit('/', 1)[0]
+    return parent if parent else '/'
+
+
+def _split_variable_path(variable_path: str) -> tuple[str, str]:
+    """
+    Split a group-qualified variable path, e.g. `data_01/ku/ssha`, into the
+    group path (`/data_01/ku`) and the variable name (`ssha`). Variables
+    without a group are in the root group, `/`.
+    """
+    group_path, _, variable_name = variable_path.strip('/').rpartition('/')
+    return f'/{group_path}', variable_name
+
+
+def output_basename(variable_name: str) -> str:
+    """The file name of the COG of a variable, `<variable name>.tif` with any
+    slashes replaced with underscores.
+    """
+    return f'{variable_name.strip("/")}.tif'.replace('/', '_')
+
+
+def _has_spatial_dims(dims) -> bool:
+    return any(set(spatial_dims).issubset(set(dims)) for spatial_dims in SPATIAL_DIMS)
+
+
+def _plan_swath_variable(group_datasets: _GroupDatasets, variable_path: str,
+                         coordinates: tuple[str, str]) -> VariablePlan:
+    """Describe a variable of a swath group from its metadata as stored.
+    Gridding the group reads its 2D coordinates to compute the grid, so it is
+    left to the conversion.
+    """
+    group_path, variable_name = _split_variable_path(variable_path)
+    xds = group_datasets.stored(group_path)
+    if variable_name not in xds.variables:
+        return VariablePlan(variable_path, found=False, skip_reason=repr(variable_name))
+
+    variable = xds[variable_name]
+    variable_plan = VariablePlan(
+        variable_path,
+        shape=list(variable.shape),
+        dtype=str(gridded_dtype(variable.dtype, group_datasets.swath_grid.method_for(variable))),
+        chunks=list(variable.encoding['chunksizes']) if variable.encoding.get('chunksizes') else None,
+        # Estimated from the swath, which is about the size of its grid
+        estimated_bytes=variable.size * variable.dtype.itemsize * 4 // 3,
+    )
+
+    if variable_name in EXCLUDE_VARS or variable_name in coordinates:
+        variable_plan.skip_reason = 'excluded coordinate variable'
+    elif variable.dims != xds[coordinates[0]].dims:
+        variable_plan.skip_reason = f'variable dimensions {variable.dims} are not the swath dimensions'
+
+    return variable_plan
+
+
+def _plan_variable(group_datasets: _GroupDatasets, variable_path: str) -> VariablePlan:
+    """Describe a variable using only the file metadata, and decide whether
+    it can be converted.
+    """
+    group_path, variable_name = _split_variable_path(variable_path)
+
+    try:
+        coordinates = group_datasets.swath(group_path)
+        if coordinates is not None:
+            return _plan_swath_variable(group_datasets, variable_path, coordinates)
+        # Opening a group is lazy: only coordinate variables are read
+        xds = group_datasets.open(group_path)
+        variable = xds[variable_name]
+    except (Net2CogError, KeyError) as error:
+        return VariablePlan(variable_path, found=False, skip_reason=str(error))
+
+    variable_plan = VariablePlan(
+        variable_path,
+        shape=list(variable.shape),
+        dtype=str(variable.dtype),
+        chunks=list(variable.encoding['chunksizes']) if variable.encoding.get('chunksizes') else None,
+        # The COG, with overviews, is estimated at 4/3 the size of the raw data.
+        estimated_bytes=variable.size * variable.dtype.itemsize * 4 // 3,
+    )
+
+    if variable_name in EXCLUDE_VARS:
+        variable_plan.skip_reason = 'excluded coordinate variable'
+    elif not _has_spatial_dims(xds.dims):
+        variable_plan.skip_reason = f'group {group_path} does not contain spatial dimensions'
+    elif not _has_spatial_dims(variable.dims):
+        variable_plan.skip_reason = f'variable dimensions {variable.dims} are not spatial'
+
+    return variable_plan
+
+
+def _build_plan(netcdf_file: str, group_datasets: _GroupDatasets, var_list: list[str]) -> ConversionPlan:
+    if not var_list:
+        # Empty list means "all" variables, so get all variables in
+        # every group of the file that has spatial dimensions.
+        var_list = group_datasets.all_variables()
+
+    return ConversionPlan(
+        input_file=netcdf_file,
+        variables=[_plan_variable(group_datasets, variable_path) for variable_path in var_list],
+    )
+
+
+def inspect(input_nc_file: pathlib.Path, var_list: list[str], logger: Logger,
+            swath_grid: SwathGridConfig | None = None) -> ConversionPlan:
+    """
+    Determine which variables of a NetCDF file can be converted to COGs,
+    reading only the file metadata.
+
+    Parameters
+    ----------
+    input_nc_file : pathlib.Path
+        Path to NetCDF file to inspect, or a kerchunk reference file or Zarr
+        store, see `zarr_input.py`.
+    var_list : list[str]
+        Variables to inspect, as for `netcdf_converter`. If this list is
+        empty, all variables are inspected.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    swath_grid : net2cog.swath.SwathGridConfig | None
+        Gridding of swath variables, which determines their data type.
+        Swath coordinates are not read, so swath variables are planned with
+        the shape of the swath.
+
+    Returns
+    -------
+    ConversionPlan
+        The shape, data type, chunking and estimated output size of each
+        variable, and the reason for skipping any that cannot be converted.
+    """
+    netcdf_file = os.path.abspath(input_nc_file)
+    logger.info("Inspecting %s", basename(netcdf_file))
+
+    with _GroupDatasets(netcdf_file, logger, swath_grid) as group_datasets:
+        return _build_plan(netcdf_file, group_datasets, var_list)
+
+
+def _aligned_blocksize(chunksizes) -> int | None:
+    """
+    Return the largest COG blocksize that evenly divides the NetCDF chunks of
+    the two spatial dimensions, so that no COG tile spans a chunk boundary.
+    Returns None if the variable is not chunked, or its chunks cannot be
+    tiled between `MIN_ALIGNED_BLOCKSIZE` and `MAX_ALIGNED_BLOCKSIZE`.
+    """
+    if not chunksizes or len(chunksizes) < 2:
+        return None
+
+    chunk_y, chunk_x = chunksizes[-2:]
+    if chunk_y % 16 or chunk_x % 16:
+        return None
+
+    blocksize = MAX_ALIGNED_BLOCKSIZE
+    while blocksize >= MIN_ALIGNED_BLOCKSIZE:
+        if chunk_y % blocksize == 0 and chunk_x % blocksize == 0:
+            return blocksize
+        blocksize //= 2
+
+    return None
+
+
+def _tiling(variable: xr.DataArray, logger: Logger) -> tuple[dict, dict, int]:
+    """
+    Return the `to_raster` options for the intermediate GeoTIFF and the COG
+    profile for a variable, with tiles aligned to its NetCDF chunks if
+    possible, and the rows of the first window of chunks. The first window is
+    shorter than a chunk if the variable was flipped to north-up and its
+    height is not a multiple of the chunk height, as the last stored chunk
+    row is then partial. Otherwise it is 0, for windows of whole chunks from
+    the first row.
+    """
+    dst_profile = cog_profiles.get("deflate")
+    chunksizes = variable.encoding.get('chunksizes')
+    blocksize = _aligned_blocksize(chunksizes)
+    if blocksize is None:
+        return {}, dst_profile, 0
+
+    # Write the intermediate GeoTIFF one row of NetCDF chunks at a time, so
+    # each chunk is decompressed once and only one row of chunks is held in
+    # memory. COG tiles then never span a chunk boundary, unless the rows
+    # were flipped.
+    logger.info("Using %d pixel COG tiles aligned with NetCDF chunks %s", blocksize, chunksizes)
+    dst_profile.update(blockxsize=blocksize, blockysize=blocksize)
+    first_rows = 0
+    if variable.encoding.get(FLIPPED_ENCODING) == variable.dims[-2]:
+        first_rows = variable.shape[-2] % chunksizes[-2]
+    return {'blockysize': chunksizes[-2], 'windowed': True}, dst_profile, first_rows
+
+
+def _write_chunk_rows(variable: xr.DataArray, temp_file_name: str, blockysize: int, first_rows: int) -> bool:
+    """
+    Write the intermediate GeoTIFF of a variable as `rio.to_raster` would, in
+    windows of whole rows of NetCDF chunks after a first window of
+    `first_rows` rows, as returned by `_tiling` for flipped variables.
+    Returns False, writing nothing, for variables rioxarray must write.
+    """
+    if '_Unsigned' in variable.encoding:
+        return False
+    dtype = np.dtype(variable.encoding.get('rasterio_dtype', variable.encoding.get('dtype', variable.dtype)))
+    geotiff_profile = raster_profile(variable, variable.shape, dtype, blockysize)
+    if geotiff_profile is None:
+        return False
+
+    height = variable.shape[-2]
+    starts = [0] + list(range(first_rows, height, blockysize))
+    with rasterio.open(temp_file_name, 'w', **geotiff_profile) as dataset:
+        write_metadata(dataset, variable)
+        for start, stop in zip(starts, starts[1:] + [height]):
+            window = Window(0, start, variable.shape[-1], stop - start)
+            data = encode_cf_variable(variable.rio.isel_window(window).variable).values.astype(dtype)
+            write_block(dataset, data, window)
+    return True
+
+
 def _rioxr_swapdims(netcdf_xarray):
-    netcdf_xarray.coords['y'] = ('lat', netcdf_xarray.lat)
-    netcdf_xarray.coords['x'] = ('lon', netcdf_xarray.lon)
+    netcdf_xarray.coords['y'] = ('lat', netcdf_xarray.lat.values)
+    netcdf_xarray.coords['x'] = ('lon', netcdf_xarray.lon.values)
 
     return netcdf_xarray.swap_dims({'lat': 'y', 'lon': 'x'})
 
 
+def _translate_intermediate(  # pylint: disable=too-many-arguments,too-many-locals
+    temp_file_name: str,
+    output_file_name: str,
+    variable_name: str,
+    validity: Validity,
+    dst_profile: dict,
+    scratch: ScratchSpace,
+    histogram_bins: int,
+    logger: Logger,
+    compression: CompressionConfig | None = None,
+    overviews: OverviewConfig | None = None,
+    quantization: QuantizeConfig | None = None,
+    sparse: bool = False,
+):
+    """
+    Set the CRS, mask and band statistics of an intermediate GeoTIFF,
+    quantize it if configured, and translate it to a COG with the configured
+    compression and overviews, leaving empty tiles unwritten if sparse.
+    """
+    overviews = overviews or OverviewConfig()
+    # Option to add additional GDAL config settings
+    # config = dict(GDAL_NUM_THREADS="ALL_CPUS", GDAL_TIFF_OVR_BLOCKSIZE="128")
+    # with rasterio.Env(**config):
+
+    logger.info("Starting conversion... %s", output_file_name)
+
+    # default CRS setting
+    # crs = rasterio.crs.CRS({"init": "epsg:3857"})
+
+    with rasterio.open(temp_file_name, mode='r+') as src_dataset:
+        # if src_dst.crs is None:
+        #     src_dst.crs = crs
+        src_dataset.crs = CRS.from_proj4(proj="+proj=latlong")
+        masked = apply_mask(src_dataset, validity)
+        if masked:
+            logger.info("Masked %d pixels outside the valid range of %s", masked, variable_name)
+        # Before the statistics, which describe the values written to the COG
+        quantize(src_dataset, quantization, variable_name, logger)
+        # Computed from the intermediate file, which is local and
+        # uncompressed, and forwarded to the COG band metadata
+        write_statistics(src_dataset, histogram_bins)
+        # Chosen from the masked data, as it is written to the COG
+        dst_profile, compression_metadata = compression_profile(src_dataset, dst_profile, compression,
+                                                                variable_name, logger)
+        dst_profile = sparse_profile(src_dataset, dst_profile, sparse, variable_name, logger)
+        if overviews.engine == 'numpy':
+            reduction = overviews.reduction(validity.categorical)
+            src_dataset.update_tags(OVR_RESAMPLING_ALG=RESAMPLING_NAMES[reduction], **(compression_metadata or {}))
+        else:
+            cog_translate(
+                src_dataset,
+                output_file_name,
+                dst_profile,
+                in_memory=scratch.is_in_memory(temp_file_name) or None,
+                overview_level=overviews.level_count(src_dataset.width, src_dataset.height,
+                                                     dst_profile['blockxsize']),
+                overview_resampling=validity.overview_resampling,
+                forward_band_tags=True,
+                additional_cog_metadata=compression_metadata,
+                use_cog_driver=True
+            )
+
+    if overviews.engine == 'numpy':
+        # Once the intermediate file is closed, with its mask, statistics and
+        # tags written
+        write_cog(temp_file_name, output_file_name, dst_profile, reduction, overviews, logger)
+
+
+def _to_raster(nc_xarray: xr.Dataset, variable_name: str, temp_file_name: str, raster_options: dict,
+               logger: Logger):
+    """Write the intermediate GeoTIFF of a variable through xarray and
+    rioxarray.
+    """
+    _, group_variable_name = _split_variable_path(variable_name)
+    try:
+        nc_xarray[group_variable_name].rio.to_raster(temp_file_name, **raster_options)
+    except LookupError as err:
+        logger.info("Variable %s cannot be converted to tif: %s", variable_name, err)
+        raise Net2CogError(variable_name, err) from err
+    except DimensionError as dmerr:
+        try:
+            logger.info("%s: No x or y xarray dimensions, adding them...", dmerr)
+            nc_xarray_tmp = _rioxr_swapdims(nc_xarray)
+            nc_xarray_tmp[group_variable_name].rio.to_raster(temp_file_name, **raster_options)
+        except RuntimeError as runerr:
+            logger.info("Variable %s cannot be converted to tif: %s", variable_name, runerr)
+            raise Net2CogError(variable_name, runerr) from runerr
+        except Exception as aerr:  # pylint: disable=broad-except
+            logger.info("Variable %s cannot be converted to tif: %s", variable_name, aerr)
+            raise Net2CogError(variable_name, aerr) from aerr
+
+
 # pylint: disable=R0914
-def _write_cogtiff(
+def _write_cogtiff(  # pylint: disable=too-many-arguments
     output_directory: str,
     nc_xarray: xr.Dataset,
     variable_name: str,
     logger: Logger,
+    scratch: ScratchSpace,
+    histogram_bins: int = DEFAULT_HISTOGRAM_BINS,
+    compression: CompressionConfig | None = None,
+    overviews: OverviewConfig | None = None,
+    mapped: MappedVariable | None = None,
+    quantization: QuantizeConfig | None = None,
+    sparse: bool = False,
 ) -> str | None:
     """
     This function converts a variable inside a NetCDF file into a
@@ -63,82 +650,107 @@ def _write_cogtiff(
             netcdf_converter/
             RSS_smap_SSS_L3_8day_running_2020_037_FNL_v04.0_test
     nc_xarray : xarray.Dataset
-        xarray dataset loaded from NetCDF file
+        xarray dataset loaded from the NetCDF group containing the variable
     variable_name: str
-        Name of the variable within the file to convert.
+        Name of the variable within the file to convert. Variables in nested
+        groups are given as the full path, e.g. `group/variable`.
     logger : logging.Logger
         Python Logger object for emitting log messages.
+    scratch : net2cog.scratch.ScratchSpace
+        Location of the intermediate GeoTIFF and the output COG, which may be
+        in memory.
+    histogram_bins : int
+        Number of buckets in the histogram written with the band statistics,
+        or 0 to skip the histogram.
+    compression : net2cog.compression.CompressionConfig | None
+        Compression of the COG, or of each COG in auto mode. Defaults to
+        DEFLATE.
+    overviews : net2cog.overviews.OverviewConfig | None
+        Engine and number of overview levels. Defaults to GDAL overviews.
+    mapped : net2cog.memmap.MappedVariable | None
+        Memory map of the variable, as returned by `_GroupDatasets.mapped`.
+        If given, the intermediate GeoTIFF is written from the map rather
+        than read through xarray.
+    quantization : net2cog.quantize.QuantizeConfig | None
+        Precision floating point data is quantized to. Not quantized if None.
+    sparse : bool
+        Whether tiles that are entirely nodata are left unwritten, see
+        `sparse.py`.
 
     Notes
     -----
-    - Assumption that 0 is always on the prime meridian/equator.
+    - The dataset is expected to be normalized north-up in -180..180, as
+      returned by `_GroupDatasets.open`.
     - The output name for converted GeoTIFFs is `<variable name>.tif`, with any
       slashes replaced with underscores.
     """
 
     logger.debug("NetCDF Var: %s", variable_name)
+    _, group_variable_name = _split_variable_path(variable_name)
 
-    if variable_name in EXCLUDE_VARS:
+    if group_variable_name in EXCLUDE_VARS:
         logger.debug(f"Variable {variable_name} is excluded. Will not produce COG")
         return None
 
-    output_basename = f'{variable_name}.tif'.replace('/', '_')
-    output_file_name = path_join(output_directory, output_basename)
-
-    with TemporaryDirectory() as tempdir:
-        temp_file_name = path_join(tempdir, output_basename)
-
-        try:
-            nc_xarray[variable_name].rio.to_raster(temp_file_name)
-        except KeyError as error:
-            # Occurs when trying to locate a variable that is not in the Dataset
-            raise Net2CogError(variable_name, error) from error
-        except LookupError as err:
-            logger.info("Variable %s cannot be converted to tif: %s", variable_name, err)
-            raise Net2CogError(variable_name, err) from err
-        except DimensionError as dmerr:
-            try:
-                logger.info("%s: No x or y xarray dimensions, adding them...", dmerr)
-                nc_xarray_tmp = _rioxr_swapdims(nc_xarray)
-                nc_xarray_tmp[variable_name].rio.to_raster(temp_file_name)
-            except RuntimeError as runerr:
-                logger.info("Variable %s cannot be converted to tif: %s", variable_name, runerr)
-                raise Net2CogError(variable_name, runerr) from runerr
-            except Exception as aerr:  # pylint: disable=broad-except
-                logger.info("Variable %s cannot be converted to tif: %s", variable_name, aerr)
-                raise Net2CogError(variable_name, aerr) from aerr
-
-        # Option to add additional GDAL config settings
-        # config = dict(GDAL_NUM_THREADS="ALL_CPUS", GDAL_TIFF_OVR_BLOCKSIZE="128")
-        # with rasterio.Env(**config):
-
-        logger.info("Starting conversion... %s", output_file_name)
-
-        # default CRS setting
-        # crs = rasterio.crs.CRS({"init": "epsg:3857"})
-
-        with rasterio.open(temp_file_name, mode='r+') as src_dataset:
-            # if src_dst.crs is None:
-            #     src_dst.crs = crs
-            src_dataset.crs = CRS.from_proj4(proj="+proj=latlong")
-            dst_profile = cog_profiles.get("deflate")
-            cog_translate(
-                src_dataset,
-                output_file_name,
-                dst_profile,
-                use_cog_driver=True
-            )
-
+    cog_basename = output_basename(variable_name)
+
+    try:
+        variable_size = nc_xarray[group_variable_name].nbytes
+    except KeyError as error:
+        # Occurs when trying to locate a variable that is not in the Dataset
+        raise Net2CogError(variable_name, error) from error
+
+    # The COG, with overviews, is estimated at 4/3 the size of the raw data.
+    # The intermediate file also holds rio-cogeo's temporary COG when it is
+    # in memory.
+    cog_size = variable_size * 4 // 3
+    output_file_name = scratch.output_file(str(output_directory), cog_basename, cog_size)
+
+    raster_options, dst_profile, first_rows = _tiling(nc_xarray[group_variable_name], logger)
+    validity = Validity.from_variable(nc_xarray[group_variable_name])
+
+    try:
+        with scratch.intermediate_file(cog_basename, variable_size + cog_size) as temp_file_name:
+            if mapped is not None and write_raster(nc_xarray[group_variable_name], mapped, temp_file_name,
+                                                   raster_options.get('blockysize')):
+                logger.info("Wrote %s from its memory mapped storage", variable_name)
+            elif first_rows and _write_chunk_rows(nc_xarray[group_variable_name], temp_file_name,
+                                                  raster_options['blockysize'], first_rows):
+                logger.info("Wrote %s flipped to north-up in windows of whole chunks", variable_name)
+            else:
+                _to_raster(nc_xarray, variable_name, temp_file_name, raster_options, logger)
+
+            _translate_intermediate(temp_file_name, output_file_name, variable_name, validity,
+                                    dst_profile, scratch, histogram_bins, logger, compression, overviews,
+                                    quantization, sparse)
+    except BaseException:
+        # Return an in-memory output to the scratch budget
+        scratch.release(output_file_name)
+        raise
+
+    scratch.account_file(output_file_name)
     logger.info("Finished conversion, writing variable: %s", output_file_name)
     logger.info("NetCDF conversion complete. Returning COG generated.")
     return output_file_name
 
 
-def netcdf_converter(
+def netcdf_converter(  # pylint: disable=too-many-arguments
     input_nc_file: pathlib.Path,
     output_directory: pathlib.Path,
     var_list: list[str],
     logger: Logger,
+    scratch: ScratchSpace | None = None,
+    profile_config: ProfileConfig | None = None,
+    plan: ConversionPlan | None = None,
+    histogram_bins: int = DEFAULT_HISTOGRAM_BINS,
+    on_converted: Callable[[str, str], None] | None = None,
+    compression: CompressionConfig | None = None,
+    overviews: OverviewConfig | None = None,
+    existing_output: Callable[[str, xr.Dataset], str | None] | None = None,
+    quantization: QuantizeConfig | None = None,
+    sparse: bool = False,
+    quicklook: QuicklookConfig | None = None,
+    swath_grid: SwathGridConfig | None = None,
 ) -> List[str]:
     """Primary function for beginning NetCDF conversion using rasterio,
     rioxarray and xarray
@@ -146,56 +758,171 @@ def netcdf_converter(
     Parameters
     ----------
     input_nc_file : pathlib.Path
-        Path to  NetCDF file to process
+        Path to  NetCDF file to process, or a kerchunk reference file or Zarr
+        store, see `zarr_input.py`.
     output_directory : pathlib.Path
         Path to temporary directory into which results will be placed before
         staging in S3.
     var_list : str | None
         List of variable names to be converted to various single band cogs,
-        ex: ['gland', 'fland', 'sss_smap']. If this list is empty, it is assumed
-        that all variables have been requested.
+        ex: ['gland', 'fland', 'sss_smap']. Variables in nested groups are
+        given by their full path, ex: ['data_01/ku/ssha']. If this list is
+        empty, it is assumed that all variables have been requested.
     logger : logging.Logger
         Python Logger object for emitting log messages.
+    scratch : net2cog.scratch.ScratchSpace | None
+        Scratch space for intermediate and output files. Defaults to disk,
+        with outputs written to `output_directory`. Outputs held in memory
+        must be released by the caller once they have been staged.
+    profile_config : net2cog.profiling.ProfileConfig | None
+        Opt-in profiling of the whole conversion (`item` scope), or of each
+        variable (`variable` scope). Disabled when None.
+    plan : ConversionPlan | None
+        Plan returned by `inspect` for this file. If given, its convertible
+        variables are converted and `var_list` is ignored.
+    histogram_bins : int
+        Number of buckets in the histogram written to each COG with its band
+        statistics, or 0 to skip the histogram.
+    on_converted : Callable[[str, str], None] | None
+        Called with the variable name and output file as soon as each
+        variable has been converted, e.g. to checkpoint progress.
+    compression : net2cog.compression.CompressionConfig | None
+        Compression of each COG, fixed or chosen per variable in auto mode.
+        Defaults to DEFLATE.
+    overviews : net2cog.overviews.OverviewConfig | None
+        Engine and number of overview levels of each COG. Defaults to GDAL
+        overviews.
+    existing_output : Callable[[str, xarray.Dataset], str | None] | None
+        Called with the variable name and the dataset of its group before
+        each variable is converted. If it returns an output file, e.g. for an
+        identical COG produced from another granule, that file is returned for
+        the variable and the variable is not converted.
+    quantization : net2cog.quantize.QuantizeConfig | None
+        Precision floating point variables are quantized to, to improve
+        compression. Not quantized if None.
+    sparse : bool
+        Whether tiles of each COG that are entirely nodata are left unwritten,
+        for smaller COGs of mostly empty variables. See `sparse.py`.
+    quicklook : net2cog.quicklook.QuicklookConfig | None
+        If enabled, a quicklook PNG of each converted variable is written to
+        `output_directory` as `<variable name>.png`, see `quicklook.py`.
+        Variables returned by `existing_output` have no quicklook.
+    swath_grid : net2cog.swath.SwathGridConfig | None
+        Resolution and method of the gridding of swath variables, on 2D
+        latitude and longitude coordinates. Defaults to the nearest sample
+        for categorical variables and the mean for others, at the resolution
+        of each swath. See `swath.py`.
 
     Notes
     -----
-    Currently uses local file paths, no s3 paths
+    Currently uses local file paths, no s3 paths. Only the groups containing
+    requested variables are opened.
     """
+    with profile(profile_config, 'item', basename(input_nc_file), logger):
+        return _netcdf_converter(input_nc_file, output_directory, var_list, logger,
+                                 scratch or ScratchSpace(logger=logger), profile_config, plan, histogram_bins,
+                                 on_converted, compression, overviews, existing_output, quantization,
+                                 sparse, quicklook, swath_grid)
+
+
+def _netcdf_converter(  # pylint: disable=too-many-arguments
+    input_nc_file: pathlib.Path,
+    output_directory: pathlib.Path,
+    var_list: list[str],
+    logger: Logger,
+    scratch: ScratchSpace,
+    profile_config: ProfileConfig | None,
+    plan: ConversionPlan | None,
+    histogram_bins: int,
+    on_converted: Callable[[str, str], None] | None,
+    compression: CompressionConfig | None,
+    overviews: OverviewConfig | None,
+    existing_output: Callable[[str, xr.Dataset], str | None] | None,
+    quantization: QuantizeConfig | None,
+    sparse: bool,
+    quicklook: QuicklookConfig | None,
+    swath_grid: SwathGridConfig | None,
+) -> List[str]:
     logger.info("Input file name: %s", input_nc_file)
 
     netcdf_file = os.path.abspath(input_nc_file)
     logger.debug('NetCDF Path: %s', netcdf_file)
 
-    if netcdf_file.endswith('.nc'):
+    if netcdf_file.endswith('.nc') or is_zarr_input(netcdf_file):
         logger.info("Reading %s", basename(netcdf_file))
 
-        xds = xr.open_dataset(netcdf_file)
-
-        # NetCDF must have spatial dimensions
-        if (({"lon", "lat"}.issubset(set(xds.dims)))
-                or ({"longitude", "latitude"}.issubset(set(xds.dims)))
-                or ({"x", "y"}.issubset(set(xds.dims)))):
-            # used to invert y axis
-            # xds_reversed = xds.reindex(lat=xds.lat[::-1])
+        with _GroupDatasets(netcdf_file, logger, swath_grid) as group_datasets:
+            plan = plan or _build_plan(netcdf_file, group_datasets, var_list)
 
-            if not var_list:
-                # Empty list means "all" variables, so get all variables in
-                # the `xarray.Dataset`.
-                var_list = list(xds.data_vars.keys())
+            for variable_plan in plan.variables:
+                if not variable_plan.found:
+                    raise Net2CogError(variable_plan.name, variable_plan.skip_reason)
+                if variable_plan.skip_reason is not None:
+                    logger.info("Skipping variable %s: %s", variable_plan.name, variable_plan.skip_reason)
 
-            output_files = [
-                _write_cogtiff(output_directory, xds, variable_name, logger)
-                for variable_name in var_list
-            ]
-            # Remove None returns, e.g., for excluded variables
+            output_files = []
+            try:
+                for variable_name in plan.convertible_variables:
+                    group_path, _ = _split_variable_path(variable_name)
+                    xds = group_datasets.open(group_path)
+                    existing_file = existing_output(variable_name, xds) if existing_output else None
+                    if existing_file is not None:
+                        output_files.append(existing_file)
+                        continue
+
+                    profile_name = f'{basename(netcdf_file)}-{variable_name}'
+                    with profile(profile_config, 'variable', profile_name, logger):
+                        output_files.append(
+                            _write_cogtiff(output_directory, xds, variable_name, logger, scratch, histogram_bins,
+                                           compression, overviews, group_datasets.mapped(variable_name),
+                                           quantization, sparse)
+                        )
+                        if quicklook and quicklook.enabled and output_files[-1] is not None:
+                            write_quicklook(output_files[-1], quicklook_file(str(output_directory), output_files[-1]),
+                                            quicklook, logger)
+                    if on_converted is not None and output_files[-1] is not None:
+                        on_converted(variable_name, output_files[-1])
+            except BaseException:
+                # The caller never sees the outputs produced so far, so return
+                # any held in memory to the scratch budget.
+                for output_file in output_files:
+                    if output_file is not None:
+                        scratch.release(output_file)
+                raise
+
+            # Remove any None returns
             return [
                 output_file
                 for output_file in output_files
                 if output_file is not None
             ]
 
-        logger.error("%s: NetCDF file does not contain spatial dimensions such as lat / lon "
-                     "or x / y", netcdf_file)
-        return []
     logger.info("Not a NetCDF file; Skipped file: %s", netcdf_file)
     return []
+
+
+def inspect_main():
+    """Parse command line arguments, inspect a NetCDF file and print the
+    conversion plan as JSON.
+
+    Returns
+    -------
+    None
+
+    """
+    parser = argparse.ArgumentParser(prog='net2cog_inspect',
+                                     description='List the variables of a NetCDF file that can be '
+                                                 'converted to COGs, reading only file metadata')
+    parser.add_argument('input_file', help='NetCDF file to inspect')
+    parser.add_argument('-v', '--variables', nargs='*', default=[],
+                        help='Variables to inspect, all variables if omitted')
+    parser.add_argument('-o', '--output', help='Write the plan to this file instead of stdout')
+    args = parser.parse_args()
+
+    plan = inspect(pathlib.Path(args.input_file), args.variables, getLogger(__name__))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file_handler:
+            file_handler.write(plan.to_json())
+    else:
+        sys.stdout.write(plan.to_json() + '\n')
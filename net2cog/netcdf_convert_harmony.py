@@ -14,23 +14,44 @@ import os
 import pathlib
 import shutil
 import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
 from os.path import basename, splitext
 
 import harmony_service_lib
 import pystac
+import rasterio
 from harmony_service_lib import BaseHarmonyAdapter
 from harmony_service_lib.exceptions import HarmonyException
 from harmony_service_lib.message import Source
-from harmony_service_lib.util import download, generate_output_filename, stage
-from pystac import Asset, Item
+from harmony_service_lib.util import bbox_to_geometry, download, generate_output_filename
+from pystac import Asset, Catalog, Item, read_file
+from pystac.extensions.file import FileExtension
+from pystac.extensions.raster import DataType, RasterBand, RasterExtension
 
-from net2cog import netcdf_convert
-from net2cog.netcdf_convert import Net2CogError
+from net2cog import aggregate, netcdf_convert
+from net2cog.checkpoint import CHECKPOINT_DIRECTORY_ENV, CheckpointManifest, work_directory
+from net2cog.compression import CompressionConfig
+from net2cog.dedupe import (DEDUPE_INDEX_ENV, DEDUPE_VARIABLES_ENV, DedupeIndex, GranuleDeduplicator,
+                            dedupe_variables_from_environment)
+from net2cog.netcdf_convert import ConversionPlan, Net2CogError
+from net2cog.overviews import OverviewConfig
+from net2cog.profiling import ProfileConfig, profile
+from net2cog.quantize import QuantizeConfig
+from net2cog.quicklook import QuicklookConfig, quicklook_file
+from net2cog.scratch import ScratchSpace
+from net2cog.sparse import sparse_from_environment
+from net2cog.staging import (CHECKSUM_ALGORITHM_ENV, DEFAULT_CHECKSUM_ALGORITHM, MULTIHASH_CODES, MultipartConfig,
+                             StagedFile, stage_file)
+from net2cog.statistics import DEFAULT_HISTOGRAM_BINS, HISTOGRAM_BINS_ENV, read_statistics
+from net2cog.swath import SwathGridConfig
 
 DATA_DIRECTORY_ENV = "DATA_DIRECTORY"
+ITEM_CONCURRENCY_ENV = "ITEM_CONCURRENCY"
 
 
-class NetcdfConverterService(BaseHarmonyAdapter):
+class NetcdfConverterService(BaseHarmonyAdapter):  # pylint: disable=too-many-instance-attributes
     """
     See https://github.com/nasa/harmony-service-lib-py
     for documentation and examples.
@@ -45,6 +66,152 @@ class NetcdfConverterService(BaseHarmonyAdapter):
         # Create temp directory
         self.job_data_dir = tempfile.mkdtemp(prefix=message.requestId, dir=self.data_dir)
 
+        # Intermediate and output files may be held in memory, see scratch.py
+        self.scratch = ScratchSpace.from_environment(self.logger)
+
+        # Number of STAC items (granules) converted at the same time
+        self.item_concurrency = max(int(os.getenv(ITEM_CONCURRENCY_ENV, '1')), 1)
+
+        # Opt-in profiling, see profiling.py
+        self.profile_config = ProfileConfig.from_environment()
+
+        # Buckets in the histogram written with each COG's band statistics
+        self.histogram_bins = int(os.getenv(HISTOGRAM_BINS_ENV, str(DEFAULT_HISTOGRAM_BINS)))
+
+        # Fixed, or per variable auto-tuned, COG compression, see compression.py
+        self.compression = CompressionConfig.from_environment()
+
+        # Overview engine and levels, see overviews.py
+        self.overviews = OverviewConfig.from_environment()
+
+        # Opt-in quantization of floating point variables, see quantize.py
+        self.quantization = QuantizeConfig.from_environment()
+
+        # Opt-in sparse COGs, without their empty tiles, see sparse.py
+        self.sparse = sparse_from_environment()
+
+        # Opt-in quicklook PNG of each variable, staged as a thumbnail asset,
+        # see quicklook.py
+        self.quicklook = QuicklookConfig.from_environment()
+
+        # Resolution and method of gridding swath variables, see swath.py
+        self.swath_grid = SwathGridConfig.from_environment()
+
+        # Checksum of each staged COG, computed while it is uploaded
+        self.checksum_algorithm = os.getenv(CHECKSUM_ALGORITHM_ENV, DEFAULT_CHECKSUM_ALGORITHM)
+        if self.checksum_algorithm not in MULTIHASH_CODES:
+            raise ValueError(f'Unknown checksum algorithm {self.checksum_algorithm}, '
+                             f'expected one of {list(MULTIHASH_CODES)}')
+
+        # Large COGs are staged with parallel multipart uploads
+        self.multipart_config = MultipartConfig.from_environment()
+
+        # Opt-in checkpoints, so a retried item resumes, see checkpoint.py
+        self.checkpoint_directory = os.getenv(CHECKPOINT_DIRECTORY_ENV)
+
+        # Opt-in reuse of COGs of variables identical across granules, see
+        # dedupe.py
+        self.dedupe_index = DedupeIndex.from_environment(self.logger)
+        self.dedupe_variables = dedupe_variables_from_environment()
+        if self.dedupe_index and not self.dedupe_variables:
+            self.logger.warning('%s is set without %s, so no variables are deduplicated',
+                                DEDUPE_INDEX_ENV, DEDUPE_VARIABLES_ENV)
+
+    def invoke(self):
+        """Process all items in the input STAC catalog. When `ITEM_CONCURRENCY`
+        is greater than 1, items are processed concurrently, each in its own
+        work directory. When the request asks for outputs to be concatenated,
+        all items are aggregated into a single output item.
+
+        Returns
+        -------
+        (harmony_service_lib.Message, pystac.Catalog)
+            The Harmony message and a STAC catalog describing the output.
+        """
+        try:
+            if self.catalog and self.message.concatenate:
+                return (self.message, self._aggregate_catalog(self.catalog))
+            if self.catalog and self.item_concurrency > 1:
+                return (self.message, self._process_catalog_concurrently(self.catalog))
+            return super().invoke()
+        finally:
+            # Clean up any intermediate resources
+            self.scratch.cleanup()
+            shutil.rmtree(self.job_data_dir, ignore_errors=True)
+
+    def _process_catalog_concurrently(self, catalog: Catalog) -> Catalog:
+        """Process the catalog with a pool of `item_concurrency` threads. The
+        output catalog has the same structure as that produced by
+        `BaseHarmonyAdapter._process_catalog_recursive`: child catalogs are
+        rebuilt, `next` links are followed as child catalogs and items keep
+        their input order.
+
+        Parameters
+        ----------
+        catalog : pystac.Catalog
+            The catalog to process
+
+        Returns
+        -------
+        pystac.Catalog
+            A new catalog containing all of the processed results
+        """
+        pending_items = []
+        with ThreadPoolExecutor(max_workers=self.item_concurrency) as executor:
+            result = self._submit_catalog_recursive(catalog, executor, pending_items)
+
+            for result_catalog, item, future in pending_items:
+                output_item = future.result()
+                if output_item:
+                    # Ensure the item gets a new ID
+                    if output_item.id == item.id:
+                        output_item.id = str(uuid.uuid4())
+                    result_catalog.add_item(output_item)
+
+        self.logger.info('Processed %d granule(s) with %d worker(s)',
+                         len(pending_items), self.item_concurrency)
+        return result
+
+    def _submit_catalog_recursive(self, catalog: Catalog, executor: ThreadPoolExecutor,
+                                  pending_items: list) -> Catalog:
+        """Build the output catalog for `catalog` and its children, submitting
+        each item to the executor. The output catalog, input item and future
+        for each item are appended to `pending_items`, so results can be added
+        to the right catalog once all items have been submitted.
+        """
+        result = catalog.clone()
+        result.id = str(uuid.uuid4())
+
+        # Recursively process all sub-catalogs
+        children = catalog.get_children()
+        result.clear_children()
+        result.add_children([
+            self._submit_catalog_recursive(child, executor, pending_items)
+            for child in children
+        ])
+
+        # Submit immediate child items
+        items = catalog.get_items()
+        result.clear_items()
+        source = None
+        for item in items:
+            cloned_item = item.clone()
+            # if there is a bbox, but no geometry, create a geometry from the bbox
+            if cloned_item.bbox and not cloned_item.geometry:
+                cloned_item.geometry = bbox_to_geometry(cloned_item.bbox)
+            source = source or self._get_item_source(cloned_item)
+            pending_items.append(
+                (result, item, executor.submit(self.process_item, cloned_item, source))
+            )
+
+        # process 'next' link if present
+        link = catalog.get_single_link(rel='next')
+        if link:
+            next_catalog = read_file(link.get_href())
+            result.add_child(self._submit_catalog_recursive(next_catalog, executor, pending_items))
+
+        return result
+
     def process_item(self, item: pystac.Item, source: Source) -> pystac.Item:
         """
         Performs net2cog on input STAC Item's data, returning
@@ -62,38 +229,32 @@ class NetcdfConverterService(BaseHarmonyAdapter):
         pystac.Item
             a STAC item describing the output
         """
-        output_dir = self.job_data_dir
+        with profile(self.profile_config, 'item', item.id, self.logger):
+            return self._process_item(item, source)
+
+    def _process_item(self, item: pystac.Item, source: Source) -> pystac.Item:
+        asset = self._data_asset(item)
+        output_dir, manifest = self._work_directory(item, asset)
+        deduplicator = None
+        if self.dedupe_index and self.dedupe_variables:
+            deduplicator = GranuleDeduplicator(self.dedupe_index, output_dir, self._output_settings(),
+                                               self.dedupe_variables, self.logger)
+
+        generated_cogs = []
+        succeeded = False
         try:
             self.logger.info('Input item: %s', json.dumps(item.to_dict()))
             self.logger.info('Input source: %s', source)
-            # Get the data file
-            asset = next(v for k, v in item.assets.items() if 'data' in (v.roles or []))
-            self.logger.info('Downloading %s to %s', asset.href, output_dir)
-            input_filename = download(
-                asset.href,
-                output_dir,
-                logger=self.logger,
-                access_token=self.message.accessToken,
-                cfg=self.config
-            )
-
-            # Determine variables that need processing
-            var_list = source.process('variables')
-
-            if var_list:
-                var_list = list(map(lambda var: var.name, var_list))
-                self.logger.info('Processing variables %s', var_list)
-            else:
-                self.logger.info('Processing all variables.')
+            input_filename = self._input_file(asset, output_dir, manifest)
+            var_list = self._variable_names(source)
 
             # Run the netcdf converter for the complete netcdf granule
             try:
-                generated_cogs = netcdf_convert.netcdf_converter(
-                    pathlib.Path(input_filename),
-                    pathlib.Path(output_dir),
-                    var_list,
-                    self.logger,
-                )
+                if manifest:
+                    generated_cogs = self._resume_conversion(input_filename, output_dir, var_list, manifest,
+                                                             deduplicator)
+                else:
+                    generated_cogs = self._convert(input_filename, output_dir, var_list, deduplicator=deduplicator)
             except Net2CogError as error:
                 raise HarmonyException(
                     f'net2cog failed to convert {asset.title}: {error}') from error
@@ -102,24 +263,243 @@ class NetcdfConverterService(BaseHarmonyAdapter):
                                            f'Notify net2cog service provider. '
                                            f'Message: {uncaught_exception}')) from uncaught_exception
 
-            return self.stage_output_and_create_output_stac(
+            output_item = self.stage_output_and_create_output_stac(
                 basename(asset.href),
                 generated_cogs,
-                item
+                item,
+                manifest=manifest,
+                deduplicator=deduplicator,
+                output_dir=output_dir,
             )
+            succeeded = True
+            return output_item
         finally:
-            # Clean up any intermediate resources
-            shutil.rmtree(self.job_data_dir)
+            # Clean up any intermediate resources for this item. The work
+            # directory of a failed checkpointed item is kept for its retry.
+            for generated_cog in generated_cogs:
+                self.scratch.release(generated_cog)
+            if succeeded or not manifest:
+                shutil.rmtree(output_dir)
+            if succeeded and manifest:
+                try:
+                    # Removed with the last item of the request
+                    os.rmdir(os.path.dirname(output_dir))
+                except OSError:
+                    pass
+
+    def _work_directory(self, item: pystac.Item, asset: Asset) -> tuple[str, CheckpointManifest | None]:
+        """The work directory of an item, and its checkpoint manifest if
+        checkpointing is enabled.
+        """
+        if self.checkpoint_directory:
+            # The work directory of a checkpointed item is the same for every
+            # attempt, so a retry can resume.
+            output_dir = work_directory(self.checkpoint_directory, self.message.requestId, item.id)
+            return output_dir, CheckpointManifest(output_dir, asset.href, self.checksum_algorithm, self.logger)
+
+        # Each item has its own work directory, so items can be processed
+        # concurrently.
+        return tempfile.mkdtemp(prefix=f'{item.id}-', dir=self.job_data_dir), None
+
+    def _input_file(self, asset: Asset, output_dir: str, manifest: CheckpointManifest | None) -> str:
+        """Download the input file, unless a previous attempt downloaded it."""
+        input_filename = manifest and manifest.downloaded_file()
+        if input_filename:
+            self.logger.info('Using %s downloaded by a previous attempt', input_filename)
+            return input_filename
+
+        input_filename = self._download_data(asset, output_dir)
+        if manifest:
+            manifest.record_download(input_filename)
+        return input_filename
+
+    def _convert(self, input_filename: str, output_dir: str, var_list: list[str],  # pylint: disable=too-many-arguments
+                 plan: ConversionPlan | None = None, manifest: CheckpointManifest | None = None,
+                 deduplicator: GranuleDeduplicator | None = None) -> list[str]:
+        """Convert the requested variables of a downloaded granule."""
+        return netcdf_convert.netcdf_converter(
+            pathlib.Path(input_filename),
+            pathlib.Path(output_dir),
+            var_list,
+            self.logger,
+            scratch=self.scratch,
+            # Items are profiled here, only variables by the converter
+            profile_config=self.profile_config if self.profile_config
+            and self.profile_config.scope == 'variable' else None,
+            plan=plan,
+            histogram_bins=self.histogram_bins,
+            on_converted=manifest.record_converted if manifest else None,
+            compression=self.compression,
+            overviews=self.overviews,
+            quantization=self.quantization,
+            sparse=self.sparse,
+            quicklook=self.quicklook,
+            swath_grid=self.swath_grid,
+            existing_output=deduplicator.existing_output if deduplicator else None,
+        )
 
-    def stage_output_and_create_output_stac(
+    def _output_settings(self) -> str:
+        """The settings that change a COG, so COGs are only reused for the
+        same settings.
+        """
+        return json.dumps({
+            'compression': asdict(self.compression),
+            'overviews': asdict(self.overviews),
+            'quantization': asdict(self.quantization),
+            'sparse': self.sparse,
+            'swath_grid': asdict(self.swath_grid),
+            'histogram_bins': self.histogram_bins,
+            'checksum_algorithm': self.checksum_algorithm,
+        }, sort_keys=True)
+
+    def _resume_conversion(self, input_filename: str, output_dir: str,  # pylint: disable=too-many-arguments
+                           var_list: list[str], manifest: CheckpointManifest,
+                           deduplicator: GranuleDeduplicator | None = None) -> list[str]:
+        """Convert the requested variables that were not converted by a
+        previous attempt, returning the COGs of all requested variables in
+        the order they would be converted.
+        """
+        plan = netcdf_convert.inspect(pathlib.Path(input_filename), var_list, self.logger, self.swath_grid)
+        completed = {}
+        for variable_name in plan.convertible_variables:
+            converted_file = manifest.converted_file(variable_name)
+            if converted_file is not None:
+                completed[variable_name] = converted_file
+        if completed:
+            self.logger.info('Skipping variables converted by a previous attempt: %s', list(completed))
+
+        remaining_plan = ConversionPlan(
+            input_file=plan.input_file,
+            variables=[variable for variable in plan.variables if variable.name not in completed],
+        )
+        converted = iter(self._convert(input_filename, output_dir, var_list, remaining_plan, manifest, deduplicator))
+        return [
+            completed[variable_name] if variable_name in completed else next(converted)
+            for variable_name in plan.convertible_variables
+        ]
+
+    def _data_asset(self, item: pystac.Item) -> Asset:
+        """The data asset of an item."""
+        return next(v for k, v in item.assets.items() if 'data' in (v.roles or []))
+
+    def _download_data(self, asset: Asset, output_dir: str) -> str:
+        """Download a data asset, returning the local file name."""
+        self.logger.info('Downloading %s to %s', asset.href, output_dir)
+        return download(
+            asset.href,
+            output_dir,
+            logger=self.logger,
+            access_token=self.message.accessToken,
+            cfg=self.config
+        )
+
+    def _variable_names(self, source: Source) -> list[str]:
+        """Names of the variables requested for the source, empty for all."""
+        var_list = source.process('variables')
+
+        if var_list:
+            var_list = list(map(lambda var: var.name, var_list))
+            self.logger.info('Processing variables %s', var_list)
+        else:
+            self.logger.info('Processing all variables.')
+        return var_list
+
+    def _check_aggregation(self):
+        """Reject concatenation with checkpoints or deduplication, which
+        apply to single granules.
+        """
+        unsupported = [name for name, enabled in [
+            (CHECKPOINT_DIRECTORY_ENV, self.checkpoint_directory),
+            (DEDUPE_INDEX_ENV, self.dedupe_index and self.dedupe_variables),
+        ] if enabled]
+        if unsupported:
+            raise HarmonyException(f'net2cog cannot concatenate granules with {" and ".join(unsupported)} set, '
+                                   f'as checkpoints and deduplication apply to single granules')
+
+    def _aggregate_catalog(self, catalog: Catalog) -> Catalog:
+        """Aggregate all items in the catalog, which must be on the same grid,
+        into one output item with a multi-band COG for each variable. The
+        bands are the granules in catalog order.
+
+        Parameters
+        ----------
+        catalog : pystac.Catalog
+            The catalog to process
+
+        Returns
+        -------
+        pystac.Catalog
+            A new catalog containing the aggregated item
+        """
+        self._check_aggregation()
+        items = [item.clone() for item in self.get_all_catalog_items(catalog)]
+        result = catalog.clone()
+        result.id = str(uuid.uuid4())
+        result.clear_children()
+        result.clear_items()
+        if not items:
+            return result
+
+        output_dir = tempfile.mkdtemp(prefix='aggregate-', dir=self.job_data_dir)
+        generated_cogs = []
+        try:
+            assets = [self._data_asset(item) for item in items]
+            input_filenames = [self._download_data(asset, output_dir) for asset in assets]
+            var_list = self._variable_names(self._get_item_source(items[0]))
+            first_stem, extension = splitext(basename(assets[0].href))
+
+            try:
+                with profile(self.profile_config, 'item', f'{first_stem}_stacked', self.logger):
+                    generated_cogs = aggregate.netcdf_aggregator(
+                        [pathlib.Path(input_filename) for input_filename in input_filenames],
+                        pathlib.Path(output_dir),
+                        var_list,
+                        self.logger,
+                        scratch=self.scratch,
+                        histogram_bins=self.histogram_bins,
+                        compression=self.compression,
+                        overviews=self.overviews,
+                        quantization=self.quantization,
+                        sparse=self.sparse,
+                        quicklook=self.quicklook,
+                        swath_grid=self.swath_grid,
+                        profile_config=self.profile_config,
+                    )
+            except Net2CogError as error:
+                raise HarmonyException(
+                    f'net2cog failed to aggregate {len(items)} granules: {error}') from error
+            except Exception as uncaught_exception:
+                raise HarmonyException(str(f'Uncaught error in net2cog. '
+                                           f'Notify net2cog service provider. '
+                                           f'Message: {uncaught_exception}')) from uncaught_exception
+
+            output_item = self.stage_output_and_create_output_stac(
+                f'{first_stem}_stacked{extension}',
+                generated_cogs,
+                _aggregated_item(items),
+                output_dir=output_dir,
+            )
+            result.add_item(output_item)
+            self.logger.info('Aggregated %d granule(s)', len(items))
+            return result
+        finally:
+            for generated_cog in generated_cogs:
+                self.scratch.release(generated_cog)
+            shutil.rmtree(output_dir)
+
+    def stage_output_and_create_output_stac(  # pylint: disable=too-many-arguments
         self,
         source_asset_basename: str,
         output_files: list[str],
-        input_stac_item: Item
+        input_stac_item: Item,
+        manifest: CheckpointManifest | None = None,
+        deduplicator: GranuleDeduplicator | None = None,
+        output_dir: str | None = None,
     ) -> Item:
         """Iterate through all generated COGs and stage the results in S3. Also
         add a unique pystac.Asset for each COG to the pystac.Item returned to
-        Harmony.
+        Harmony, with the band statistics of the COG as STAC raster extension
+        fields, and its size and checksum as STAC file extension fields.
 
         Parameters
         ----------
@@ -129,6 +509,16 @@ class NetcdfConverterService(BaseHarmonyAdapter):
         input_stac_item : pystac.Item
             the input STAC for the request. This is the basis of the output
             STAC, which will replace the pystac.Assets with generated COGs.
+        manifest : net2cog.checkpoint.CheckpointManifest | None
+            Checkpoint of the item. COGs it records as staged are not staged
+            again, and newly staged COGs are recorded.
+        deduplicator : net2cog.dedupe.GranuleDeduplicator | None
+            Deduplication of the item's variables. Assets of reused COGs refer
+            to the COG staged for another granule, and newly staged COGs are
+            added to the index.
+        output_dir : str | None
+            Directory of the quicklooks written by the converter. The
+            quicklook of each COG, if any, is staged as a thumbnail asset.
 
         Returns
         -------
@@ -149,26 +539,129 @@ class NetcdfConverterService(BaseHarmonyAdapter):
                 is_reformatted=True,
             )
 
-            staged_url = stage(
-                output_file,
-                output_basename,
-                pystac.MediaType.COG,
-                location=self.message.stagingLocation,
-                logger=self.logger,
-                cfg=self.config
-            )
-            self.logger.info('Staged %s to %s', output_file, staged_url)
+            staged_file, raster_bands = self._stage(output_file, output_basename, manifest, deduplicator)
+            self.scratch.release(output_file)
 
             # Each asset needs a unique key, so the filename of the COG is used
-            output_stac_item.assets[output_basename] = Asset(
-                staged_url,
+            asset = Asset(
+                staged_file.url,
                 title=output_basename,
                 media_type=pystac.MediaType.COG,
                 roles=['visual'],
             )
+            output_stac_item.add_asset(output_basename, asset)
+            RasterExtension.ext(asset, add_if_missing=True).apply(raster_bands)
+            FileExtension.ext(asset, add_if_missing=True).apply(size=staged_file.size,
+                                                                checksum=staged_file.checksum)
+
+            quicklook = quicklook_file(output_dir, output_file) if output_dir else None
+            if quicklook and os.path.exists(quicklook):
+                thumbnail_basename = splitext(output_basename)[0] + '.png'
+                self._add_thumbnail(output_stac_item, quicklook, thumbnail_basename)
 
         return output_stac_item
 
+    def _add_thumbnail(self, output_stac_item: Item, quicklook: str, thumbnail_basename: str):
+        """Stage the quicklook of a COG, and add it to the item as a thumbnail
+        asset.
+        """
+        staged_file = stage_file(
+            quicklook,
+            thumbnail_basename,
+            pystac.MediaType.PNG,
+            location=self.message.stagingLocation,
+            logger=self.logger,
+            cfg=self.config,
+            checksum_algorithm=self.checksum_algorithm,
+        )
+        self.logger.info('Staged %s to %s', quicklook, staged_file.url)
+        asset = Asset(
+            staged_file.url,
+            title=thumbnail_basename,
+            media_type=pystac.MediaType.PNG,
+            roles=['thumbnail'],
+        )
+        output_stac_item.add_asset(thumbnail_basename, asset)
+        FileExtension.ext(asset, add_if_missing=True).apply(size=staged_file.size, checksum=staged_file.checksum)
+
+    def _stage(self, output_file: str, output_basename: str, manifest: CheckpointManifest | None,
+               deduplicator: GranuleDeduplicator | None = None) -> tuple[StagedFile, list[RasterBand]]:
+        """Stage a COG, unless a previous attempt staged it or an identical
+        COG is reused, returning the staged file and its raster bands.
+        """
+        checkpoint = manifest.staged_file(output_file) if manifest else None
+        if checkpoint is not None:
+            staged_file, raster_bands = checkpoint
+            self.logger.info('%s was staged to %s by a previous attempt', output_file, staged_file.url)
+            return staged_file, [RasterBand(raster_band) for raster_band in raster_bands]
+
+        reused = deduplicator.reused_file(output_file) if deduplicator else None
+        if reused is not None:
+            staged_file, raster_bands = reused
+            self.logger.info('Reusing %s for %s', staged_file.url, output_file)
+            return staged_file, [RasterBand(raster_band) for raster_band in raster_bands]
+
+        staged_file = stage_file(
+            output_file,
+            output_basename,
+            pystac.MediaType.COG,
+            location=self.message.stagingLocation,
+            logger=self.logger,
+            cfg=self.config,
+            checksum_algorithm=self.checksum_algorithm,
+            multipart=self.multipart_config,
+        )
+        self.logger.info('Staged %s to %s', output_file, staged_file.url)
+        raster_bands = _raster_bands(output_file)
+        raster_band_dicts = [raster_band.to_dict() for raster_band in raster_bands]
+        if manifest:
+            manifest.record_staged(output_file, staged_file, raster_band_dicts)
+        if deduplicator:
+            deduplicator.record_staged(output_file, staged_file, raster_band_dicts)
+        return staged_file, raster_bands
+
+
+def _aggregated_item(items: list[Item]) -> Item:
+    """An item covering the bounding boxes and time ranges of all items."""
+    aggregated_item = items[0].clone()
+    aggregated_item.id = str(uuid.uuid4())
+
+    bboxes = [item.bbox for item in items if item.bbox]
+    if bboxes:
+        aggregated_item.bbox = [
+            min(bbox[0] for bbox in bboxes),
+            min(bbox[1] for bbox in bboxes),
+            max(bbox[2] for bbox in bboxes),
+            max(bbox[3] for bbox in bboxes),
+        ]
+        aggregated_item.geometry = bbox_to_geometry(aggregated_item.bbox)
+
+    starts = [item.common_metadata.start_datetime or item.datetime for item in items]
+    ends = [item.common_metadata.end_datetime or item.datetime for item in items]
+    if all(starts) and all(ends):
+        aggregated_item.common_metadata.start_datetime = min(starts)
+        aggregated_item.common_metadata.end_datetime = max(ends)
+        aggregated_item.datetime = None
+
+    return aggregated_item
+
+
+def _raster_bands(output_file: str) -> list[RasterBand]:
+    """STAC raster extension bands for a COG, from its metadata and the band
+    statistics written by net2cog.
+    """
+    with rasterio.open(output_file) as dataset:
+        data_types = dataset.dtypes
+    band_statistics = read_statistics(output_file)
+
+    raster_bands = []
+    for data_type, statistics in zip(data_types, band_statistics):
+        raster_band = RasterBand.create(data_type=DataType(data_type))
+        if statistics is not None:
+            raster_band.properties.update(statistics.to_stac())
+        raster_bands.append(raster_band)
+    return raster_bands
+
 
 def main():
     """Parse command line arguments and invoke the service to respond to
@@ -0,0 +1,137 @@
+"""
+============
+normalize.py
+============
+
+Normalization of NetCDF grids so that COGs are written north-up with
+longitudes in -180..180, whatever the layout of the input.
+
+The layout is detected once per dataset from its 1D coordinate variables:
+
+* Latitudes (or `y`) stored south to north are flipped. This is a slice with
+  a negative step, which xarray applies lazily and NumPy as a view, so no
+  data is copied. Flipped variables are marked with `FLIPPED_ENCODING` in
+  their encoding, so their chunks can still be read whole.
+* Longitudes in 0..360 are wrapped to -180..180, moving the columns east of
+  the antimeridian to the west with a single index array, applied lazily
+  when each variable, or window of a variable, is read.
+
+Every variable of the dataset shares the normalized coordinates, so there is
+no per-variable cost beyond reading the data.
+"""
+
+from dataclasses import dataclass
+from logging import Logger
+
+import numpy as np
+import xarray as xr
+
+LATITUDE_DIMS = ['lat', 'latitude', 'y']
+LONGITUDE_DIMS = ['lon', 'longitude']
+
+# Encoding of variables whose rows are flipped, from the last stored to the
+# first
+FLIPPED_ENCODING = 'net2cog_flipped'
+
+# Attributes describing the original longitude range, which no longer apply
+LONGITUDE_RANGE_ATTRIBUTES = ['valid_min', 'valid_max', 'valid_range']
+
+
+def _coordinate(dataset: xr.Dataset, dim_names: list[str]) -> tuple[str, np.ndarray] | tuple[None, None]:
+    """The first of the dimensions with a 1D coordinate variable, and its
+    values.
+    """
+    for dim in dim_names:
+        if dim in dataset.dims and dim in dataset.coords and dataset[dim].ndim == 1 and dataset.sizes[dim] > 1:
+            return dim, dataset[dim].values
+    return None, None
+
+
+@dataclass
+class GridLayout:
+    """
+    How the grid of a dataset differs from north-up in -180..180.
+
+    Attributes
+    ----------
+    flip_dim : str | None
+        Latitude dimension stored south to north, to be reversed.
+    wrap_dim : str | None
+        Longitude dimension with values greater than 180, to be wrapped.
+    wrap_shift : int
+        Number of columns east of the antimeridian, moved to the west.
+    """
+
+    flip_dim: str | None = None
+    wrap_dim: str | None = None
+    wrap_shift: int = 0
+
+    @property
+    def is_normalized(self) -> bool:
+        """Whether the grid is already north-up in -180..180."""
+        return self.flip_dim is None and self.wrap_dim is None
+
+    @classmethod
+    def detect(cls, dataset: xr.Dataset, logger: Logger) -> 'GridLayout':
+        """Detect the layout of a dataset from its coordinate variables."""
+        layout = cls()
+
+        lat_dim, latitudes = _coordinate(dataset, LATITUDE_DIMS)
+        if lat_dim is not None and latitudes[0] < latitudes[-1]:
+            layout.flip_dim = lat_dim
+
+        lon_dim, longitudes = _coordinate(dataset, LONGITUDE_DIMS)
+        if lon_dim is not None and longitudes.max() > 180:
+            east = longitudes > 180
+            shift = int(east.sum())
+            wrapped = np.roll(np.where(east, longitudes - 360, longitudes), shift)
+            contiguous = np.all(np.diff(longitudes) > 0) and np.all(np.diff(wrapped) > 0)
+            if contiguous and 0 < shift < len(longitudes):
+                # The columns either side of the antimeridian must be adjacent
+                contiguous = np.isclose(wrapped[shift] - wrapped[shift - 1], np.median(np.diff(longitudes)))
+            if contiguous:
+                layout.wrap_dim = lon_dim
+                layout.wrap_shift = shift
+            else:
+                # e.g. a regional grid crossing the antimeridian, which cannot
+                # be contiguous in -180..180
+                logger.info('Longitudes of %s cannot be wrapped to -180..180 and are kept', lon_dim)
+
+        return layout
+
+
+def normalize_grid(dataset: xr.Dataset, logger: Logger) -> xr.Dataset:
+    """
+    Return a lazy view of the dataset that is north-up with longitudes in
+    -180..180. Data is only read, flipped and wrapped when each variable is
+    written.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        Dataset opened from a NetCDF group, with its coordinates resolved.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+    layout = GridLayout.detect(dataset, logger)
+    if layout.is_normalized:
+        return dataset
+
+    if layout.flip_dim is not None:
+        logger.info('Flipping %s to north-up', layout.flip_dim)
+        dataset = dataset.isel({layout.flip_dim: slice(None, None, -1)})
+        for variable in dataset.variables.values():
+            if layout.flip_dim in variable.dims:
+                variable.encoding[FLIPPED_ENCODING] = layout.flip_dim
+
+    if layout.wrap_dim is not None:
+        logger.info('Wrapping %s from 0..360 to -180..180', layout.wrap_dim)
+        columns = np.roll(np.arange(dataset.sizes[layout.wrap_dim]), layout.wrap_shift)
+        dataset = dataset.isel({layout.wrap_dim: columns})
+        longitude = dataset[layout.wrap_dim]
+        wrapped = longitude.copy(data=np.where(longitude.values > 180, longitude.values - 360, longitude.values))
+        wrapped.attrs = {key: value for key, value in longitude.attrs.items()
+                         if key not in LONGITUDE_RANGE_ATTRIBUTES}
+        dataset = dataset.assign_coords({layout.wrap_dim: wrapped})
+
+    return dataset
@@ -0,0 +1,283 @@
+"""
+============
+overviews.py
+============
+
+Overviews of each COG. By default rio-cogeo and GDAL build each overview
+level by reading the full resolution GeoTIFF again. The `numpy` engine
+instead reads the intermediate GeoTIFF once, and computes every level from
+the level above it in memory:
+
+* `mean`: continuous data, averaged from the sums and counts of the valid
+  pixels of each level, so every level is the exact mean of the valid full
+  resolution pixels it covers.
+* `mode`: categorical data such as flags and masks, the most common valid
+  value of each 2x2 block.
+* `nearest`: the top left pixel of each 2x2 block.
+
+Pixels equal to the nodata value, or NaN, are excluded, and a block with no
+valid pixels is nodata. The levels are written with the full resolution data
+to the COG in a single copy.
+
+For both engines, overviews are halved until the smaller side of the raster
+is no more than `OVERVIEW_MIN_SIZE` pixels, which defaults to the COG
+blocksize, so rasters that fit in one tile have no overviews.
+
+Overviews are configured with environment variables:
+
+* `OVERVIEW_ENGINE`: `gdal` (the default) or `numpy`.
+* `OVERVIEW_MAX_LEVELS`: maximum number of overview levels. Unlimited when
+  not set.
+* `OVERVIEW_MIN_SIZE`: smallest side, in pixels, of a raster that has an
+  overview level below it. Defaults to the COG blocksize.
+* `OVERVIEW_CATEGORICAL`: reduction of categorical variables by the `numpy`
+  engine, `mode` (the default) or `nearest`.
+"""
+
+import os
+import xml.etree.ElementTree as ET
+from contextlib import ExitStack
+from dataclasses import dataclass
+from logging import Logger
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.io import MemoryFile
+
+OVERVIEW_ENGINE_ENV = 'OVERVIEW_ENGINE'
+OVERVIEW_MAX_LEVELS_ENV = 'OVERVIEW_MAX_LEVELS'
+OVERVIEW_MIN_SIZE_ENV = 'OVERVIEW_MIN_SIZE'
+OVERVIEW_CATEGORICAL_ENV = 'OVERVIEW_CATEGORICAL'
+
+OVERVIEW_ENGINES = ['gdal', 'numpy']
+CATEGORICAL_REDUCTIONS = ['mode', 'nearest']
+
+# Names of the reductions as GDAL resampling algorithms, for the
+# `OVR_RESAMPLING_ALG` tag rio-cogeo writes
+RESAMPLING_NAMES = {'mean': 'AVERAGE', 'mode': 'MODE', 'nearest': 'NEAREST'}
+
+# Options of the rio-cogeo profile that are not options of the COG driver
+_GTIFF_OPTIONS = ['driver', 'interleave', 'tiled', 'blockxsize', 'blockysize', 'photometric']
+
+
+@dataclass
+class OverviewConfig:
+    """How to build the overviews of each COG."""
+
+    engine: str = 'gdal'
+    max_levels: int | None = None
+    min_size: int | None = None
+    categorical: str = 'mode'
+
+    def __post_init__(self):
+        if self.engine not in OVERVIEW_ENGINES:
+            raise ValueError(f'Unknown overview engine {self.engine}, expected one of {OVERVIEW_ENGINES}')
+        if self.categorical not in CATEGORICAL_REDUCTIONS:
+            raise ValueError(f'Unknown categorical overview reduction {self.categorical}, '
+                             f'expected one of {CATEGORICAL_REDUCTIONS}')
+
+    @classmethod
+    def from_environment(cls) -> 'OverviewConfig':
+        """Build the overview configuration from the environment."""
+        max_levels = os.getenv(OVERVIEW_MAX_LEVELS_ENV)
+        min_size = os.getenv(OVERVIEW_MIN_SIZE_ENV)
+        return cls(
+            engine=os.getenv(OVERVIEW_ENGINE_ENV, 'gdal'),
+            max_levels=int(max_levels) if max_levels else None,
+            min_size=int(min_size) if min_size else None,
+            categorical=os.getenv(OVERVIEW_CATEGORICAL_ENV, 'mode'),
+        )
+
+    def reduction(self, categorical: bool) -> str:
+        """Reduction of the `numpy` engine for a variable."""
+        return self.categorical if categorical else 'mean'
+
+    def level_count(self, width: int, height: int, blocksize: int) -> int:
+        """Number of overview levels of a raster, as rio-cogeo counts them,
+        up to `max_levels`.
+        """
+        min_size = self.min_size or blocksize
+        levels = 0
+        while min(width, height) // 2 ** levels > min_size:
+            levels += 1
+        return levels if self.max_levels is None else min(levels, self.max_levels)
+
+
+def _pad_even(array: np.ndarray, fill) -> np.ndarray:
+    """Pad the last two dimensions of an array to even lengths."""
+    pad_y, pad_x = array.shape[-2] % 2, array.shape[-1] % 2
+    if not pad_y and not pad_x:
+        return array
+    return np.pad(array, [(0, 0)] * (array.ndim - 2) + [(0, pad_y), (0, pad_x)], constant_values=fill)
+
+
+def _blocks(array: np.ndarray) -> np.ndarray:
+    """The 2x2 blocks of an array of even size, as a new first dimension of
+    length 4.
+    """
+    return np.stack([array[..., 0::2, 0::2], array[..., 0::2, 1::2],
+                     array[..., 1::2, 0::2], array[..., 1::2, 1::2]])
+
+
+def _block_sum(array: np.ndarray) -> np.ndarray:
+    """The sum of each 2x2 block of an array."""
+    array = _pad_even(array, 0)
+    return array[..., 0::2, 0::2] + array[..., 0::2, 1::2] + array[..., 1::2, 0::2] + array[..., 1::2, 1::2]
+
+
+def _block_mode(values: np.ndarray, valid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """The most common valid value of each 2x2 block, and whether it has
+    any valid value. Ties are won by the first value in the block.
+    """
+    block_values = _blocks(_pad_even(values, 0))
+    block_valid = _blocks(_pad_even(valid, False))
+    counts = ((block_values[:, None] == block_values[None, :]) & block_valid[None, :]).sum(axis=1)
+    counts[np.logical_not(block_valid)] = -1
+    mode = np.take_along_axis(block_values, counts.argmax(axis=0)[None], axis=0)[0]
+    return mode, block_valid.any(axis=0)
+
+
+def reduce_levels(data: np.ndarray, valid: np.ndarray, levels: int, reduction: str, nodata) -> list[np.ndarray]:
+    """
+    Compute overview levels, each half the size of the level above it.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Full resolution data, of shape (bands, height, width).
+    valid : numpy.ndarray
+        Whether each pixel of `data` is valid.
+    levels : int
+        Number of overview levels.
+    reduction : str
+        `mean`, `mode` or `nearest`.
+    nodata
+        Value of pixels with no valid pixels below them, or None if every
+        pixel is valid.
+
+    Returns
+    -------
+    list[numpy.ndarray]
+        The overview levels, from the largest, with the data type of `data`.
+    """
+    overviews = []
+    values = data
+    sums = counts = None
+    if reduction == 'mean':
+        sums = np.where(valid, data, 0).astype(np.float64)
+        counts = valid.astype(np.int32)
+
+    for _ in range(levels):
+        if reduction == 'mean':
+            sums = _block_sum(sums)
+            counts = _block_sum(counts)
+            valid = counts > 0
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = sums / counts
+            if np.issubdtype(data.dtype, np.integer):
+                values = np.rint(values)
+        elif reduction == 'mode':
+            values, valid = _block_mode(values, valid)
+        else:
+            values, valid = values[..., ::2, ::2], valid[..., ::2, ::2]
+
+        level = values.astype(data.dtype) if nodata is None else np.where(valid, values, nodata).astype(data.dtype)
+        overviews.append(level)
+
+    return overviews
+
+
+def _valid(data: np.ndarray, nodata) -> np.ndarray:
+    """Whether each pixel is valid, excluding nodata and NaN."""
+    valid = np.ones(data.shape, dtype=bool)
+    if nodata is not None and not np.isnan(nodata):
+        valid &= data != nodata
+    if np.issubdtype(data.dtype, np.floating):
+        valid &= ~np.isnan(data)
+    return valid
+
+
+def _write_level(level: np.ndarray, blocksize: int) -> MemoryFile:
+    """Write an overview level to an uncompressed in-memory GeoTIFF."""
+    memory_file = MemoryFile(ext='.tif')
+    with memory_file.open(driver='GTiff', width=level.shape[2], height=level.shape[1], count=level.shape[0],
+                          dtype=level.dtype, tiled=True, blockxsize=blocksize, blockysize=blocksize) as dataset:
+        dataset.write(level)
+    return memory_file
+
+
+def _vrt_with_overviews(source_file: str, level_files: list[str]) -> bytes:
+    """A VRT of the source GeoTIFF, with its metadata, that has the given
+    overview levels.
+    """
+    with MemoryFile(ext='.vrt') as vrt_file:
+        rasterio.shutil.copy(source_file, vrt_file.name, driver='VRT')  # pylint: disable=no-member
+        root = ET.fromstring(vrt_file.read())
+
+    for source_filename in root.iter('SourceFilename'):
+        source_filename.set('relativeToVRT', '0')
+        source_filename.text = source_file
+    for band in root.iter('VRTRasterBand'):
+        for level_file in level_files:
+            overview = ET.SubElement(band, 'Overview')
+            ET.SubElement(overview, 'SourceFilename', relativeToVRT='0').text = level_file
+            ET.SubElement(overview, 'SourceBand').text = band.get('band')
+    return ET.tostring(root)
+
+
+def _overview_levels(source_file: str, blocksize: int, reduction: str, config: OverviewConfig,
+                     logger: Logger) -> list[np.ndarray]:
+    """Read a GeoTIFF once, and compute its overview levels."""
+    with rasterio.open(source_file) as source:
+        levels = config.level_count(source.width, source.height, blocksize)
+        if not levels:
+            return []
+        logger.info('Computing %d overview levels of %s with %s', levels, source_file, reduction)
+        data = source.read()
+        return reduce_levels(data, _valid(data, source.nodata), levels, reduction, source.nodata)
+
+
+def write_cog(  # pylint: disable=too-many-arguments
+    source_file: str,
+    output_file: str,
+    dst_profile: dict,
+    reduction: str,
+    config: OverviewConfig,
+    logger: Logger,
+):
+    """
+    Write a COG from a GeoTIFF with the overviews computed by the `numpy`
+    engine. The GeoTIFF must be closed, with its nodata value, band
+    statistics and tags written.
+
+    Parameters
+    ----------
+    source_file : str
+        Intermediate GeoTIFF, which may be in GDAL memory.
+    output_file : str
+        Path of the COG.
+    dst_profile : dict
+        rio-cogeo COG profile, with the blocksize and compression.
+    reduction : str
+        `mean`, `mode` or `nearest`.
+    config : OverviewConfig
+        Overview configuration.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+    blocksize = int(dst_profile['blockxsize'])
+    overviews = _overview_levels(source_file, blocksize, reduction, config, logger)
+    cog_options = {key: value for key, value in dst_profile.items() if key not in _GTIFF_OPTIONS}
+
+    with ExitStack() as level_files:
+        level_names = [
+            level_files.enter_context(_write_level(level, blocksize)).name  # pylint: disable=no-member
+            for level in overviews
+        ]
+        overviews.clear()
+
+        with MemoryFile(_vrt_with_overviews(source_file, level_names), ext='.vrt') as vrt_file, \
+                vrt_file.open() as vrt:
+            rasterio.shutil.copy(vrt, output_file, driver='COG', blocksize=blocksize,
+                                 overviews='FORCE_USE_EXISTING' if level_names else 'NONE', **cog_options)
@@ -0,0 +1,155 @@
+"""
+============
+profiling.py
+============
+
+Opt-in profiling of conversions. When enabled, a cProfile stats file and a
+tracemalloc summary are written for each profiled item, or each profiled
+variable, to a configured directory. The summary has the current and peak
+memory traced while profiling, and the top allocation sites.
+
+Only one block is profiled at a time: cProfile cannot profile concurrently
+from several threads, and tracemalloc traces the whole process. When items
+are converted concurrently, a block starting while another is profiled is
+not profiled, with a warning. The traced memory and allocations are those of
+the whole process, so they include any concurrent conversions.
+
+Profiling is configured with environment variables:
+
+* `PROFILE_DIRECTORY`: directory for profile output. Profiling is disabled
+  when this is not set.
+* `PROFILE_SAMPLE_RATE`: fraction of items or variables to profile, between
+  0 and 1. Defaults to 1.
+* `PROFILE_SCOPE`: `item` (the default) or `variable`.
+* `PROFILE_TOP_ALLOCATIONS`: number of allocation sites written to the
+  tracemalloc summary. Defaults to 25.
+"""
+
+import cProfile
+import os
+import pathlib
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from logging import Logger
+from os.path import join as path_join
+from typing import ContextManager, Iterator
+
+PROFILE_DIRECTORY_ENV = 'PROFILE_DIRECTORY'
+PROFILE_SAMPLE_RATE_ENV = 'PROFILE_SAMPLE_RATE'
+PROFILE_SCOPE_ENV = 'PROFILE_SCOPE'
+PROFILE_TOP_ALLOCATIONS_ENV = 'PROFILE_TOP_ALLOCATIONS'
+
+PROFILE_SCOPES = ['item', 'variable']
+
+# Held by the active profile
+_profile_lock = threading.Lock()
+
+
+@dataclass
+class ProfileConfig:
+    """Where, how often and at what granularity to profile conversions."""
+
+    directory: str
+    sample_rate: float = 1.0
+    scope: str = 'item'
+    top_allocations: int = 25
+
+    def __post_init__(self):
+        if self.scope not in PROFILE_SCOPES:
+            raise ValueError(f'Unknown profile scope {self.scope}, expected one of {PROFILE_SCOPES}')
+
+    @classmethod
+    def from_environment(cls) -> 'ProfileConfig | None':
+        """Build the profile configuration from the environment, or return
+        None if `PROFILE_DIRECTORY` is not set.
+        """
+        directory = os.getenv(PROFILE_DIRECTORY_ENV)
+        if not directory:
+            return None
+
+        return cls(
+            directory=directory,
+            sample_rate=float(os.getenv(PROFILE_SAMPLE_RATE_ENV, '1')),
+            scope=os.getenv(PROFILE_SCOPE_ENV, 'item'),
+            top_allocations=int(os.getenv(PROFILE_TOP_ALLOCATIONS_ENV, '25')),
+        )
+
+    def should_sample(self) -> bool:
+        """Randomly decide whether to profile, at the configured rate."""
+        return random.random() < self.sample_rate
+
+
+def profile(config: ProfileConfig | None, scope: str, name: str, logger: Logger) -> ContextManager:
+    """
+    Profile the enclosed block if profiling is enabled for the given scope and
+    this call is sampled. Otherwise this returns a no-op context manager, so
+    disabled profiling costs nothing beyond this call.
+
+    Parameters
+    ----------
+    config : ProfileConfig | None
+        Profile configuration, or None if profiling is disabled.
+    scope : str
+        The scope of the enclosed block, `item` or `variable`.
+    name : str
+        Name of the item or variable, used in the output file names.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+    if config is None or config.scope != scope or not config.should_sample():
+        return nullcontext()
+
+    return _profile(config, name, logger)
+
+
+@contextmanager
+def _profile(config: ProfileConfig, name: str, logger: Logger) -> Iterator[None]:
+    """Profile the enclosed block, unless another block is being
+    profiled.
+    """
+    if not _profile_lock.acquire(blocking=False):  # pylint: disable=consider-using-with
+        logger.warning('Not profiling %s, as another conversion is being profiled', name)
+        yield
+        return
+
+    try:
+        pathlib.Path(config.directory).mkdir(parents=True, exist_ok=True)
+        file_prefix = path_join(
+            config.directory,
+            f'{re.sub(r"[^A-Za-z0-9_.-]", "_", name)}-{time.strftime("%Y%m%dT%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        )
+
+        # Leave tracing that was started outside net2cog running
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started:
+                tracemalloc.stop()
+
+            profiler.dump_stats(f'{file_prefix}.prof')
+            with open(f'{file_prefix}.tracemalloc.txt', 'w', encoding='utf-8') as file_handler:
+                file_handler.write(f'Memory traced in the process while profiling {name}, including any '
+                                   f'concurrent conversions: current {current} B, peak {peak} B\n')
+                file_handler.write('Top allocation sites in the process:\n')
+                for statistic in snapshot.statistics('lineno')[:config.top_allocations]:
+                    file_handler.write(f'{statistic}\n')
+    finally:
+        _profile_lock.release()
+
+        logger.info('Wrote profile for %s to %s.*', name, file_prefix)
@@ -0,0 +1,207 @@
+"""
+===========
+quantize.py
+===========
+
+Opt-in lossy quantization of floating point variables. Many geophysical
+variables, such as sea surface salinity and temperature, are only meaningful
+to a few significant digits, but are stored with full float32 mantissas,
+whose noisy low bits barely compress. Quantization zeroes those bits before
+the COG is compressed, with one of two precisions:
+
+* significant bits: bit rounding, keeping `N` bits of each value's mantissa
+  and rounding half to even, so the relative error is at most `2**-(N+1)`;
+* least significant digit: rounding to the power of two just finer than
+  `10**-D`, as the netCDF4 library does for `least_significant_digit`, so
+  the absolute error is at most `0.5 * 10**-D`. Scaling by a power of two is
+  exact, and the rounded values have trailing zero bits.
+
+The valid pixels of the intermediate GeoTIFF are quantized in place, one
+window of rows at a time, after out of range values are masked and before
+the band statistics are computed. Nodata, NaN and infinite pixels are not
+changed, nor are integer variables, and values that would round to nodata
+or overflow are kept exact. The precision and the largest absolute
+error are written to the COG metadata as `NET2COG_QUANTIZE_BITS` or
+`NET2COG_QUANTIZE_DIGITS`, and `NET2COG_QUANTIZE_MAX_ERROR`.
+
+Quantization is configured with environment variables:
+
+* `QUANTIZE_BITS`: number of mantissa bits to keep.
+* `QUANTIZE_DIGITS`: least significant decimal digit to keep, e.g. 2 for a
+  precision of 0.01. Only one of `QUANTIZE_BITS` and `QUANTIZE_DIGITS` may be
+  set; quantization is disabled when neither is.
+* `QUANTIZE_VARIABLES`: comma separated variables to quantize. Defaults to
+  every floating point variable.
+
+See `benchmarks/quantization.py` for the compression gain and error of each
+precision.
+"""
+
+import math
+import os
+from dataclasses import dataclass, field
+from logging import Logger
+
+import numpy as np
+import rasterio
+
+from net2cog.statistics import row_windows
+
+QUANTIZE_BITS_ENV = 'QUANTIZE_BITS'
+QUANTIZE_DIGITS_ENV = 'QUANTIZE_DIGITS'
+QUANTIZE_VARIABLES_ENV = 'QUANTIZE_VARIABLES'
+
+BITS_KEY = 'NET2COG_QUANTIZE_BITS'
+DIGITS_KEY = 'NET2COG_QUANTIZE_DIGITS'
+MAX_ERROR_KEY = 'NET2COG_QUANTIZE_MAX_ERROR'
+
+# Explicit mantissa bits of each floating point type, and the unsigned
+# integer type of the same size
+MANTISSA_BITS = {np.dtype('float32'): (23, np.uint32), np.dtype('float64'): (52, np.uint64)}
+
+
+@dataclass
+class QuantizeConfig:
+    """The precision variables are quantized to, if any."""
+
+    significant_bits: int | None = None
+    significant_digits: int | None = None
+    variables: list[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if self.significant_bits is not None and self.significant_digits is not None:
+            raise ValueError('Only one of significant bits and significant digits may be set')
+        if self.significant_bits is not None and self.significant_bits < 1:
+            raise ValueError(f'Significant bits must be at least 1, not {self.significant_bits}')
+
+    @classmethod
+    def from_environment(cls) -> 'QuantizeConfig':
+        """Build the quantization configuration from the environment."""
+        bits = os.getenv(QUANTIZE_BITS_ENV)
+        digits = os.getenv(QUANTIZE_DIGITS_ENV)
+        variables = os.getenv(QUANTIZE_VARIABLES_ENV, '')
+        return cls(
+            significant_bits=int(bits) if bits else None,
+            significant_digits=int(digits) if digits else None,
+            variables=[variable.strip() for variable in variables.split(',') if variable.strip()],
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any variable is quantized."""
+        return self.significant_bits is not None or self.significant_digits is not None
+
+    def applies(self, variable_name: str) -> bool:
+        """Whether a variable is quantized."""
+        return self.enabled and (not self.variables or variable_name.strip('/') in self.variables)
+
+    def round(self, data: np.ndarray) -> np.ndarray:
+        """Quantize floating point data to the configured precision."""
+        if self.significant_bits is not None:
+            return bit_round(data, self.significant_bits)
+        return digit_round(data, self.significant_digits)
+
+
+def bit_round(data: np.ndarray, keepbits: int) -> np.ndarray:
+    """
+    Round each value to `keepbits` mantissa bits, half to even, setting the
+    other mantissa bits to zero.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        float32 or float64 data, which is not modified. Values must be
+        finite.
+    keepbits : int
+        Number of explicit mantissa bits to keep.
+    """
+    mantissa_bits, uint = MANTISSA_BITS[data.dtype]
+    maskbits = mantissa_bits - keepbits
+    if maskbits <= 0:
+        return data.copy()
+
+    bits = data.view(uint).copy()
+    # Add half of the dropped bits, less one if the last kept bit is even,
+    # so ties round to even
+    bits += ((bits >> uint(maskbits)) & uint(1)) + uint((1 << (maskbits - 1)) - 1)
+    bits &= ~uint((1 << maskbits) - 1)
+    return bits.view(data.dtype)
+
+
+def digit_round(data: np.ndarray, digits: int) -> np.ndarray:
+    """
+    Round each value to a multiple of the power of two just finer than
+    `10**-digits`.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        Floating point data, which is not modified.
+    digits : int
+        Least significant decimal digit to keep, negative for digits left of
+        the decimal point.
+    """
+    scale = data.dtype.type(2.0 ** math.ceil(math.log2(10.0 ** digits)))
+    return np.around(data * scale) / scale
+
+
+def quantize(dataset: rasterio.io.DatasetWriter, config: QuantizeConfig | None, variable_name: str,
+             logger: Logger) -> dict[str, str] | None:
+    """
+    Quantize the valid pixels of a GeoTIFF opened for update, and write the
+    precision and largest error to its metadata.
+
+    Parameters
+    ----------
+    dataset : rasterio.io.DatasetWriter
+        Intermediate GeoTIFF of the variable, with its nodata value set.
+    config : QuantizeConfig | None
+        Quantization configuration. Nothing is quantized if None.
+    variable_name : str
+        Name of the variable, with its group path.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+
+    Returns
+    -------
+    dict[str, str] | None
+        The metadata written, or None if the variable was not quantized.
+    """
+    if config is None or not config.applies(variable_name):
+        return None
+    dtype = np.dtype(dataset.dtypes[0])
+    if dtype not in MANTISSA_BITS:
+        logger.info('Not quantizing %s, of type %s', variable_name, dtype)
+        return None
+
+    nodata = dataset.nodata
+    max_error = 0.0
+    for band in dataset.indexes:
+        for window in row_windows(dataset):
+            data = dataset.read(band, window=window)
+            valid = np.isfinite(data)
+            if nodata is not None and not np.isnan(nodata):
+                valid &= data != nodata
+            if not valid.any():
+                continue
+            with np.errstate(over='ignore', invalid='ignore'):
+                rounded = config.round(np.where(valid, data, 0))
+            # Values rounded to nodata, or overflowing to infinity near the
+            # largest float, are kept exact
+            kept = ~valid | ~np.isfinite(rounded)
+            if nodata is not None and not np.isnan(nodata):
+                kept |= rounded == nodata
+            rounded = np.where(kept, data, rounded)
+            max_error = max(max_error, float(np.abs(rounded[valid] - data[valid]).max()))
+            dataset.write(rounded, band, window=window)
+
+    metadata = {MAX_ERROR_KEY: repr(max_error)}
+    if config.significant_bits is not None:
+        metadata[BITS_KEY] = str(config.significant_bits)
+    else:
+        metadata[DIGITS_KEY] = str(config.significant_digits)
+    dataset.update_tags(**metadata)
+    logger.info('Quantized %s to %s, with a maximum absolute error of %s', variable_name,
+                f'{config.significant_bits} significant bits' if config.significant_bits is not None
+                else f'{config.significant_digits} decimal digits', max_error)
+    return metadata
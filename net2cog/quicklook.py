@@ -0,0 +1,171 @@
+"""
+============
+quicklook.py
+============
+
+Quicklook PNG previews of each converted variable, for portals to show
+without reading the COG. The preview is rendered from a decimated read of
+the finished COG, which GDAL serves from the smallest overview level at
+least as large as the preview, so only a small fraction of the COG is read
+and decoded. Variables too small to have overviews are decimated from their
+full resolution.
+
+The valid values of the preview are stretched between their 2nd and 98th
+percentiles and mapped through a colormap. Nodata, masked and NaN pixels are
+transparent. The PNG of the COG `<variable name>.tif` is written to the
+output directory as `<variable name>.png`, which the Harmony adapter stages
+as a `thumbnail` asset of the item.
+
+Quicklooks are configured with environment variables:
+
+* `QUICKLOOK`: set to `true` to write quicklooks. Defaults to `false`.
+* `QUICKLOOK_SIZE`: width or height of the quicklook, whichever is larger, in
+  pixels. Defaults to 256. Quicklooks are never larger than the COG.
+* `QUICKLOOK_COLORMAP`: one of `viridis` (default), `magma`, `coolwarm` or
+  `gray`.
+"""
+
+import os
+import time
+from dataclasses import dataclass
+from logging import Logger
+from os.path import basename, join, splitext
+
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+
+QUICKLOOK_ENV = 'QUICKLOOK'
+QUICKLOOK_SIZE_ENV = 'QUICKLOOK_SIZE'
+QUICKLOOK_COLORMAP_ENV = 'QUICKLOOK_COLORMAP'
+
+DEFAULT_QUICKLOOK_SIZE = 256
+DEFAULT_COLORMAP = 'viridis'
+
+# Percentiles of the valid values mapped to the ends of the colormap
+STRETCH_PERCENTILES = (2, 98)
+
+# Evenly spaced RGB control points of each colormap, interpolated to 256
+# colors
+COLORMAPS = {
+    'viridis': [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)],
+    'magma': [(0, 0, 4), (81, 18, 124), (183, 55, 121), (252, 137, 97), (252, 253, 191)],
+    'coolwarm': [(59, 76, 192), (141, 176, 254), (221, 221, 221), (244, 154, 123), (180, 4, 38)],
+    'gray': [(0, 0, 0), (255, 255, 255)],
+}
+
+
+@dataclass
+class QuicklookConfig:
+    """Whether quicklooks are written, and their size and colormap."""
+
+    enabled: bool = False
+    size: int = DEFAULT_QUICKLOOK_SIZE
+    colormap: str = DEFAULT_COLORMAP
+
+    def __post_init__(self):
+        if self.colormap not in COLORMAPS:
+            raise ValueError(f'Unknown quicklook colormap {self.colormap}, expected one of {list(COLORMAPS)}')
+        if self.size < 1:
+            raise ValueError(f'Quicklook size must be at least 1, not {self.size}')
+
+    @classmethod
+    def from_environment(cls) -> 'QuicklookConfig':
+        """Build the quicklook configuration from the environment."""
+        return cls(
+            enabled=os.getenv(QUICKLOOK_ENV, 'false').lower() == 'true',
+            size=int(os.getenv(QUICKLOOK_SIZE_ENV, str(DEFAULT_QUICKLOOK_SIZE))),
+            colormap=os.getenv(QUICKLOOK_COLORMAP_ENV, DEFAULT_COLORMAP),
+        )
+
+
+def quicklook_file(output_directory: str, cog_file: str) -> str:
+    """The quicklook of a COG, `<variable name>.png` in the output
+    directory.
+    """
+    return join(output_directory, f'{splitext(basename(cog_file))[0]}.png')
+
+
+def colormap_table(name: str) -> np.ndarray:
+    """The 256 RGB colors of a colormap, as a (256, 3) uint8 array."""
+    control_points = np.array(COLORMAPS[name], dtype=np.float64)
+    positions = np.linspace(0, 1, len(control_points))
+    levels = np.linspace(0, 1, 256)
+    return np.stack([np.interp(levels, positions, control_points[:, channel]) for channel in range(3)],
+                    axis=1).round().astype(np.uint8)
+
+
+def _quicklook_shape(height: int, width: int, size: int) -> tuple[int, int]:
+    """Shape of the quicklook of a raster, at most `size` pixels wide and high
+    and keeping its aspect ratio.
+    """
+    scale = min(1.0, size / max(height, width))
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def render(data: np.ma.MaskedArray, colormap: str) -> np.ndarray:
+    """
+    Map the valid values of a band through a colormap.
+
+    Parameters
+    ----------
+    data : numpy.ma.MaskedArray
+        Band values, masked where nodata.
+    colormap : str
+        Name of the colormap.
+
+    Returns
+    -------
+    numpy.ndarray
+        (4, height, width) uint8 RGBA image, transparent where `data` is
+        masked or not finite.
+    """
+    values = data.filled(np.nan).astype(np.float64)
+    valid = np.isfinite(values)
+    rgba = np.zeros((4,) + values.shape, dtype=np.uint8)
+    if not valid.any():
+        return rgba
+
+    low, high = np.percentile(values[valid], STRETCH_PERCENTILES)
+    scaled = (values - low) / (high - low) if high > low else np.zeros_like(values)
+    indices = np.clip(np.nan_to_num(scaled) * 255, 0, 255).round().astype(np.uint8)
+    rgba[:3] = np.moveaxis(colormap_table(colormap)[indices], -1, 0)
+    rgba[3] = np.where(valid, 255, 0)
+    return rgba
+
+
+def write_quicklook(cog_file: str, output_file: str, config: QuicklookConfig, logger: Logger) -> str:
+    """
+    Write the quicklook PNG of the first band of a COG.
+
+    Parameters
+    ----------
+    cog_file : str
+        The COG, which may be in memory.
+    output_file : str
+        Path of the PNG, as returned by `quicklook_file`.
+    config : QuicklookConfig
+        Size and colormap of the quicklook.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+
+    Returns
+    -------
+    str
+        `output_file`.
+    """
+    start = time.perf_counter()
+    with rasterio.open(cog_file) as dataset:
+        shape = _quicklook_shape(dataset.height, dataset.width, config.size)
+        # Served from the smallest overview at least as large as the
+        # quicklook
+        data = dataset.read(1, out_shape=shape, masked=True, resampling=Resampling.nearest)
+
+    rgba = render(data, config.colormap)
+    with rasterio.open(output_file, 'w', driver='PNG', width=shape[1], height=shape[0], count=4,
+                       dtype='uint8') as quicklook:
+        quicklook.write(rgba)
+
+    logger.info('Wrote %d x %d quicklook %s in %.2f s', shape[1], shape[0], output_file,
+                time.perf_counter() - start)
+    return output_file
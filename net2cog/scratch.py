@@ -0,0 +1,226 @@
+"""
+==========
+scratch.py
+==========
+
+Scratch space for the intermediate GeoTIFFs and output COGs written while
+converting a NetCDF file.
+
+Three backends are supported:
+
+* `disk`: files are written to the local file system (the default).
+* `tmpfs`: files are written to a memory-backed directory, e.g. `/dev/shm`.
+* `vsimem`: intermediate files are written to the GDAL in-memory file system.
+  Output COGs are still written to the local file system, as staging uploads
+  them from a file path.
+
+Memory-backed files are accounted against a budget. When a file would exceed
+the remaining budget it is written to disk instead.
+"""
+
+import os
+import pathlib
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+from logging import Logger, getLogger
+from os.path import join as path_join
+from tempfile import TemporaryDirectory, mkdtemp
+from typing import Iterator
+
+import rasterio.shutil
+from rasterio.errors import RasterioIOError
+
+SCRATCH_BACKEND_ENV = 'SCRATCH_BACKEND'
+SCRATCH_DIRECTORY_ENV = 'SCRATCH_DIRECTORY'
+SCRATCH_MEMORY_BUDGET_ENV = 'SCRATCH_MEMORY_BUDGET'
+
+SCRATCH_BACKENDS = ['disk', 'tmpfs', 'vsimem']
+DEFAULT_MEMORY_DIRECTORY = '/dev/shm'
+DEFAULT_MEMORY_BUDGET = 2 * 1024 ** 3
+VSIMEM_PREFIX = '/vsimem/net2cog'
+
+
+@dataclass
+class ScratchUsage:
+    """Accounting of the files written to scratch space."""
+
+    memory_in_use: int = 0
+    memory_peak: int = 0
+    memory_files: int = 0
+    disk_bytes_written: int = 0
+    disk_files: int = 0
+    memory_fallbacks: int = 0
+
+
+class ScratchSpace:  # pylint: disable=too-many-instance-attributes
+    """
+    Location for intermediate and output files, backed by disk or memory.
+
+    Parameters
+    ----------
+    backend : str
+        One of `disk`, `tmpfs` or `vsimem`.
+    memory_directory : str
+        Memory-backed directory used by the `tmpfs` backend.
+    memory_budget : int
+        Maximum number of bytes held in memory at any one time. Files that
+        would exceed this budget are written to disk.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+
+    def __init__(
+        self,
+        backend: str = 'disk',
+        memory_directory: str = DEFAULT_MEMORY_DIRECTORY,
+        memory_budget: int = DEFAULT_MEMORY_BUDGET,
+        logger: Logger | None = None,
+    ):
+        if backend not in SCRATCH_BACKENDS:
+            raise ValueError(f'Unknown scratch backend {backend}, expected one of {SCRATCH_BACKENDS}')
+
+        self.backend = backend
+        self.memory_directory = memory_directory
+        self.memory_budget = memory_budget
+        self.logger = logger or getLogger(__name__)
+        self.usage = ScratchUsage()
+
+        self._lock = threading.Lock()
+        self._reservations: dict[str, int] = {}
+        self._memory_root: str | None = None
+
+    @classmethod
+    def from_environment(cls, logger: Logger | None = None) -> 'ScratchSpace':
+        """Build the scratch space configured by `SCRATCH_BACKEND`,
+        `SCRATCH_DIRECTORY` and `SCRATCH_MEMORY_BUDGET`.
+        """
+        return cls(
+            backend=os.getenv(SCRATCH_BACKEND_ENV, 'disk'),
+            memory_directory=os.getenv(SCRATCH_DIRECTORY_ENV, DEFAULT_MEMORY_DIRECTORY),
+            memory_budget=int(os.getenv(SCRATCH_MEMORY_BUDGET_ENV, str(DEFAULT_MEMORY_BUDGET))),
+            logger=logger,
+        )
+
+    @property
+    def memory_root(self) -> str | None:
+        """Directory, or GDAL `/vsimem/` prefix, holding in-memory files.
+        This is created on first use, and removed by `cleanup`.
+        """
+        with self._lock:
+            if self._memory_root is None:
+                if self.backend == 'tmpfs':
+                    pathlib.Path(self.memory_directory).mkdir(parents=True, exist_ok=True)
+                    self._memory_root = mkdtemp(prefix='net2cog-', dir=self.memory_directory)
+                elif self.backend == 'vsimem':
+                    self._memory_root = f'{VSIMEM_PREFIX}/{uuid.uuid4().hex}'
+
+            return self._memory_root
+
+    def is_in_memory(self, path: str) -> bool:
+        """Whether the file is held in memory, and counted against the budget."""
+        return path in self._reservations
+
+    def _reserve(self, path: str, estimated_size: int) -> bool:
+        """Reserve memory for a file, returning False if it does not fit."""
+        if self.memory_root is None:
+            return False
+
+        with self._lock:
+            available = self.memory_budget - self.usage.memory_in_use
+            if self.backend == 'tmpfs':
+                available = min(available, shutil.disk_usage(self.memory_directory).free)
+
+            if estimated_size > available:
+                self.usage.memory_fallbacks += 1
+                self.logger.info('%s (%d bytes) exceeds the %d bytes of scratch memory available. '
+                                 'Falling back to disk.', path, estimated_size, available)
+                return False
+
+            self._reservations[path] = estimated_size
+            self.usage.memory_in_use += estimated_size
+            self.usage.memory_peak = max(self.usage.memory_peak, self.usage.memory_in_use)
+            self.usage.memory_files += 1
+            return True
+
+    def account_file(self, path: str):
+        """Record a file written to disk in the scratch usage."""
+        if not self.is_in_memory(path) and os.path.isfile(path):
+            with self._lock:
+                self.usage.disk_bytes_written += os.path.getsize(path)
+                self.usage.disk_files += 1
+
+    @contextmanager
+    def intermediate_file(self, basename: str, estimated_size: int) -> Iterator[str]:
+        """
+        Path for a temporary file that is removed when the context exits.
+
+        Parameters
+        ----------
+        basename : str
+            Name of the file, without a directory.
+        estimated_size : int
+            Expected size of the file in bytes, used to decide whether it
+            fits in the in-memory budget.
+        """
+        path = path_join(self.memory_root, uuid.uuid4().hex, basename) if self.memory_root else None
+
+        if path is not None and self._reserve(path, estimated_size):
+            if self.backend == 'tmpfs':
+                pathlib.Path(path).parent.mkdir()
+            try:
+                yield path
+            finally:
+                self.release(path)
+        else:
+            with TemporaryDirectory() as tempdir:
+                path = path_join(tempdir, basename)
+                try:
+                    yield path
+                finally:
+                    self.account_file(path)
+
+    def output_file(self, output_directory: str, basename: str, estimated_size: int) -> str:
+        """
+        Path for an output file that must outlive the conversion, e.g. to
+        be staged. With the `tmpfs` backend this is in memory if it fits in
+        the budget, and must be freed with `release` once it is no longer
+        needed. Otherwise the file is in the output directory.
+        """
+        if self.backend == 'tmpfs':
+            path = path_join(self.memory_root, uuid.uuid4().hex, basename)
+            if self._reserve(path, estimated_size):
+                pathlib.Path(path).parent.mkdir()
+                return path
+
+        return path_join(output_directory, basename)
+
+    def release(self, path: str):
+        """Remove an in-memory file and return its space to the budget."""
+        with self._lock:
+            reserved = self._reservations.pop(path, None)
+            if reserved is None:
+                return
+            self.usage.memory_in_use -= reserved
+
+        if self.backend == 'vsimem':
+            try:
+                rasterio.shutil.delete(path)
+            except RasterioIOError:
+                pass
+        else:
+            shutil.rmtree(pathlib.Path(path).parent, ignore_errors=True)
+
+    def cleanup(self):
+        """Release all in-memory files, and log the scratch usage."""
+        for path in list(self._reservations):
+            self.release(path)
+
+        with self._lock:
+            if self.backend == 'tmpfs' and self._memory_root is not None:
+                shutil.rmtree(self._memory_root, ignore_errors=True)
+            self._memory_root = None
+
+        self.logger.info('Scratch usage (%s): %s', self.backend, self.usage)
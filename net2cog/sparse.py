@@ -0,0 +1,114 @@
+"""
+=========
+sparse.py
+=========
+
+Sparse COGs, in which tiles that are entirely nodata are not written. Many
+variables are mostly fill, such as ocean products over land, polar masks and
+partial daily coverage, and every empty tile would otherwise be encoded and
+stored. Readers, including GDAL, return nodata for tiles that are not
+written.
+
+The intermediate GeoTIFF is scanned once, one window of whole tile rows at a
+time, and the tiles of the COG blocksize whose pixels are all nodata (or NaN)
+in every band are counted with vectorized comparisons. If there are any, the
+COG is written with GDAL's `SPARSE_OK` creation option, so empty tiles are
+not written at full resolution or in the overviews, and their number is
+written to the COG metadata as `NET2COG_EMPTY_TILES`. Variables without a
+nodata value are never sparse.
+
+Sparse COGs are enabled by setting `SPARSE_TILES` to `true`.
+"""
+
+import os
+from logging import Logger
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from net2cog.statistics import WINDOW_BYTES
+
+SPARSE_TILES_ENV = 'SPARSE_TILES'
+EMPTY_TILES_KEY = 'NET2COG_EMPTY_TILES'
+
+
+def sparse_from_environment() -> bool:
+    """Whether sparse COGs are enabled in the environment."""
+    return os.getenv(SPARSE_TILES_ENV, 'false').lower() == 'true'
+
+
+def _empty(data: np.ndarray, nodata: float) -> np.ndarray:
+    """Whether each pixel is nodata."""
+    if np.isnan(nodata):
+        return np.isnan(data)
+    return data == nodata
+
+
+def empty_tiles(dataset: rasterio.io.DatasetReader, blocksize: int) -> tuple[int, int]:
+    """
+    Count the tiles of a dataset that are entirely nodata in every band.
+
+    Parameters
+    ----------
+    dataset : rasterio.io.DatasetReader
+        The intermediate GeoTIFF, with its nodata value set.
+    blocksize : int
+        Width and height of the COG tiles.
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of empty tiles, and the number of tiles.
+    """
+    tile_rows = -(-dataset.height // blocksize)
+    tile_columns = -(-dataset.width // blocksize)
+    nodata = dataset.nodata
+    if nodata is None:
+        return 0, tile_rows * tile_columns
+
+    tile_row_bytes = dataset.count * blocksize * dataset.width * np.dtype(dataset.dtypes[0]).itemsize
+    rows = blocksize * max(1, WINDOW_BYTES // tile_row_bytes)
+    empty = 0
+    for row in range(0, dataset.height, rows):
+        window = Window(0, row, dataset.width, min(rows, dataset.height - row))
+        pixels = _empty(dataset.read(window=window), nodata).all(axis=0)
+        # Pixels past the edge of the raster are empty
+        pixels = np.pad(pixels, [(0, -pixels.shape[0] % blocksize), (0, -pixels.shape[1] % blocksize)],
+                        constant_values=True)
+        tiles = pixels.reshape((-1, blocksize, tile_columns, blocksize)).all(axis=(1, 3))
+        empty += int(tiles.sum())
+
+    return empty, tile_rows * tile_columns
+
+
+def sparse_profile(dataset: rasterio.io.DatasetWriter, dst_profile: dict, sparse: bool, variable_name: str,
+                   logger: Logger) -> dict:
+    """
+    Scan the intermediate GeoTIFF of a variable for empty tiles, and return
+    the COG profile writing them sparsely if there are any.
+
+    Parameters
+    ----------
+    dataset : rasterio.io.DatasetWriter
+        The intermediate GeoTIFF, opened for update, with its nodata value
+        set. The number of empty tiles is written to its metadata.
+    dst_profile : dict
+        rio-cogeo COG profile, with the blocksize.
+    sparse : bool
+        Whether sparse COGs are enabled.
+    variable_name : str
+        Name of the variable, with its group path.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    """
+    if not sparse:
+        return dst_profile
+
+    empty, total = empty_tiles(dataset, int(dst_profile['blockxsize']))
+    logger.info('%d of %d tiles of %s are empty', empty, total, variable_name)
+    if not empty:
+        return dst_profile
+
+    dataset.update_tags(**{EMPTY_TILES_KEY: str(empty)})
+    return {**dst_profile, 'sparse_ok': True}
@@ -0,0 +1,293 @@
+"""
+==========
+staging.py
+==========
+
+Staging of output COGs to S3. Each file is read once: its size and checksum
+are computed from the bytes as they are uploaded, so they can be added to the
+output STAC without fetching the staged object.
+
+The checksum algorithm is configured with `CHECKSUM_ALGORITHM`, one of the
+`hashlib` algorithms in `MULTIHASH_CODES`. Checksums are given as hex-encoded
+multihashes, as required by the STAC file extension.
+
+Files of at least `MULTIPART_THRESHOLD` bytes are uploaded as S3 multipart
+uploads, with parts of `MULTIPART_PART_SIZE` bytes uploaded in parallel by
+`MULTIPART_CONCURRENCY` threads. A part that fails is retried, up to
+`MULTIPART_MAX_ATTEMPTS` times, after an exponential backoff starting at
+`MULTIPART_RETRY_BACKOFF` seconds. Smaller files are uploaded in a single
+request, as by `harmony_service_lib.util.stage`.
+"""
+
+import hashlib
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from logging import Logger
+
+import boto3
+from botocore.exceptions import BotoCoreError, ClientError
+from harmony_service_lib.aws import aws_parameters
+from harmony_service_lib.util import Config
+
+CHECKSUM_ALGORITHM_ENV = 'CHECKSUM_ALGORITHM'
+DEFAULT_CHECKSUM_ALGORITHM = 'sha256'
+
+# Multihash function codes, see https://github.com/multiformats/multicodec
+MULTIHASH_CODES = {
+    'md5': 0xd5,
+    'sha1': 0x11,
+    'sha256': 0x12,
+    'sha512': 0x13,
+    'sha3_512': 0x14,
+    'sha3_384': 0x15,
+    'sha3_256': 0x16,
+}
+
+READ_SIZE = 8 * 1024 ** 2
+
+MULTIPART_THRESHOLD_ENV = 'MULTIPART_THRESHOLD'
+MULTIPART_PART_SIZE_ENV = 'MULTIPART_PART_SIZE'
+MULTIPART_CONCURRENCY_ENV = 'MULTIPART_CONCURRENCY'
+MULTIPART_MAX_ATTEMPTS_ENV = 'MULTIPART_MAX_ATTEMPTS'
+MULTIPART_RETRY_BACKOFF_ENV = 'MULTIPART_RETRY_BACKOFF'
+
+# S3 rejects parts, other than the last, smaller than 5 MiB
+MIN_PART_SIZE = 5 * 1024 ** 2
+
+
+@dataclass
+class StagedFile:
+    """The URL, size in bytes and multihash checksum of a staged file."""
+
+    url: str
+    size: int
+    checksum: str
+
+
+@dataclass
+class MultipartConfig:
+    """When and how to upload files as S3 multipart uploads."""
+
+    threshold: int = 256 * 1024 ** 2
+    part_size: int = 64 * 1024 ** 2
+    concurrency: int = 8
+    max_attempts: int = 5
+    retry_backoff: float = 1.0
+
+    def __post_init__(self):
+        if self.part_size < MIN_PART_SIZE:
+            raise ValueError(f'Multipart part size {self.part_size} is smaller than the S3 minimum '
+                             f'of {MIN_PART_SIZE} bytes')
+        self.concurrency = max(self.concurrency, 1)
+        self.max_attempts = max(self.max_attempts, 1)
+
+    @classmethod
+    def from_environment(cls) -> 'MultipartConfig':
+        """Build the multipart configuration from the `MULTIPART_*`
+        environment variables.
+        """
+        defaults = cls()
+        return cls(
+            threshold=int(os.getenv(MULTIPART_THRESHOLD_ENV, str(defaults.threshold))),
+            part_size=int(os.getenv(MULTIPART_PART_SIZE_ENV, str(defaults.part_size))),
+            concurrency=int(os.getenv(MULTIPART_CONCURRENCY_ENV, str(defaults.concurrency))),
+            max_attempts=int(os.getenv(MULTIPART_MAX_ATTEMPTS_ENV, str(defaults.max_attempts))),
+            retry_backoff=float(os.getenv(MULTIPART_RETRY_BACKOFF_ENV, str(defaults.retry_backoff))),
+        )
+
+
+def _varint(value: int) -> bytes:
+    """Unsigned varint encoding, as used by multihash."""
+    encoded = bytearray()
+    while True:
+        byte, value = value & 0x7f, value >> 7
+        if value:
+            encoded.append(byte | 0x80)
+        else:
+            encoded.append(byte)
+            return bytes(encoded)
+
+
+class ChecksumReader:
+    """
+    Read-only file wrapper that computes the size and checksum of the bytes
+    read through it.
+    """
+
+    def __init__(self, file_handler, algorithm: str):
+        if algorithm not in MULTIHASH_CODES:
+            raise ValueError(f'Unknown checksum algorithm {algorithm}, '
+                             f'expected one of {list(MULTIHASH_CODES)}')
+        self.algorithm = algorithm
+        self.size = 0
+        self._file_handler = file_handler
+        self._hash = hashlib.new(algorithm)
+
+    def read(self, size: int = -1) -> bytes:
+        """Read from the wrapped file, updating the size and checksum."""
+        data = self._file_handler.read(size)
+        self._hash.update(data)
+        self.size += len(data)
+        return data
+
+    def drain(self):
+        """Read the remainder of the file."""
+        while self.read(READ_SIZE):
+            pass
+
+    @property
+    def checksum(self) -> str:
+        """Hex-encoded multihash of the bytes read so far."""
+        digest = self._hash.digest()
+        return (_varint(MULTIHASH_CODES[self.algorithm]) + _varint(len(digest)) + digest).hex()
+
+
+def staging_destination(remote_filename: str, location: str | None, cfg: Config) -> tuple[str, str]:
+    """
+    Return the bucket and key for a staged file, as chosen by
+    `harmony_service_lib.aws.stage`.
+    """
+    if location is None:
+        key = f'{cfg.staging_path}/{remote_filename}' if cfg.staging_path else remote_filename
+        return cfg.staging_bucket, key
+
+    _, _, staging_bucket, staging_path = location.split('/', 3)
+    return staging_bucket, staging_path + remote_filename
+
+
+def s3_client(cfg: Config):
+    """A boto3 S3 client for the Harmony runtime environment."""
+    return boto3.client(
+        's3', **aws_parameters(cfg.use_localstack, cfg.localstack_host, cfg.aws_default_region)
+    )
+
+
+def _upload_part(  # pylint: disable=too-many-arguments
+    client,
+    destination: dict,
+    part_number: int,
+    data: bytes,
+    multipart: MultipartConfig,
+    logger: Logger,
+) -> dict:
+    """Upload one part, retrying with exponential backoff and jitter."""
+    attempt = 1
+    while True:
+        try:
+            response = client.upload_part(PartNumber=part_number, Body=data, **destination)
+            return {'PartNumber': part_number, 'ETag': response['ETag']}
+        except (BotoCoreError, ClientError) as error:
+            if attempt >= multipart.max_attempts:
+                raise
+            delay = multipart.retry_backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+            logger.warning('Part %d of %s failed (attempt %d of %d), retrying in %.1fs: %s',
+                           part_number, destination['Key'], attempt, multipart.max_attempts, delay, error)
+            time.sleep(delay)
+            attempt += 1
+
+
+def _multipart_upload(  # pylint: disable=too-many-arguments,too-many-locals
+    reader: ChecksumReader,
+    bucket: str,
+    key: str,
+    mime: str,
+    multipart: MultipartConfig,
+    logger: Logger,
+    cfg: Config,
+):
+    """
+    Upload a file as an S3 multipart upload. Parts are read in order, so the
+    checksum is computed in a single pass, and uploaded in parallel. At most
+    `concurrency` parts are held in memory at once. The upload is aborted if
+    any part fails after all its attempts.
+    """
+    client = s3_client(cfg)
+    upload_id = client.create_multipart_upload(Bucket=bucket, Key=key, ContentType=mime)['UploadId']
+    destination = {'Bucket': bucket, 'Key': key, 'UploadId': upload_id}
+    logger.info('Started multipart upload of s3://%s/%s in parts of %d bytes', bucket, key, multipart.part_size)
+
+    in_flight = threading.BoundedSemaphore(multipart.concurrency)
+    failed = threading.Event()
+
+    def part_done(future: Future):
+        if future.exception() is not None:
+            failed.set()
+        in_flight.release()
+
+    futures: list[Future] = []
+    try:
+        with ThreadPoolExecutor(max_workers=multipart.concurrency) as executor:
+            part_number = 1
+            # Stop reading once a part has failed, the upload will be aborted
+            while not failed.is_set() and (data := reader.read(multipart.part_size)):
+                in_flight.acquire()  # pylint: disable=consider-using-with
+                future = executor.submit(_upload_part, client, destination, part_number, data, multipart, logger)
+                future.add_done_callback(part_done)
+                futures.append(future)
+                part_number += 1
+
+        parts = [future.result() for future in futures]
+        client.complete_multipart_upload(MultipartUpload={'Parts': parts}, **destination)
+    except BaseException:
+        logger.error('Aborting multipart upload of s3://%s/%s', bucket, key)
+        client.abort_multipart_upload(**destination)
+        raise
+
+    logger.info('Uploaded s3://%s/%s in %d parts', bucket, key, len(parts))
+
+
+def stage_file(  # pylint: disable=too-many-arguments
+    local_filename: str,
+    remote_filename: str,
+    mime: str,
+    location: str | None,
+    logger: Logger,
+    cfg: Config,
+    checksum_algorithm: str = DEFAULT_CHECKSUM_ALGORITHM,
+    multipart: MultipartConfig | None = None,
+) -> StagedFile:
+    """
+    Stage a file to S3, as `harmony_service_lib.util.stage` does, computing
+    its size and checksum from the bytes uploaded.
+
+    Parameters
+    ----------
+    local_filename : str
+        Path to the file to stage.
+    remote_filename : str
+        The basename of the staged file.
+    mime : str
+        The mime type of the staged file.
+    location : str | None
+        The S3 prefix URL under which to place the file.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+    cfg : harmony_service_lib.util.Config
+        The configuration for the current runtime environment.
+    checksum_algorithm : str
+        The `hashlib` algorithm for the checksum.
+    multipart : MultipartConfig | None
+        Multipart upload configuration for large files. Files are always
+        uploaded in a single request when None.
+    """
+    bucket, key = staging_destination(remote_filename, location, cfg)
+
+    with open(local_filename, 'rb') as file_handler:
+        reader = ChecksumReader(file_handler, checksum_algorithm)
+        if cfg.env in ['dev', 'test'] and not cfg.use_localstack:
+            logger.warning('ENV=%s and not using localstack, so we will not stage %s to %s',
+                           cfg.env, local_filename, key)
+            reader.drain()
+            url = 'http://example.com/' + key
+        elif multipart is not None and os.path.getsize(local_filename) >= multipart.threshold:
+            _multipart_upload(reader, bucket, key, mime, multipart, logger, cfg)
+            url = f's3://{bucket}/{key}'
+        else:
+            s3_client(cfg).upload_fileobj(reader, bucket, key, ExtraArgs={'ContentType': mime})
+            url = f's3://{bucket}/{key}'
+
+    return StagedFile(url, reader.size, reader.checksum)
@@ -0,0 +1,267 @@
+"""
+=============
+statistics.py
+=============
+
+Band statistics and histograms for output COGs. These are written as GDAL
+band metadata, using the `STATISTICS_*` keys GDAL reads, so tile servers and
+clients can scale colors without reading the data.
+
+Statistics and histograms are computed in a single pass, one window of
+whole rows at a time. As the histogram covers the minimum to the maximum of
+the band, which are only known at the end, values are counted in fine bins
+and rebinned into the histogram buckets at the end:
+
+* integers of at most 16 bits are counted per value, so their histogram is
+  exact;
+* other values are counted in `FINE_BINS_PER_BUCKET` bins per bucket, over a
+  range that doubles as needed to cover every window, and each fine bin is
+  counted in the bucket of its center, so buckets are accurate to a fine bin
+  at their edges.
+"""
+
+import json
+import math
+from dataclasses import asdict, dataclass
+from typing import Iterator
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+HISTOGRAM_BINS_ENV = 'HISTOGRAM_BINS'
+DEFAULT_HISTOGRAM_BINS = 256
+
+# Data is read in windows of whole rows of about this many bytes
+WINDOW_BYTES = 64 * 1024 ** 2
+
+# Resolution of the fine bins of histograms of values that are not small
+# integers
+FINE_BINS_PER_BUCKET = 64
+
+HISTOGRAM_TAG = 'STATISTICS_HISTOGRAM'
+VALID_COUNT_TAG = 'STATISTICS_VALID_COUNT'
+
+
+@dataclass
+class BandStatistics:
+    """Statistics of the valid (not nodata, not NaN) pixels of a band."""
+
+    minimum: float | None
+    maximum: float | None
+    mean: float | None
+    stddev: float | None
+    valid_count: int
+    valid_percent: float
+    histogram: dict | None = None
+
+    def to_tags(self) -> dict[str, str]:
+        """GDAL band metadata for these statistics."""
+        tags = {
+            VALID_COUNT_TAG: str(self.valid_count),
+            'STATISTICS_VALID_PERCENT': repr(self.valid_percent),
+        }
+        if self.valid_count:
+            tags.update({
+                'STATISTICS_MINIMUM': repr(self.minimum),
+                'STATISTICS_MAXIMUM': repr(self.maximum),
+                'STATISTICS_MEAN': repr(self.mean),
+                'STATISTICS_STDDEV': repr(self.stddev),
+            })
+        if self.histogram is not None:
+            tags[HISTOGRAM_TAG] = json.dumps(self.histogram)
+        return tags
+
+    @classmethod
+    def from_tags(cls, tags: dict[str, str]) -> 'BandStatistics | None':
+        """Read statistics written by `to_tags`, or return None if the band
+        has none.
+        """
+        if VALID_COUNT_TAG not in tags:
+            return None
+
+        def optional_float(key):
+            return float(tags[key]) if key in tags else None
+
+        return cls(
+            minimum=optional_float('STATISTICS_MINIMUM'),
+            maximum=optional_float('STATISTICS_MAXIMUM'),
+            mean=optional_float('STATISTICS_MEAN'),
+            stddev=optional_float('STATISTICS_STDDEV'),
+            valid_count=int(tags[VALID_COUNT_TAG]),
+            valid_percent=float(tags['STATISTICS_VALID_PERCENT']),
+            histogram=json.loads(tags[HISTOGRAM_TAG]) if HISTOGRAM_TAG in tags else None,
+        )
+
+    def to_stac(self) -> dict:
+        """Fields of a STAC raster extension band for these statistics."""
+        statistics = asdict(self)
+        histogram = statistics.pop('histogram')
+        statistics.pop('valid_count')
+        band = {'statistics': {key: value for key, value in statistics.items() if value is not None}}
+        if histogram is not None:
+            band['histogram'] = histogram
+        return band
+
+
+def row_windows(dataset: rasterio.io.DatasetReader) -> Iterator[Window]:
+    """Windows of whole rows covering the dataset."""
+    row_bytes = dataset.width * np.dtype(dataset.dtypes[0]).itemsize
+    rows = max(1, WINDOW_BYTES // row_bytes)
+    for row in range(0, dataset.height, rows):
+        yield Window(0, row, dataset.width, min(rows, dataset.height - row))
+
+
+def _valid_values(dataset: rasterio.io.DatasetReader, band: int, window: Window) -> np.ndarray:
+    data = dataset.read(band, window=window, masked=True)
+    values = data.compressed()
+    if np.issubdtype(values.dtype, np.floating):
+        values = values[np.isfinite(values)]
+    return values
+
+
+class _Histogram:
+    """Counts of the valid values of a band in fine bins, accumulated one
+    window at a time and rebinned into the histogram buckets at the end.
+    """
+
+    def __init__(self, buckets: int, dtype: np.dtype):
+        self.buckets = buckets
+        dtype = np.dtype(dtype)
+        if np.issubdtype(dtype, np.integer) and dtype.itemsize <= 2:
+            # One bin per value
+            self.low, self.width = float(np.iinfo(dtype).min), 1.0
+            self.counts = np.zeros(2 ** (8 * dtype.itemsize), dtype=np.int64)
+            self.exact = True
+        else:
+            self.low, self.width = None, None
+            self.counts = np.zeros(buckets * FINE_BINS_PER_BUCKET, dtype=np.int64)
+            self.exact = False
+
+    def _double(self, downward: bool):
+        """Double the width of the bins, extending the range downward or
+        upward.
+        """
+        padding = np.zeros_like(self.counts)
+        counts = np.concatenate([padding, self.counts] if downward else [self.counts, padding])
+        self.counts = counts.reshape((-1, 2)).sum(axis=1)
+        if downward:
+            self.low -= self.width * self.counts.size
+        self.width *= 2
+
+    def add(self, values: np.ndarray):
+        """Count the valid values of a window, as float64."""
+        if not values.size:
+            return
+        low, high = values.min(), values.max()
+        if self.low is None:
+            self.low = low
+            self.width = (high - low) / (self.counts.size - 1) if high > low else max(abs(low), 1.0) / self.counts.size
+        while low < self.low:
+            self._double(downward=True)
+        while high >= self.low + self.width * self.counts.size:
+            self._double(downward=False)
+        indices = np.minimum(((values - self.low) / self.width).astype(np.int64), self.counts.size - 1)
+        self.counts += np.bincount(indices, minlength=self.counts.size)
+
+    def result(self, minimum: float, maximum: float) -> dict:
+        """The histogram buckets between the minimum and maximum of the
+        band.
+        """
+        bins = np.flatnonzero(self.counts)
+        # Values themselves if exact, otherwise the centers of the fine bins
+        values = self.low + (bins + (0.0 if self.exact else 0.5)) * self.width
+        buckets = np.histogram(np.clip(values, minimum, maximum), bins=self.buckets, range=(minimum, maximum),
+                               weights=self.counts[bins])[0]
+        return {
+            'count': self.buckets,
+            'min': float(minimum),
+            'max': float(maximum),
+            'buckets': buckets.astype(np.int64).tolist(),
+        }
+
+
+def _band_moments(dataset: rasterio.io.DatasetReader, band: int,
+                  histogram: _Histogram | None) -> tuple[int, float, float, float, float]:
+    """Count, mean, sum of squared deviations, minimum and maximum of the
+    valid values of a band, combining the results of each window, and count
+    them in the histogram if any.
+    """
+    count, mean, sum_squares = 0, 0.0, 0.0
+    minimum, maximum = math.inf, -math.inf
+    for window in row_windows(dataset):
+        values = _valid_values(dataset, band, window).astype(np.float64)
+        if not values.size:
+            continue
+        if histogram is not None:
+            histogram.add(values)
+        window_mean = values.mean()
+        # Chan et al. parallel combination of mean and variance
+        delta = window_mean - mean
+        combined = count + values.size
+        mean += delta * values.size / combined
+        sum_squares += ((values - window_mean) ** 2).sum() + delta ** 2 * count * values.size / combined
+        count = combined
+        minimum = min(minimum, values.min())
+        maximum = max(maximum, values.max())
+
+    return count, mean, sum_squares, minimum, maximum
+
+
+def compute_statistics(dataset: rasterio.io.DatasetReader, histogram_bins: int) -> list[BandStatistics]:
+    """
+    Compute the statistics of each band of a dataset. Pixels that are nodata,
+    masked or NaN are excluded.
+
+    The count, mean and variance of each window are combined, and the
+    histogram is accumulated in fine bins, so the data is read once.
+
+    Parameters
+    ----------
+    dataset : rasterio.io.DatasetReader
+        Open raster dataset.
+    histogram_bins : int
+        Number of histogram buckets, or 0 to skip the histogram.
+    """
+    band_statistics = []
+
+    for band in dataset.indexes:
+        histogram = _Histogram(histogram_bins, dataset.dtypes[band - 1]) if histogram_bins else None
+        count, mean, sum_squares, minimum, maximum = _band_moments(dataset, band, histogram)
+        if not count:
+            band_statistics.append(BandStatistics(None, None, None, None, 0, 0.0))
+            continue
+
+        statistics = BandStatistics(
+            minimum=float(minimum),
+            maximum=float(maximum),
+            mean=float(mean),
+            stddev=math.sqrt(sum_squares / count),
+            valid_count=count,
+            valid_percent=100.0 * count / (dataset.width * dataset.height),
+        )
+
+        if histogram is not None:
+            statistics.histogram = histogram.result(minimum, maximum)
+
+        band_statistics.append(statistics)
+
+    return band_statistics
+
+
+def write_statistics(dataset: rasterio.io.DatasetWriter, histogram_bins: int) -> list[BandStatistics]:
+    """Compute the statistics of each band of a dataset opened for update,
+    and write them to its band metadata.
+    """
+    band_statistics = compute_statistics(dataset, histogram_bins)
+    for band, statistics in zip(dataset.indexes, band_statistics):
+        dataset.update_tags(band, **statistics.to_tags())
+    return band_statistics
+
+
+def read_statistics(path: str) -> list[BandStatistics | None]:
+    """Read the statistics from the band metadata of a raster file, without
+    reading its data.
+    """
+    with rasterio.open(path) as dataset:
+        return [BandStatistics.from_tags(dataset.tags(band)) for band in dataset.indexes]
@@ -0,0 +1,433 @@
+"""
+========
+swath.py
+========
+
+Gridding of swath (L2) products, whose latitudes and longitudes are 2D
+coordinate variables on the swath dimensions, e.g. `(along_track,
+cross_track)`, rather than dimensions of a regular grid. Each variable on the
+swath dimensions is binned onto a regular latitude/longitude grid covering
+the swath, and the gridded variable is converted by the existing COG writer
+like any gridded variable.
+
+The swath is processed in chunks of whole swath rows, so memory is bounded
+by the chunk and the output grid. For each chunk, the grid cell of every
+valid sample is computed with vectorized arithmetic, and the samples are
+reduced into the cells with one of:
+
+* `mean`: the mean of the samples in each cell, from `numpy.bincount` sums
+  and counts;
+* `count`: the number of valid samples in each cell;
+* `nearest`: the sample nearest to the center of each cell, selected with
+  `numpy.minimum.at` of the distances.
+
+Categorical variables, with `flag_values` or `flag_masks` attributes or
+stored as integers without packing, are gridded with `nearest` by default,
+as their values must not be averaged, and keep their integer type, with the
+NetCDF default fill value of the type in empty cells. Other variables are
+gridded with `mean` by default.
+
+Cells without samples are NaN, except for `count`, where they are 0. Samples
+masked in the input, or with invalid coordinates, are ignored. Longitudes
+are wrapped to -180..180, so a swath crossing the antimeridian is gridded to
+the whole range of longitudes.
+
+Gridding is lazy: the grid is computed from the coordinates when the group
+is opened for conversion, and each variable is binned when it is first read.
+Inspecting a swath file reads neither its coordinates nor its data: swath
+groups are recognized from the dimensions of their variables, and swath
+variables are planned with the shape of the swath.
+
+Gridding is configured with environment variables:
+
+* `SWATH_RESOLUTION`: size of the grid cells in degrees. Defaults to the
+  median spacing of the swath pixels, along or across track, whichever is
+  larger, so that most cells have a sample.
+* `SWATH_METHOD`: `mean`, `count` or `nearest`, for every swath variable.
+  Defaults to `nearest` for categorical variables and `mean` for others.
+* `SWATH_CHUNK_PIXELS`: number of swath pixels binned at a time. Defaults to
+  4M.
+"""
+
+import math
+import os
+from dataclasses import dataclass
+from logging import Logger
+
+import netCDF4
+import numpy as np
+import xarray as xr
+from xarray.backends import BackendArray
+from xarray.core import indexing
+
+SWATH_RESOLUTION_ENV = 'SWATH_RESOLUTION'
+SWATH_METHOD_ENV = 'SWATH_METHOD'
+SWATH_CHUNK_PIXELS_ENV = 'SWATH_CHUNK_PIXELS'
+
+METHODS = ('mean', 'count', 'nearest')
+DEFAULT_CHUNK_PIXELS = 4 * 1024 ** 2
+
+LATITUDE_NAMES = ['lat', 'latitude']
+LONGITUDE_NAMES = ['lon', 'longitude']
+
+# Attributes of the swath variables that do not apply to the gridded ones
+SWATH_ATTRIBUTES = ['coordinates', 'grid_mapping']
+
+METHOD_ATTRIBUTE = 'swath_gridding_method'
+RESOLUTION_ATTRIBUTE = 'swath_grid_resolution'
+
+
+@dataclass
+class SwathGridConfig:
+    """The resolution and reduction of swath gridding."""
+
+    resolution: float | None = None
+    method: str | None = None
+    chunk_pixels: int = DEFAULT_CHUNK_PIXELS
+
+    def __post_init__(self):
+        if self.method is not None and self.method not in METHODS:
+            raise ValueError(f'Unknown swath gridding method {self.method}, expected one of {list(METHODS)}')
+        if self.resolution is not None and self.resolution <= 0:
+            raise ValueError(f'Swath grid resolution must be positive, not {self.resolution}')
+        if self.chunk_pixels < 1:
+            raise ValueError(f'Swath chunks must have at least 1 pixel, not {self.chunk_pixels}')
+
+    @classmethod
+    def from_environment(cls) -> 'SwathGridConfig':
+        """Build the swath gridding configuration from the environment."""
+        resolution = os.getenv(SWATH_RESOLUTION_ENV)
+        return cls(
+            resolution=float(resolution) if resolution else None,
+            method=os.getenv(SWATH_METHOD_ENV) or None,
+            chunk_pixels=int(os.getenv(SWATH_CHUNK_PIXELS_ENV, str(DEFAULT_CHUNK_PIXELS))),
+        )
+
+    def method_for(self, variable: xr.DataArray) -> str:
+        """The method gridding a variable: the configured one, or `nearest`
+        for categorical variables and `mean` for others.
+        """
+        if self.method is not None:
+            return self.method
+        return 'nearest' if is_categorical(variable) else 'mean'
+
+
+def is_categorical(variable: xr.DataArray) -> bool:
+    """Whether a variable has flag attributes, or is stored as integers
+    without packing, so its values must not be averaged.
+    """
+    if 'flag_values' in variable.attrs or 'flag_masks' in variable.attrs:
+        return True
+    packed = any(key in variable.encoding or key in variable.attrs for key in ('scale_factor', 'add_offset'))
+    stored = np.dtype(variable.encoding.get('dtype', variable.dtype))
+    return np.issubdtype(variable.dtype, np.integer) or (np.issubdtype(stored, np.integer) and not packed)
+
+
+def swath_coordinates(dataset: xr.Dataset) -> tuple[str, str] | None:
+    """
+    The 2D latitude and longitude variables of a swath dataset, on the same
+    dimensions, or None if the dataset is not a swath.
+    """
+    def find(names):
+        return next((name for name in names if name in dataset.variables and dataset[name].ndim == 2), None)
+
+    latitude, longitude = find(LATITUDE_NAMES), find(LONGITUDE_NAMES)
+    if latitude is None or longitude is None or dataset[latitude].dims != dataset[longitude].dims:
+        return None
+    return latitude, longitude
+
+
+def _wrap(longitudes: np.ndarray) -> np.ndarray:
+    return np.where(longitudes >= 180, longitudes - 360, np.where(longitudes < -180, longitudes + 360, longitudes))
+
+
+def _chunks(rows: int, columns: int, chunk_pixels: int):
+    """Slices of whole swath rows with at most `chunk_pixels` pixels, or one
+    row.
+    """
+    step = max(1, chunk_pixels // max(1, columns))
+    for row in range(0, rows, step):
+        yield slice(row, min(rows, row + step))
+
+
+def _read_coordinates(latitudes: xr.DataArray, longitudes: xr.DataArray,
+                      rows: slice) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """The latitudes, wrapped longitudes and validity of a chunk of swath
+    rows.
+    """
+    lat = np.asarray(latitudes[rows].values, dtype=np.float64)
+    lon = _wrap(np.asarray(longitudes[rows].values, dtype=np.float64))
+    valid = np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90)
+    return lat, lon, valid
+
+
+def estimate_resolution(latitudes: xr.DataArray, longitudes: xr.DataArray) -> float:
+    """
+    The median spacing in degrees of neighbouring pixels along the middle row
+    and column of a swath, whichever is larger, to two significant digits.
+    """
+    spacings = []
+    middle_row, middle_column = latitudes.shape[0] // 2, latitudes.shape[1] // 2
+    for index in [(middle_row, slice(None)), (slice(None), middle_column)]:
+        lat = np.asarray(latitudes[index].values, dtype=np.float64)
+        lon = np.asarray(longitudes[index].values, dtype=np.float64)
+        # Differences wrapped to -180..180, so the antimeridian is one step
+        steps = np.hypot(np.diff(lat), _wrap(np.diff(lon)))
+        steps = steps[np.isfinite(steps) & (steps > 0)]
+        if steps.size:
+            spacings.append(float(np.median(steps)))
+    if not spacings:
+        raise ValueError('Cannot estimate the resolution of a swath without valid coordinates')
+    return float(f'{max(spacings):.2g}')
+
+
+@dataclass
+class SwathGrid:
+    """
+    A regular north-up latitude/longitude grid covering a swath.
+
+    Attributes
+    ----------
+    north : float
+        Latitude of the northern edge of the first row.
+    west : float
+        Longitude of the western edge of the first column.
+    resolution : float
+        Size of the cells in degrees.
+    height : int
+        Number of rows.
+    width : int
+        Number of columns.
+    """
+
+    north: float
+    west: float
+    resolution: float
+    height: int
+    width: int
+
+    @classmethod
+    def covering(cls, latitudes: xr.DataArray, longitudes: xr.DataArray, resolution: float,
+                 chunk_pixels: int) -> 'SwathGrid':
+        """The grid of cells aligned on multiples of the resolution covering
+        the valid coordinates of a swath, read in chunks.
+        """
+        south, north, west, east = math.inf, -math.inf, math.inf, -math.inf
+        for rows in _chunks(*latitudes.shape, chunk_pixels):
+            lat, lon, valid = _read_coordinates(latitudes, longitudes, rows)
+            if valid.any():
+                south, north = min(south, lat[valid].min()), max(north, lat[valid].max())
+                west, east = min(west, lon[valid].min()), max(east, lon[valid].max())
+        if not math.isfinite(south):
+            raise ValueError('Cannot grid a swath without valid coordinates')
+
+        north = math.ceil(north / resolution) * resolution
+        west = math.floor(west / resolution) * resolution
+        return cls(
+            north=north,
+            west=west,
+            resolution=resolution,
+            height=max(1, math.ceil((north - south) / resolution)),
+            width=max(1, math.ceil((east - west) / resolution)),
+        )
+
+    @property
+    def size(self) -> int:
+        """Number of cells."""
+        return self.height * self.width
+
+    def latitudes(self) -> np.ndarray:
+        """Latitudes of the cell centers, north to south."""
+        return self.north - (np.arange(self.height) + 0.5) * self.resolution
+
+    def longitudes(self) -> np.ndarray:
+        """Longitudes of the cell centers, west to east."""
+        return self.west + (np.arange(self.width) + 0.5) * self.resolution
+
+    def cells(self, lat: np.ndarray, lon: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """The flat index of the cell of each sample, and the squared distance
+        in degrees of the sample to the center of its cell.
+        """
+        row_position = (self.north - lat) / self.resolution
+        column_position = (lon - self.west) / self.resolution
+        # Samples on the southern or eastern edge are in the last cell
+        rows = np.clip(np.floor(row_position).astype(np.int64), 0, self.height - 1)
+        columns = np.clip(np.floor(column_position).astype(np.int64), 0, self.width - 1)
+        distances = (row_position - rows - 0.5) ** 2 + (column_position - columns - 0.5) ** 2
+        return rows * self.width + columns, distances * self.resolution ** 2
+
+
+def gridded_dtype(dtype: np.dtype, method: str) -> np.dtype:
+    """The data type of a variable gridded with a method. Integers keep
+    their type with `nearest`.
+    """
+    if method == 'count':
+        return np.dtype(np.int32)
+    if method == 'nearest' and np.issubdtype(dtype, np.integer):
+        return np.dtype(dtype)
+    return np.result_type(dtype, np.float32)
+
+
+def gridded_fill(dtype: np.dtype) -> float | int:
+    """The value of the cells without samples of a variable gridded to a
+    data type, other than with `count`: NaN, or the NetCDF default fill value
+    of integer types.
+    """
+    if np.issubdtype(dtype, np.integer):
+        return np.dtype(dtype).type(netCDF4.default_fillvals[np.dtype(dtype).str[1:]])
+    return np.nan
+
+
+class _Accumulator:
+    """The reduction of samples into the cells of a grid, across chunks."""
+
+    def __init__(self, grid: SwathGrid, method: str, dtype: np.dtype):
+        self.grid = grid
+        self.method = method
+        self.dtype = dtype
+        if method == 'nearest':
+            self.values = np.full(grid.size, gridded_fill(dtype), dtype=dtype)
+            self.distances = np.full(grid.size, np.inf)
+        else:
+            self.counts = np.zeros(grid.size, dtype=np.int64)
+            self.sums = np.zeros(grid.size, dtype=np.float64)
+
+    def add(self, cells: np.ndarray, distances: np.ndarray, data: np.ndarray):
+        """Add samples, given their cells and distances to the cell centers."""
+        if self.method == 'nearest':
+            np.minimum.at(self.distances, cells, distances)
+            # Samples at least as near as every other sample of their cell,
+            # including those of previous chunks
+            winners = distances <= self.distances[cells]
+            self.values[cells[winners]] = data[winners]
+        else:
+            self.counts += np.bincount(cells, minlength=self.grid.size)
+            if self.method == 'mean':
+                self.sums += np.bincount(cells, weights=data, minlength=self.grid.size)
+
+    def result(self) -> np.ndarray:
+        """The gridded values."""
+        if self.method == 'count':
+            gridded = self.counts.astype(self.dtype)
+        elif self.method == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                gridded = (self.sums / self.counts).astype(self.dtype)
+        else:
+            gridded = self.values
+        return gridded.reshape(self.grid.height, self.grid.width)
+
+
+def bin_swath(values: xr.DataArray, latitudes: xr.DataArray, longitudes: xr.DataArray, grid: SwathGrid,
+              config: SwathGridConfig) -> np.ndarray:
+    """
+    Bin the valid samples of a swath variable onto a grid.
+
+    Parameters
+    ----------
+    values : xarray.DataArray
+        The variable on the swath dimensions, decoded so masked samples are
+        NaN. It is read one chunk of rows at a time.
+    latitudes, longitudes : xarray.DataArray
+        The coordinates of the swath pixels.
+    grid : SwathGrid
+        The output grid.
+    config : SwathGridConfig
+        The method, and the number of swath pixels binned at a time.
+
+    Returns
+    -------
+    numpy.ndarray
+        (height, width) gridded values, `gridded_fill` where a cell has no
+        samples except for `count`.
+    """
+    method = config.method_for(values)
+    accumulator = _Accumulator(grid, method, gridded_dtype(values.dtype, method))
+    for rows in _chunks(*latitudes.shape, config.chunk_pixels):
+        lat, lon, valid = _read_coordinates(latitudes, longitudes, rows)
+        data = np.asarray(values[rows].values)
+        if np.issubdtype(data.dtype, np.floating):
+            valid &= np.isfinite(data)
+        accumulator.add(*grid.cells(lat[valid], lon[valid]), data[valid])
+    return accumulator.result()
+
+
+class _GriddedArray(BackendArray):
+    """A swath variable binned onto a grid the first time it is read."""
+
+    def __init__(self, values: xr.DataArray, coordinates: tuple[xr.DataArray, xr.DataArray], grid: SwathGrid,
+                 config: SwathGridConfig):
+        self._values = values
+        self._coordinates = coordinates
+        self._grid = grid
+        self._config = config
+        self._gridded = None
+        self.shape = (grid.height, grid.width)
+        self.dtype = gridded_dtype(values.dtype, config.method_for(values))
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self._getitem)
+
+    def _getitem(self, key):
+        if self._gridded is None:
+            self._gridded = bin_swath(self._values, *self._coordinates, self._grid, self._config)
+        return self._gridded[key]
+
+
+def _gridded_attributes(variable: xr.DataArray, method: str, resolution: float) -> dict:
+    if method == 'count':
+        attributes = {'long_name': f'number of {variable.name} samples', 'units': '1'}
+    else:
+        attributes = {key: value for key, value in variable.attrs.items() if key not in SWATH_ATTRIBUTES}
+    attributes[METHOD_ATTRIBUTE] = method
+    attributes[RESOLUTION_ATTRIBUTE] = resolution
+    return attributes
+
+
+def grid_swath(dataset: xr.Dataset, coordinates: tuple[str, str], config: SwathGridConfig,
+               logger: Logger) -> xr.Dataset:
+    """
+    Replace the variables of a swath dataset on the swath dimensions with
+    lazily gridded variables on `lat` and `lon` dimensions, north-up in
+    -180..180.
+
+    Parameters
+    ----------
+    dataset : xarray.Dataset
+        The swath dataset, as opened by xarray.
+    coordinates : tuple[str, str]
+        The latitude and longitude variables, as returned by
+        `swath_coordinates`.
+    config : SwathGridConfig
+        Resolution and method of the gridding.
+    logger : logging.Logger
+        Python Logger object for emitting log messages.
+
+    Returns
+    -------
+    xarray.Dataset
+        The dataset with the gridded variables, and the other variables
+        unchanged.
+    """
+    latitudes, longitudes = (dataset[name] for name in coordinates)
+    resolution = config.resolution or estimate_resolution(latitudes, longitudes)
+    grid = SwathGrid.covering(latitudes, longitudes, resolution, config.chunk_pixels)
+    logger.info('Gridding swath of %s pixels onto a %d x %d grid of %s degree cells',
+                'x'.join(map(str, latitudes.shape)), grid.width, grid.height, resolution)
+
+    swath_variables = [name for name, variable in dataset.data_vars.items()
+                       if variable.dims == latitudes.dims and name not in coordinates]
+    gridded = {}
+    for name in swath_variables:
+        method = config.method_for(dataset[name])
+        logger.debug('Gridding %s by %s', name, method)
+        gridded[name] = xr.Variable(
+            ('lat', 'lon'),
+            indexing.LazilyIndexedArray(_GriddedArray(dataset[name], (latitudes, longitudes), grid, config)),
+            attrs=_gridded_attributes(dataset[name], method, resolution),
+            encoding={} if method == 'count' else {
+                '_FillValue': gridded_fill(gridded_dtype(dataset[name].dtype, method))},
+        )
+    return dataset.drop_vars(list(coordinates) + swath_variables).assign_coords(
+        lat=('lat', grid.latitudes(), {'units': 'degrees_north', 'standard_name': 'latitude'}),
+        lon=('lon', grid.longitudes(), {'units': 'degrees_east', 'standard_name': 'longitude'}),
+    ).assign(gridded)
@@ -32,18 +32,31 @@
 #  DEALINGS IN THE SOFTWARE.
 # *****************************************************************************
 
+import argparse
+import glob
+import json
 import os.path
 import struct
 import sys
-from osgeo import gdal
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from osgeo import gdal
+except ImportError:
+    # Only the batch mode can be used without the GDAL Python bindings
+    gdal = None
 
 
 def Usage():
-    print('Usage: validate_cloud_optimized_geotiff.py [-q] [--full-check=yes/no/auto] test.tif')
+    print('Usage: validate_cloud_optimized_geotiff.py [-q] [--full-check=yes/no/auto] [--json] [-j JOBS] test.tif [...]')
     print('')
     print('Options:')
     print('-q: quiet mode')
     print('--full-check=yes/no/auto: check tile/strip leader/trailer bytes. auto=yes for local files, and no for remote files')
+    print('--json: print a JSON report with the warnings, errors, IFD and data offsets of each file')
+    print('-j JOBS: number of files validated concurrently')
+    print('')
+    print('Files may be given as glob patterns, e.g. "staged/**/*.tif".')
     return 1
 
 
@@ -117,6 +130,10 @@ def validate(ds,check_tiled=True, full_check=False):
         file is not a Tiff.
     """
 
+    if gdal is None:
+        raise ValidateCloudOptimizedGeoTIFFException(
+            'The GDAL Python bindings (osgeo) are required')
+
     if int(gdal.VersionInfo('VERSION_NUM')) < 2020000:
         raise ValidateCloudOptimizedGeoTIFFException(
             'GDAL 2.2 or above required')
@@ -314,66 +331,122 @@ def validate(ds,check_tiled=True, full_check=False):
     return warnings, errors, details
 
 
-def main():
-    """Return 0 in case of success, 1 for failure."""
-
-    i = 1
-    filename = None
-    quiet = False
-    full_check = None
-    while i < len(sys.argv):
-        if sys.argv[i] == '-q':
-            quiet = True
-        elif sys.argv[i] == '--full-check=yes':
-            full_check = True
-        elif sys.argv[i] == '--full-check=no':
-            full_check = False
-        elif sys.argv[i] == '--full-check=auto':
-            full_check = None
-        elif sys.argv[i][0] == '-':
-            return Usage()
-        elif filename is None:
-            filename = sys.argv[i]
-        else:
-            return Usage()
-
-        i += 1
-
-    if filename is None:
-        return Usage()
-
+def validate_file(filename, full_check=None):
+    """
+    Validate one file, catching any exception, e.g. a GDAL `RuntimeError`
+    for an unreadable file, so one file never fails a batch.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the file, or a GDAL virtual file system path.
+    full_check : bool | None
+        Whether to check tile leader and trailer bytes. When None, only local
+        and `/vsimem/` files are fully checked.
+
+    Returns
+    -------
+    dict
+        The file name, whether it is a valid COG, and its warnings, errors
+        and details (IFD and data offsets).
+    """
     if full_check is None:
         full_check = filename.startswith('/vsimem/') or os.path.exists(filename)
 
     try:
-        ret = 0
-        warnings, errors, details = validate(filename, full_check = full_check)
-        if warnings:
-            if not quiet:
-                print('The following warnings were found:')
-                for warning in warnings:
-                    print(' - ' + warning)
-                print('')
-        if errors:
-            if not quiet:
-                print('%s is NOT a valid cloud optimized GeoTIFF.' % filename)
-                print('The following errors were found:')
-                for error in errors:
-                    print(' - ' + error)
-                print('')
-            ret = 1
-        else:
-            if not quiet:
-                print('%s is a valid cloud optimized GeoTIFF' % filename)
-
-        if not quiet and not warnings and not errors:
-            print('\nThe size of all IFD headers is %d bytes' %
-                  min(details['data_offsets'][k] for k in details['data_offsets']))
+        warnings, errors, details = validate(filename, full_check=full_check)
     except ValidateCloudOptimizedGeoTIFFException as e:
-        if not quiet:
-            print('%s is NOT a valid cloud optimized GeoTIFF : %s' %
-                  (filename, str(e)))
-        ret = 1
+        warnings, errors, details = [], [str(e)], {}
+    except Exception as e:
+        warnings, errors, details = [], ['%s: %s' % (type(e).__name__, e)], {}
+
+    return {
+        'file': filename,
+        'valid': not errors,
+        'warnings': warnings,
+        'errors': errors,
+        'details': details,
+    }
+
+
+def expand_filenames(patterns):
+    """Expand glob patterns, keeping names that are not patterns, or match no
+    file, so they are reported as invalid.
+    """
+    filenames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else []
+        filenames.extend(matches or [pattern])
+    return filenames
+
+
+def validate_files(filenames, full_check=None, jobs=None):
+    """
+    Validate files concurrently with a pool of `jobs` threads. GDAL releases
+    the GIL while reading, so threads overlap the I/O of remote files.
+
+    Returns
+    -------
+    list[dict]
+        The result of `validate_file` for each file, in the order given.
+    """
+    jobs = jobs or min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        return list(executor.map(lambda filename: validate_file(filename, full_check), filenames))
+
+
+def _print_result(result):
+    filename = result['file']
+    if result['warnings']:
+        print('The following warnings were found:')
+        for warning in result['warnings']:
+            print(' - ' + warning)
+        print('')
+    if result['errors']:
+        print('%s is NOT a valid cloud optimized GeoTIFF.' % filename)
+        print('The following errors were found:')
+        for error in result['errors']:
+            print(' - ' + error)
+        print('')
+    else:
+        print('%s is a valid cloud optimized GeoTIFF' % filename)
+
+    if not result['warnings'] and not result['errors']:
+        print('\nThe size of all IFD headers is %d bytes' %
+              min(result['details']['data_offsets'][k] for k in result['details']['data_offsets']))
+
+
+def main(argv=None):
+    """Return 0 if every file is a valid COG, 1 otherwise."""
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('-q', action='store_true')
+    parser.add_argument('--full-check', choices=['yes', 'no', 'auto'], default='auto')
+    parser.add_argument('--json', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int)
+    parser.add_argument('files', nargs='*')
+    args, unknown = parser.parse_known_args(sys.argv[1:] if argv is None else argv)
+    if unknown or not args.files or (args.jobs is not None and args.jobs < 1):
+        return Usage()
+
+    full_check = {'yes': True, 'no': False, 'auto': None}[args.full_check]
+    results = validate_files(expand_filenames(args.files), full_check, args.jobs)
+    ret = 0 if all(result['valid'] for result in results) else 1
+
+    if args.json:
+        json.dump({
+            'valid': ret == 0,
+            'files': len(results),
+            'invalid': sum(not result['valid'] for result in results),
+            'results': results,
+        }, sys.stdout, indent=2)
+        print('')
+    elif not args.q:
+        for result in results:
+            _print_result(result)
+        if len(results) > 1:
+            print('%d of %d files are valid cloud optimized GeoTIFFs' %
+                  (sum(result['valid'] for result in results), len(results)))
 
     return ret
 
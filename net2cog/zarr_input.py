@@ -0,0 +1,115 @@
+"""
+=============
+zarr_input.py
+=============
+
+Zarr stores and kerchunk reference files as input. Collections that publish
+kerchunk references to their NetCDF-4 granules, or Zarr copies of them, are
+opened with the xarray zarr engine, which reads each chunk directly with
+numcodecs rather than through the HDF5 library. Neither the HDF5 metadata of
+a granule is parsed, nor are reads serialized by `NETCDF_LOCK`.
+
+An input is read as Zarr if it is:
+
+* a kerchunk reference file, ending in `.json`. The references may point to
+  local files or, with the matching fsspec filesystem installed, to remote
+  URLs;
+* a Zarr store, a directory ending in `.zarr` or containing a `.zgroup`.
+
+Groups, coordinates and the chunk shape of each variable are read from the
+Zarr metadata, so the rest of the conversion is the same as for NetCDF files.
+Zarr and fsspec are optional dependencies, installed with the `zarr` extra.
+"""
+
+import os
+from os.path import isfile, join
+
+import xarray as xr
+
+REFERENCE_SUFFIX = '.json'
+ZARR_SUFFIX = '.zarr'
+
+
+def is_zarr_input(path: str) -> bool:
+    """Whether a path is a kerchunk reference file or a Zarr store."""
+    path = path.rstrip('/')
+    return (path.endswith(REFERENCE_SUFFIX)
+            or (os.path.isdir(path) and (path.endswith(ZARR_SUFFIX) or isfile(join(path, '.zgroup')))))
+
+
+def zarr_store(path: str):
+    """
+    The store of a Zarr input.
+
+    Parameters
+    ----------
+    path : str
+        Path of a kerchunk reference file or a Zarr store.
+
+    Returns
+    -------
+    collections.abc.MutableMapping | str
+        A mapping over the references of a kerchunk file, or the path of a
+        Zarr store.
+    """
+    if path.endswith(REFERENCE_SUFFIX):
+        import fsspec  # pylint: disable=import-outside-toplevel
+
+        return fsspec.get_mapper('reference://', fo=path)
+    return path
+
+
+def group_paths(store) -> list[str]:
+    """Paths of the groups of a Zarr store that contain arrays, depth first,
+    as NetCDF group paths, e.g. `/` or `/data_01/ku`.
+    """
+    import zarr  # pylint: disable=import-outside-toplevel
+
+    paths = []
+
+    def walk(group):
+        if any(True for _ in group.array_keys()):
+            paths.append(f'/{group.path}')
+        for _, child in sorted(group.groups()):
+            walk(child)
+
+    walk(zarr.open_group(store, mode='r'))
+    return paths
+
+
+def open_group(store, group_path: str) -> xr.Dataset:
+    """
+    Open a group of a Zarr store lazily.
+
+    The Zarr chunk shape of each variable is also recorded as its
+    `chunksizes` encoding, as the NetCDF engine does, so COG tiles are
+    aligned with the chunks.
+
+    Parameters
+    ----------
+    store : collections.abc.MutableMapping | str
+        Store returned by `zarr_store`.
+    group_path : str
+        Path of the group, `/` for the root group.
+
+    Raises
+    ------
+    OSError
+        If the group does not exist, as for NetCDF files.
+    """
+    from zarr.errors import GroupNotFoundError  # pylint: disable=import-outside-toplevel
+
+    try:
+        dataset = xr.open_dataset(
+            store,
+            engine='zarr',
+            group=None if group_path == '/' else group_path.strip('/'),
+            # Reference files are not consolidated; Zarr stores may be
+            consolidated=False if not isinstance(store, str) else None,
+        )
+    except GroupNotFoundError as error:
+        raise OSError(f'group {group_path} not found') from error
+    for variable in dataset.variables.values():
+        if variable.encoding.get('chunks') and 'chunksizes' not in variable.encoding:
+            variable.encoding['chunksizes'] = tuple(variable.encoding['chunks'])
+    return dataset
@@ -7,6 +7,8 @@ from pathlib import Path
 from shutil import copyfile, rmtree
 from tempfile import mkdtemp
 
+import numpy as np
+from netCDF4 import Dataset
 from pytest import fixture
 
 
@@ -53,6 +55,33 @@ def smap_file(data_dir, temp_dir, smap_collection, smap_file_basename):
     return temporary_data_file
 
 
+@fixture(scope='function')
+def grouped_file(temp_dir):
+    """Path to a NetCDF-4 file with data variables in nested groups. The
+    spatial dimensions and their coordinate variables are only defined in the
+    root group, as is common for SWOT and other L2/L3 products.
+
+    """
+    grouped_file_path = Path(join(temp_dir, 'grouped.nc'))
+    with Dataset(grouped_file_path, 'w') as dataset:
+        dataset.createDimension('lat', 90)
+        dataset.createDimension('lon', 180)
+        latitude = dataset.createVariable('lat', 'f4', ('lat',))
+        latitude.standard_name = 'latitude'
+        latitude[:] = np.linspace(-89, 89, 90)
+        longitude = dataset.createVariable('lon', 'f4', ('lon',))
+        longitude.standard_name = 'longitude'
+        longitude[:] = np.linspace(-179, 179, 180)
+        dataset.createVariable('sst', 'f4', ('lat', 'lon'))[:] = np.ones((90, 180))
+
+        ku_group = dataset.createGroup('data_01').createGroup('ku')
+        ku_group.createVariable('ssha', 'f4', ('lat', 'lon'))[:] = np.zeros((90, 180))
+        c_group = dataset.createGroup('data_02').createGroup('c')
+        c_group.createVariable('ssha', 'f4', ('lat', 'lon'))[:] = np.ones((90, 180))
+
+    return grouped_file_path
+
+
 @fixture(scope='function')
 def smap_data_operation_message(data_dir, temp_dir, smap_collection, smap_file):
     """Message for SMAP request. JSON is scoped per function, to avoids affects
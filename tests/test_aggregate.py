@@ -0,0 +1,123 @@
+"""
+=================
+test_aggregate.py
+=================
+
+Test the aggregation of granules into time-stacked COGs.
+"""
+import pathlib
+from os.path import basename
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+
+from net2cog.aggregate import netcdf_aggregator
+from net2cog.netcdf_convert import Net2CogError
+from net2cog.quicklook import QuicklookConfig
+from net2cog.swath import SwathGrid, SwathGridConfig, bin_swath
+
+
+def _write_daily_granule(path: pathlib.Path, day: int, latitudes: np.ndarray) -> pathlib.Path:
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('time', 1)
+        dataset.createDimension('lat', latitudes.size)
+        dataset.createDimension('lon', 36)
+        time = dataset.createVariable('time', 'f8', ('time',))
+        time.units = 'days since 2020-01-01'
+        time[:] = [day]
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = latitudes
+        dataset['lat'].standard_name = 'latitude'
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.linspace(-175, 175, 36)
+        dataset['lon'].standard_name = 'longitude'
+        sst = dataset.createVariable('sst', 'f4', ('time', 'lat', 'lon'), fill_value=-9999.0)
+        sst[:] = np.full((1, latitudes.size, 36), day, dtype='f4')
+        sst[0, 0, 0] = np.ma.masked
+    return path
+
+
+def _write_swath_granule(path: pathlib.Path, day: int, latitude_shift: float = 0.0) -> pathlib.Path:
+    rows, columns = np.meshgrid(np.arange(60), np.arange(20), indexing='ij')
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('along_track', 60)
+        dataset.createDimension('cross_track', 20)
+        dataset.createVariable('latitude', 'f4', ('along_track', 'cross_track'))[:] = \
+            -3 + 0.1 * rows + 0.02 * columns + latitude_shift
+        dataset.createVariable('longitude', 'f4', ('along_track', 'cross_track'))[:] = 20 + 0.1 * columns
+        sst = dataset.createVariable('sst', 'f4', ('along_track', 'cross_track'), fill_value=-999.0)
+        sst.coordinates = 'latitude longitude'
+        sst[:] = day + rows / 100
+    return path
+
+
+@pytest.fixture(name='daily_granules')
+def fixture_daily_granules(temp_dir):
+    """Three daily granules on the same grid, each filled with its day."""
+    latitudes = np.linspace(-85, 85, 18)
+    return [
+        _write_daily_granule(pathlib.Path(temp_dir, f'granule_{day}.nc'), day, latitudes)
+        for day in range(3)
+    ]
+
+
+def test_time_stacked_cog(daily_granules, temp_dir, logger):
+    """
+    Verify each variable is written as a COG with a band per granule, in
+    input order.
+    """
+    results = netcdf_aggregator(daily_granules, pathlib.Path(temp_dir), ['sst'], logger)
+
+    assert [basename(result) for result in results] == ['sst.tif']
+    with rasterio.open(results[0]) as dataset:
+        assert dataset.count == 3
+        assert dataset.nodata == -9999.0
+        assert dataset.descriptions == tuple(basename(granule) for granule in daily_granules)
+        for band in dataset.indexes:
+            data = dataset.read(band, masked=True)
+            assert data.mask.sum() == 1
+            assert (data.compressed() == band - 1).all()
+            assert dataset.tags(band)['TIME'].startswith(f'2020-01-0{band}')
+
+
+def test_different_grids(daily_granules, temp_dir, logger):
+    """Verify granules on different grids cannot be aggregated."""
+    shifted_granule = _write_daily_granule(pathlib.Path(temp_dir, 'shifted.nc'), 3, np.linspace(-80, 90, 18))
+
+    with pytest.raises(Net2CogError, match='same grid'):
+        netcdf_aggregator(daily_granules + [shifted_granule], pathlib.Path(temp_dir), ['sst'], logger)
+
+
+def test_swath_granules(temp_dir, logger):
+    """
+    Verify swath granules are gridded with the configured gridding, and can
+    only be aggregated onto the same grid.
+    """
+    granules = [_write_swath_granule(pathlib.Path(temp_dir, f'swath_{day}.nc'), day) for day in range(2)]
+    config = SwathGridConfig(resolution=0.2, method='nearest')
+
+    result, = netcdf_aggregator(granules, pathlib.Path(temp_dir), ['sst'], logger, swath_grid=config)
+    with xr.open_dataset(granules[1]) as dataset:
+        grid = SwathGrid.covering(dataset['latitude'], dataset['longitude'], 0.2, config.chunk_pixels)
+        expected = bin_swath(dataset['sst'], dataset['latitude'], dataset['longitude'], grid, config)
+    with rasterio.open(result) as dataset:
+        assert dataset.count == 2 and dataset.shape == (grid.height, grid.width)
+        np.testing.assert_array_equal(dataset.read(2), expected)
+
+    shifted = _write_swath_granule(pathlib.Path(temp_dir, 'shifted.nc'), 2, latitude_shift=1.0)
+    with pytest.raises(Net2CogError, match='same grid'):
+        netcdf_aggregator(granules + [shifted], pathlib.Path(temp_dir), ['sst'], logger, swath_grid=config)
+
+
+def test_quicklook(daily_granules, temp_dir, logger):
+    """Verify a quicklook of the first band is written next to each COG."""
+    output_dir = pathlib.Path(temp_dir, 'output')
+    output_dir.mkdir()
+    result, = netcdf_aggregator(daily_granules, output_dir, ['sst'], logger,
+                                quicklook=QuicklookConfig(enabled=True, size=20))
+
+    with rasterio.open(output_dir / 'sst.png') as png, rasterio.open(result) as dataset:
+        assert png.count == 4 and max(png.shape) == 20
+        np.testing.assert_array_equal(png.read(4) == 255,
+                                      ~dataset.read(1, out_shape=png.shape, masked=True).mask)
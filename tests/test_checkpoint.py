@@ -0,0 +1,114 @@
+"""
+==============
+test_checkpoint.py
+==============
+
+Test that a retried item resumes from the checkpoint of a failed attempt.
+"""
+import json
+import logging
+import os
+import sys
+from os.path import basename, join
+from unittest.mock import patch
+
+import pytest
+from pystac import Catalog
+
+import net2cog.netcdf_convert_harmony
+from net2cog import netcdf_convert
+from net2cog.checkpoint import MANIFEST_NAME, CheckpointManifest, work_directory
+from net2cog.staging import StagedFile, stage_file
+
+
+def test_manifest(tmp_path):
+    """
+    Verify a manifest is reloaded for the same input, and converted COGs
+    that have changed since they were recorded are not reused.
+    """
+    logger = logging.getLogger()
+    directory = work_directory(str(tmp_path), 'request', 'granule/1')
+    assert basename(directory).startswith('granule_1-')
+
+    manifest = CheckpointManifest(directory, 's3://bucket/granule.nc', 'sha256', logger)
+    for variable_name in ['sst', 'ice']:
+        with open(join(directory, f'{variable_name}.tif'), 'wb') as file_handler:
+            file_handler.write(variable_name.encode())
+        manifest.record_converted(variable_name, join(directory, f'{variable_name}.tif'))
+    manifest.record_staged(join(directory, 'sst.tif'), StagedFile('s3://bucket/sst.tif', 3, '1220ab'), [{}])
+    os.remove(join(directory, 'sst.tif'))
+    with open(join(directory, 'ice.tif'), 'wb') as file_handler:
+        file_handler.write(b'changed')
+    # Files in scratch memory are not checkpointed
+    manifest.record_converted('wind', str(tmp_path / 'wind.tif'))
+
+    resumed = CheckpointManifest(directory, 's3://bucket/granule.nc', 'sha256', logger)
+    assert resumed.converted_file('sst') == join(directory, 'sst.tif')
+    assert resumed.staged_file('sst.tif')[0].url == 's3://bucket/sst.tif'
+    assert resumed.converted_file('ice') is None
+    assert resumed.converted_file('wind') is None
+
+    other_input = CheckpointManifest(directory, 's3://bucket/other.nc', 'sha256', logger)
+    assert not other_input.converted
+    assert not other_input.staged
+
+
+def test_service_resumes(mock_environ, monkeypatch, temp_dir, tmp_path, smap_data_operation_message, smap_stac):
+    """
+    Verify a retry of an item that failed while staging its second COG
+    converts nothing again, and only stages the second COG.
+    """
+    checkpoint_directory = tmp_path / 'checkpoints'
+    monkeypatch.setenv('CHECKPOINT_DIRECTORY', str(checkpoint_directory))
+
+    with open(smap_data_operation_message, 'r', encoding='utf-8') as file_handler:
+        smap_data_operation_json = json.load(file_handler)
+    smap_data_operation_json['sources'][0]['variables'].append({
+        'id': 'V12345-ABC',
+        'name': 'gland',
+        'fullPath': 'gland',
+    })
+    with open(smap_data_operation_message, 'w', encoding='utf-8') as file_handler:
+        json.dump(smap_data_operation_json, file_handler, indent=2)
+
+    metadata_dir = join(temp_dir, 'metadata')
+    test_args = [
+        net2cog.netcdf_convert_harmony.__file__,
+        "--harmony-action", "invoke",
+        "--harmony-input-file", str(smap_data_operation_message),
+        "--harmony-sources", str(smap_stac),
+        "--harmony-metadata-dir", metadata_dir,
+    ]
+
+    def fail_gland(local_filename, *args, **kwargs):
+        if basename(local_filename) == 'gland.tif':
+            raise OSError('preempted')
+        return stage_file(local_filename, *args, **kwargs)
+
+    with patch.object(sys, 'argv', test_args), \
+            patch('net2cog.netcdf_convert_harmony.stage_file', side_effect=fail_gland):
+        with pytest.raises(OSError, match="preempted"):
+            net2cog.netcdf_convert_harmony.main()
+
+    item_directory, = checkpoint_directory.glob('*/*')
+    with open(item_directory / MANIFEST_NAME, 'r', encoding='utf-8') as file_handler:
+        manifest = json.load(file_handler)
+    assert sorted(manifest['converted']) == ['gland', 'sss_smap']
+    assert list(manifest['staged']) == ['sss_smap.tif']
+
+    with patch.object(sys, 'argv', test_args), \
+            patch('net2cog.netcdf_convert._write_cogtiff', wraps=netcdf_convert._write_cogtiff) as write_cogtiff, \
+            patch('net2cog.netcdf_convert_harmony.download') as download, \
+            patch('net2cog.netcdf_convert_harmony.stage_file', wraps=stage_file) as staged:
+        net2cog.netcdf_convert_harmony.main()
+
+    write_cogtiff.assert_not_called()
+    download.assert_not_called()
+    assert [basename(call.args[0]) for call in staged.call_args_list] == ['gland.tif']
+    assert not item_directory.exists()
+
+    output_item = next(Catalog.from_file(join(metadata_dir, 'catalog.json')).get_items())
+    assert len(output_item.assets) == 2
+    for asset in output_item.assets.values():
+        assert asset.extra_fields['raster:bands'][0]['data_type'] == 'float32'
+        assert asset.extra_fields['file:checksum'].startswith('1220')
@@ -0,0 +1,85 @@
+"""
+==============
+test_compression.py
+==============
+
+Test the choice of COG compression, fixed or auto-tuned per variable.
+"""
+import pathlib
+
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog.compression import (METADATA_KEY, SETTINGS, CandidateResult, CompressionConfig, choose,
+                                 sample_tiles)
+from net2cog.netcdf_convert import netcdf_converter
+
+
+@pytest.mark.parametrize('objective, expected', [
+    ('size', 'zstd-predictor'),
+    ('encode', 'zstd-fast'),
+    ('decode', 'deflate'),
+])
+def test_choose(objective, expected):
+    """
+    Verify the smallest setting is chosen for size, and otherwise the
+    fastest setting within the size tolerance of the smallest.
+    """
+    results = [
+        CandidateResult(SETTINGS['none'], 1000, 0.001, 0.001),
+        CandidateResult(SETTINGS['deflate'], 520, 0.010, 0.002),
+        CandidateResult(SETTINGS['zstd-fast'], 540, 0.003, 0.004),
+        CandidateResult(SETTINGS['zstd-predictor'], 500, 0.020, 0.005),
+    ]
+    assert choose(results, objective, size_tolerance=0.1).setting.name == expected
+
+
+def test_sample_tiles(tmp_path):
+    """Verify sampled edge tiles are padded, and the sample is reproducible."""
+    data = np.arange(1, 41 * 23 + 1, dtype='int16').reshape(23, 41)
+    raster_file = str(tmp_path / 'raster.tif')
+    with rasterio.open(raster_file, 'w', driver='GTiff', width=41, height=23, count=1, dtype='int16') as dataset:
+        dataset.write(data, 1)
+
+    with rasterio.open(raster_file) as dataset:
+        sample = sample_tiles(dataset, 16, count=20)
+        assert sample.shape == (1, 6 * 16, 16)
+        # Every tile is sampled once, with its valid pixels
+        assert np.count_nonzero(sample) == data.size
+        assert np.array_equal(sample, sample_tiles(dataset, 16, count=20))
+
+
+def test_invalid_config():
+    """Verify unknown settings and objectives are rejected."""
+    with pytest.raises(ValueError, match='Unknown compression lz4'):
+        CompressionConfig(mode='lz4')
+    with pytest.raises(ValueError, match='Unknown compression objective'):
+        CompressionConfig(mode='auto', objective='ratio')
+
+
+@pytest.mark.parametrize('config, expected', [
+    (CompressionConfig(), 'deflate'),
+    (CompressionConfig(mode='zstd-predictor'), 'zstd-predictor'),
+    (CompressionConfig(mode='auto', objective='size'), None),
+])
+def test_cog_compression(smap_file, temp_dir, logger, config, expected):
+    """
+    Verify the COG is written with the configured setting, and the setting
+    chosen in auto mode is recorded in the COG metadata.
+    """
+    results = netcdf_converter(smap_file, pathlib.Path(temp_dir), ['sss_smap'], logger, compression=config)
+
+    with rasterio.open(results[0]) as cog:
+        tags = cog.tags()
+        if expected is None:
+            expected = tags[METADATA_KEY]
+            assert tags[f'{METADATA_KEY}_OBJECTIVE'] == 'size'
+        else:
+            assert METADATA_KEY not in tags
+        setting = SETTINGS[expected]
+
+        structure = cog.tags(ns='IMAGE_STRUCTURE')
+        assert structure.get('COMPRESSION', 'NONE') == setting.codec
+        assert structure.get('PREDICTOR', '1') == ('3' if setting.predictor else '1')
+        assert np.isfinite(cog.read(1, masked=True)).any()
@@ -0,0 +1,127 @@
+"""
+==============
+test_dedupe.py
+==============
+
+Test that COGs of variables identical across granules are reused.
+"""
+import json
+import logging
+import sys
+from os.path import join
+from unittest.mock import patch
+
+import netCDF4
+import numpy as np
+from pystac import Catalog
+
+import net2cog.netcdf_convert_harmony
+from net2cog import dedupe, netcdf_convert
+from net2cog.dedupe import DedupeIndex, content_hash
+from net2cog.netcdf_convert import _GroupDatasets
+from net2cog.staging import StagedFile, stage_file
+
+
+def test_content_hash(smap_file, monkeypatch):
+    """
+    Verify the hash does not depend on how many rows are read at a time, and
+    changes with the values of the variable and the conversion settings.
+    """
+    logger = logging.getLogger()
+    with _GroupDatasets(str(smap_file), logger) as group_datasets:
+        gland_hash = content_hash(group_datasets.open('/'), 'gland', 'deflate')
+        monkeypatch.setattr(dedupe, 'WINDOW_BYTES', 1000)
+        assert content_hash(group_datasets.open('/'), 'gland', 'deflate') == gland_hash
+        assert content_hash(group_datasets.open('/'), 'gland', 'zstd') != gland_hash
+        assert content_hash(group_datasets.open('/'), 'fland', 'deflate') != gland_hash
+
+    with netCDF4.Dataset(smap_file, 'a') as dataset:
+        dataset['gland'][0, 0] = 0.5
+    with _GroupDatasets(str(smap_file), logger) as group_datasets:
+        assert content_hash(group_datasets.open('/'), 'gland', 'deflate') != gland_hash
+
+
+def test_variables(monkeypatch, tmp_path):
+    """Verify only the configured variables are hashed."""
+    monkeypatch.setenv('DEDUPE_VARIABLES', ' gland,/*/land_mask ,')
+    variables = dedupe.dedupe_variables_from_environment()
+    assert variables == ['gland', '*/land_mask']
+
+    logger = logging.getLogger()
+    deduplicator = dedupe.GranuleDeduplicator(DedupeIndex(str(tmp_path / 'index.sqlite'), logger), str(tmp_path),
+                                              'deflate', variables, logger)
+    with patch('net2cog.dedupe.content_hash', return_value='abc') as hashed:
+        for variable_name in ['gland', 'sss_smap', 'data_01/land_mask', 'data_01/ku/ssha']:
+            assert deduplicator.existing_output(variable_name, None) is None
+    assert [call.args[1] for call in hashed.call_args_list] == ['gland', 'data_01/land_mask']
+
+
+def test_index(tmp_path):
+    """Verify entries are shared through the index file, and expire."""
+    logger = logging.getLogger()
+    index = DedupeIndex(str(tmp_path / 'index.sqlite'), logger)
+    index.record('abc', StagedFile('s3://bucket/gland.tif', 10, '1220ab'), [{'data_type': 'float32'}])
+
+    staged_file, raster_bands = DedupeIndex(str(tmp_path / 'index.sqlite'), logger).lookup('abc')
+    assert staged_file == StagedFile('s3://bucket/gland.tif', 10, '1220ab')
+    assert raster_bands == [{'data_type': 'float32'}]
+    assert index.lookup('def') is None
+    assert DedupeIndex(str(tmp_path / 'index.sqlite'), logger, max_age=-1).lookup('abc') is None
+
+
+def test_service_reuses(mock_environ, monkeypatch, temp_dir, tmp_path, smap_file, smap_data_operation_message,
+                        smap_stac):
+    """
+    Verify a granule whose `gland` is identical to a granule already converted
+    refers to its staged COG, while its changed `sss_smap` is converted and
+    staged.
+    """
+    monkeypatch.setenv('DEDUPE_INDEX', str(tmp_path / 'index.sqlite'))
+    monkeypatch.setenv('DEDUPE_VARIABLES', 'gland, fland')
+
+    with open(smap_data_operation_message, 'r', encoding='utf-8') as file_handler:
+        smap_data_operation_json = json.load(file_handler)
+    smap_data_operation_json['sources'][0]['variables'].append({
+        'id': 'V12345-ABC',
+        'name': 'gland',
+        'fullPath': 'gland',
+    })
+    with open(smap_data_operation_message, 'w', encoding='utf-8') as file_handler:
+        json.dump(smap_data_operation_json, file_handler, indent=2)
+
+    def run_service(metadata_dir):
+        test_args = [
+            net2cog.netcdf_convert_harmony.__file__,
+            "--harmony-action", "invoke",
+            "--harmony-input-file", str(smap_data_operation_message),
+            "--harmony-sources", str(smap_stac),
+            "--harmony-metadata-dir", metadata_dir,
+        ]
+        with patch.object(sys, 'argv', test_args), \
+                patch('net2cog.netcdf_convert._write_cogtiff', wraps=netcdf_convert._write_cogtiff) as write_cogtiff, \
+                patch('net2cog.netcdf_convert_harmony.stage_file', wraps=stage_file) as staged, \
+                patch('net2cog.dedupe.content_hash', wraps=content_hash) as hashed:
+            net2cog.netcdf_convert_harmony.main()
+        output_item = next(Catalog.from_file(join(metadata_dir, 'catalog.json')).get_items())
+        # Only the variables to deduplicate are hashed
+        assert [call.args[1] for call in hashed.call_args_list] == ['gland']
+        return output_item, write_cogtiff, staged
+
+    first_item, _, _ = run_service(join(temp_dir, 'first'))
+
+    with netCDF4.Dataset(smap_file, 'a') as dataset:
+        dataset['sss_smap'][:] = np.asarray(dataset['sss_smap'][:]) + 1
+
+    second_item, write_cogtiff, staged = run_service(join(temp_dir, 'second'))
+
+    assert [call.args[2] for call in write_cogtiff.call_args_list] == ['sss_smap']
+    assert len(staged.call_args_list) == 1
+    assert list(second_item.assets) == list(first_item.assets)
+    gland = next(key for key in second_item.assets if 'gland' in key)
+    sss_smap = next(key for key in second_item.assets if 'sss_smap' in key)
+    first_gland, second_gland = first_item.assets[gland].to_dict(), second_item.assets[gland].to_dict()
+    assert second_gland['href'] == first_gland['href']
+    assert second_gland['file:checksum'] == first_gland['file:checksum']
+    assert second_gland['raster:bands'] == first_gland['raster:bands']
+    assert (second_item.assets[sss_smap].to_dict()['file:checksum']
+            != first_item.assets[sss_smap].to_dict()['file:checksum'])
@@ -0,0 +1,31 @@
+"""
+=================
+test_load_test.py
+=================
+
+Smoke test the load-testing harness in `benchmarks/load_test.py`.
+"""
+import argparse
+import importlib.util
+import sys
+from os.path import dirname, join
+
+
+def test_load_test(mock_environ, monkeypatch, tmp_path):
+    """Verify every synthetic request is run end to end and reported."""
+    spec = importlib.util.spec_from_file_location(
+        'load_test', join(dirname(dirname(__file__)), 'benchmarks', 'load_test.py'))
+    load_test = importlib.util.module_from_spec(spec)
+    # Workers find the functions they run by module name
+    monkeypatch.setitem(sys.modules, 'load_test', load_test)
+    spec.loader.exec_module(load_test)
+
+    args = argparse.Namespace(requests=3, concurrency=2, granules=2, variables=2, size=64, sample_interval=0.01)
+    results = load_test.run_load_test(args, str(tmp_path))
+
+    assert results['output_assets'] == 3 * 2 * 2
+    assert 0 < results['latency_seconds']['p50'] <= results['latency_seconds']['max']
+    assert results['peak_rss_bytes']['max_worker'] > 0
+    assert results['staged_bytes'] > 0
+    # Work directories are removed once each request completes
+    assert not list((tmp_path / 'data').iterdir())
@@ -0,0 +1,78 @@
+"""
+==============
+test_masking.py
+==============
+
+Test invalid pixels are masked in output COGs.
+"""
+import pathlib
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog.netcdf_convert import netcdf_converter
+
+
+@pytest.fixture(name='masked_file')
+def fixture_masked_file(temp_dir):
+    """A NetCDF-4 file with a packed variable with a fill value and valid
+    range, a variable with only a missing value, and a flag variable.
+    """
+    masked_file_path = pathlib.Path(temp_dir, 'masked.nc')
+    with netCDF4.Dataset(masked_file_path, 'w') as dataset:
+        dataset.createDimension('lat', 32)
+        dataset.createDimension('lon', 64)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = np.linspace(-89, 89, 32)
+        dataset['lat'].standard_name = 'latitude'
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.linspace(-179, 179, 64)
+        dataset['lon'].standard_name = 'longitude'
+
+        sst = dataset.createVariable('sst', 'i2', ('lat', 'lon'), fill_value=-32768)
+        sst.set_auto_maskandscale(False)
+        sst.scale_factor = 0.01
+        sst.valid_min = 0
+        sst.valid_max = 3000
+        packed = np.full((32, 64), 1500, dtype='i2')
+        packed[0, :] = -32768
+        packed[1, :] = 5000
+        sst[:] = packed
+
+        wind = dataset.createVariable('wind', 'f4', ('lat', 'lon'))
+        wind.missing_value = np.float32(-999.0)
+        wind.set_auto_maskandscale(False)
+        wind_data = np.ones((32, 64), dtype='f4')
+        wind_data[0, 0] = -999.0
+        wind[:] = wind_data
+
+        quality = dataset.createVariable('quality', 'i1', ('lat', 'lon'), fill_value=-1)
+        quality.flag_values = np.array([0, 1], dtype='i1')
+        quality.flag_meanings = 'good bad'
+        quality[:] = np.zeros((32, 64), dtype='i1')
+
+    return masked_file_path
+
+
+def test_masked_cogs(masked_file, temp_dir, logger):
+    """
+    Verify fill, missing and out of range values are nodata in the COG, and
+    overviews of continuous data are averaged.
+    """
+    sst, wind, quality = netcdf_converter(masked_file, pathlib.Path(temp_dir), ['sst', 'wind', 'quality'], logger)
+
+    with rasterio.open(sst) as dataset:
+        assert dataset.nodata == -32768
+        data = dataset.read(1)
+        # The first rows of the file are the southernmost
+        assert (data[-2:, :] == -32768).all()
+        assert (data[:-2, :] == 1500).all()
+        assert dataset.tags()['OVR_RESAMPLING_ALG'] == 'AVERAGE'
+        assert float(dataset.tags(1)['STATISTICS_VALID_COUNT']) == 30 * 64
+
+    with rasterio.open(wind) as dataset:
+        assert dataset.nodata == -999.0
+        assert dataset.read(1, masked=True).mask.sum() == 1
+
+    with rasterio.open(quality) as dataset:
+        assert dataset.tags()['OVR_RESAMPLING_ALG'] == 'NEAREST'
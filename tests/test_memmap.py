@@ -0,0 +1,105 @@
+"""
+==============
+test_memmap.py
+==============
+
+Test zero-copy reads of uncompressed NetCDF variables.
+"""
+import pathlib
+from unittest.mock import patch
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog import netcdf_convert
+from net2cog.memmap import mapped_array
+from net2cog.netcdf_convert import _GroupDatasets, netcdf_converter
+
+
+def _write_file(path: pathlib.Path, file_format: str):
+    """Write a file with fixed and record variables, on a grid stored south
+    to north in 0..360.
+    """
+    rng = np.random.default_rng(2)
+    with netCDF4.Dataset(path, 'w', format=file_format) as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('lat', 45)
+        dataset.createDimension('lon', 90)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = np.linspace(-88, 88, 45)
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.linspace(2, 358, 90)
+        dataset.createVariable('time', 'f8', ('time',))[:] = [0.0, 1.0]
+
+        contiguous = {'contiguous': True} if file_format == 'NETCDF4' else {}
+        sst = dataset.createVariable('sst', 'f4', ('lat', 'lon'), fill_value=-999.0, **contiguous)
+        sst.missing_value = np.float32(-999.0)
+        sst_data = rng.normal(15, 5, (45, 90)).astype('f4')
+        sst_data[:5, :10] = -999.0
+        sst_data[20, 20:30] = np.nan
+        sst.set_auto_maskandscale(False)
+        sst[:] = sst_data
+
+        wind = dataset.createVariable('wind', 'i2', ('lat', 'lon'), fill_value=-32767, **contiguous)
+        wind.scale_factor = 0.01
+        wind.add_offset = 10.0
+        wind.set_auto_maskandscale(False)
+        wind[:] = rng.integers(-2000, 2000, (45, 90)).astype('i2')
+
+        for name, dtype in [('count', 'i4'), ('flag', 'i1')]:
+            record = dataset.createVariable(name, dtype, ('time', 'lat', 'lon'))
+            record[:] = rng.integers(0, 100, (2, 45, 90)).astype(dtype)
+
+
+@pytest.mark.parametrize('file_format', [
+    'NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET', 'NETCDF3_64BIT_DATA', 'NETCDF4',
+])
+def test_mapped_array(tmp_path, file_format):
+    """
+    Verify fixed and interleaved record variables are mapped as stored, and
+    chunked NetCDF-4 variables are not mapped.
+    """
+    path = tmp_path / 'granule.nc'
+    _write_file(path, file_format)
+
+    with netCDF4.Dataset(path) as dataset:
+        dataset.set_auto_maskandscale(False)
+        for name in ['sst', 'wind', 'count', 'flag']:
+            array = mapped_array(str(path), '/', name)
+            if file_format == 'NETCDF4' and name in ('count', 'flag'):
+                # Variables with an unlimited dimension are chunked
+                assert array is None
+                continue
+            assert not array.flags.writeable
+            np.testing.assert_array_equal(array, dataset[name][:])
+    assert mapped_array(str(path), '/', 'missing') is None
+
+
+@pytest.mark.parametrize('file_format', ['NETCDF3_64BIT_OFFSET', 'NETCDF4'])
+def test_mapped_conversion(tmp_path, logger, file_format):
+    """
+    Verify COGs written from the memory map, including flipping, wrapping and
+    masked values, are the same as those written through xarray.
+    """
+    path = tmp_path / 'granule.nc'
+    _write_file(path, file_format)
+    mapped_dir = tmp_path / 'mapped'
+    xarray_dir = tmp_path / 'xarray'
+    mapped_dir.mkdir()
+    xarray_dir.mkdir()
+
+    with patch('net2cog.netcdf_convert.write_raster', wraps=netcdf_convert.write_raster) as write_raster:
+        mapped_cogs = netcdf_converter(path, mapped_dir, ['sst', 'wind', 'count'], logger)
+    with patch.object(_GroupDatasets, 'mapped', return_value=None):
+        xarray_cogs = netcdf_converter(path, xarray_dir, ['sst', 'wind', 'count'], logger)
+
+    mapped_variables = [call.args[0].name for call in write_raster.call_args_list]
+    assert mapped_variables == (['sst', 'wind', 'count'] if file_format != 'NETCDF4' else ['sst', 'wind'])
+    for mapped_cog, xarray_cog in zip(mapped_cogs, xarray_cogs):
+        with rasterio.open(mapped_cog) as actual, rasterio.open(xarray_cog) as expected:
+            assert actual.profile == expected.profile
+            assert actual.tags() == expected.tags()
+            assert actual.tags(1) == expected.tags(1)
+            assert actual.scales == expected.scales and actual.offsets == expected.offsets
+            np.testing.assert_array_equal(actual.read(), expected.read())
+            assert actual.bounds.left == pytest.approx(-180)
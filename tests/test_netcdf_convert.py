@@ -1,17 +1,26 @@
 """
-==============
+======================
 test_netcdf_convert.py
-==============
+======================
 
 Test the netcdf conversion functionality.
 """
+import json
 import pathlib
 import subprocess
+import sys
 from os.path import basename, splitext
+from unittest.mock import patch
 
+import netCDF4
+import numpy as np
 import pytest
+import rasterio
+import xarray as xr
 
-from net2cog.netcdf_convert import Net2CogError, netcdf_converter
+from net2cog import netcdf_convert
+from net2cog.netcdf_convert import (ConversionPlan, Net2CogError, _aligned_blocksize, inspect, inspect_main,
+                                    netcdf_converter)
 
 
 def test_single_cog_generation(smap_file, temp_dir, logger):
@@ -90,3 +99,177 @@ def test_unknown_band_selection(in_bands, temp_dir, smap_file, logger):
             in_bands,
             logger
         )
+
+
+def test_grouped_variable_selection(grouped_file, temp_dir, logger):
+    """
+    Verify variables in nested groups are converted, using the coordinates of
+    the root group, and only the groups containing requested variables are
+    opened.
+    """
+    with patch('net2cog.netcdf_convert.xr.open_dataset', wraps=xr.open_dataset) as mock_open_dataset:
+        results = netcdf_converter(
+            grouped_file,
+            pathlib.Path(temp_dir),
+            ['/data_01/ku/ssha'],
+            logger
+        )
+
+    assert [basename(result) for result in results] == ['data_01_ku_ssha.tif']
+    opened_groups = [call.kwargs['group'] for call in mock_open_dataset.call_args_list]
+    assert opened_groups == ['/data_01/ku', '/data_01', None]
+
+
+def test_grouped_all_variables(grouped_file, temp_dir, logger):
+    """
+    Verify requesting all variables includes those in nested groups
+    """
+    results = netcdf_converter(
+        grouped_file,
+        pathlib.Path(temp_dir),
+        [],
+        logger
+    )
+
+    assert sorted(basename(result) for result in results) == [
+        'data_01_ku_ssha.tif',
+        'data_02_c_ssha.tif',
+        'sst.tif',
+    ]
+
+
+def test_unknown_group_selection(grouped_file, temp_dir, logger):
+    """
+    Verify a variable in a group that does not exist raises an exception
+    """
+    with pytest.raises(Net2CogError):
+        netcdf_converter(
+            grouped_file,
+            pathlib.Path(temp_dir),
+            ['data_03/ssha'],
+            logger
+        )
+
+
+def test_inspect(grouped_file, logger):
+    """
+    Verify the plan describes each requested variable, and the reason any
+    variable will not be converted.
+    """
+    plan = inspect(grouped_file, ['sst', 'lat', 'data_01/ku/ssha', 'data_03/ssha'], logger)
+
+    assert plan.convertible_variables == ['sst', 'data_01/ku/ssha']
+    assert plan.estimated_bytes == 2 * 90 * 180 * 4 * 4 // 3
+
+    sst, lat, ssha, missing = plan.variables
+    assert (sst.shape, sst.dtype, sst.found) == ([90, 180], 'float32', True)
+    assert lat.skip_reason == 'excluded coordinate variable'
+    assert ssha.shape == [90, 180]
+    assert not missing.found
+    assert 'cannot open group' in missing.skip_reason
+
+    assert ConversionPlan.from_json(plan.to_json()) == plan
+
+
+def test_convert_from_plan(grouped_file, temp_dir, logger):
+    """
+    Verify the conversion uses the given plan instead of discovering
+    variables again.
+    """
+    plan = inspect(grouped_file, [], logger)
+
+    with patch('net2cog.netcdf_convert._GroupDatasets.all_variables') as mock_all_variables:
+        results = netcdf_converter(grouped_file, pathlib.Path(temp_dir), [], logger, plan=plan)
+
+    mock_all_variables.assert_not_called()
+    assert sorted(basename(result) for result in results) == [
+        'data_01_ku_ssha.tif',
+        'data_02_c_ssha.tif',
+        'sst.tif',
+    ]
+
+
+def test_inspect_main(grouped_file, capsys):
+    """
+    Verify the inspect CLI prints the plan as JSON
+    """
+    with patch.object(sys, 'argv', ['net2cog_inspect', str(grouped_file), '-v', 'sst']):
+        inspect_main()
+
+    plan = json.loads(capsys.readouterr().out)
+    assert [variable['name'] for variable in plan['variables']] == ['sst']
+
+
+@pytest.mark.parametrize('chunksizes, expected_blocksize', [
+    (None, None),
+    ([1, 256, 256], 256),
+    ([384, 768], 128),
+    ([2048, 2048], 1024),
+    ([90, 180], None),
+    ([32, 32], None),
+])
+def test_aligned_blocksize(chunksizes, expected_blocksize):
+    """
+    Verify COG tiles evenly divide suitable NetCDF chunks, and the fixed
+    profile is used otherwise.
+    """
+    assert _aligned_blocksize(chunksizes) == expected_blocksize
+
+
+def test_chunk_aligned_cog(temp_dir, logger):
+    """
+    Verify a chunked variable is converted to a valid COG with tiles aligned
+    to the NetCDF chunks.
+    """
+    chunked_file = pathlib.Path(temp_dir, 'chunked.nc')
+    with netCDF4.Dataset(chunked_file, 'w') as dataset:
+        dataset.createDimension('lat', 384)
+        dataset.createDimension('lon', 768)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = np.linspace(-89, 89, 384)
+        dataset['lat'].standard_name = 'latitude'
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.linspace(-179, 179, 768)
+        dataset['lon'].standard_name = 'longitude'
+        variable = dataset.createVariable('sst', 'f4', ('lat', 'lon'), zlib=True, chunksizes=(192, 192))
+        variable[:] = np.arange(384 * 768, dtype='f4').reshape(384, 768)
+
+    results = netcdf_converter(chunked_file, pathlib.Path(temp_dir), ['sst'], logger)
+
+    with rasterio.open(results[0]) as cog:
+        assert cog.block_shapes == [(64, 64)]
+        # North-up, so the last row of the file is the first of the COG
+        assert cog.read(1)[0, -1] == 384 * 768 - 1
+    assert subprocess.run(['rio', 'cogeo', 'validate', results[0]], check=False).returncode == 0
+
+
+def test_flipped_chunk_windows(temp_dir, logger):
+    """
+    Verify a south-up variable whose height is not a multiple of its chunks
+    is written in windows of whole chunks, starting with the partial chunk
+    row stored last.
+    """
+    chunked_file = pathlib.Path(temp_dir, 'south_up.nc')
+    with netCDF4.Dataset(chunked_file, 'w') as dataset:
+        dataset.createDimension('lat', 400)
+        dataset.createDimension('lon', 384)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = np.linspace(-89.5, 89.5, 400)
+        dataset['lat'].standard_name = 'latitude'
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.linspace(-179.5, 179.5, 384)
+        dataset['lon'].standard_name = 'longitude'
+        variable = dataset.createVariable('sst', 'i2', ('lat', 'lon'), zlib=True, chunksizes=(192, 192),
+                                          fill_value=-32767)
+        variable.scale_factor = 0.01
+        variable.units = 'kelvin'
+        data = (np.arange(400 * 384) % 30000).reshape(400, 384)
+        data[0, :10] = -32767
+        variable.set_auto_maskandscale(False)
+        variable[:] = data
+
+    with patch('net2cog.netcdf_convert.write_block', wraps=netcdf_convert.write_block) as write_block:
+        cog, = netcdf_converter(chunked_file, pathlib.Path(temp_dir), ['sst'], logger)
+    windows = [call.args[2] for call in write_block.call_args_list]
+    assert [(window.row_off, window.height) for window in windows] == [(0, 16), (16, 192), (208, 192)]
+
+    with rasterio.open(cog) as dataset:
+        assert dataset.dtypes[0] == 'int16' and dataset.nodata == -32767
+        assert dataset.scales == (0.01,) and dataset.tags()['units'] == 'kelvin'
+        np.testing.assert_array_equal(dataset.read(1), data[::-1])
@@ -6,13 +6,18 @@ test_netcdf_convert_harmony.py
 Test the Harmony service by invoking it as Harmony would.
 """
 import json
+import os
 import sys
+import threading
+from os.path import join
 from unittest.mock import patch
 
 import pytest
 from harmony_service_lib.exceptions import HarmonyException
+from pystac import Catalog
 
 import net2cog.netcdf_convert_harmony
+from net2cog.netcdf_convert import netcdf_converter
 
 
 def test_service_invoke(mock_environ, temp_dir, smap_data_operation_message, smap_stac):
@@ -31,6 +36,42 @@ def test_service_invoke(mock_environ, temp_dir, smap_data_operation_message, sma
     with patch.object(sys, 'argv', test_args):
         net2cog.netcdf_convert_harmony.main()
 
+    output_item = next(Catalog.from_file(join(temp_dir, 'catalog.json')).get_items())
+    asset, = output_item.assets.values()
+    raster_band, = asset.extra_fields['raster:bands']
+    assert raster_band['data_type'] == 'float32'
+    assert raster_band['statistics']['minimum'] <= raster_band['statistics']['maximum']
+    assert len(raster_band['histogram']['buckets']) == 256
+    assert asset.extra_fields['file:size'] > 0
+    # sha2-256 multihash prefix
+    assert asset.extra_fields['file:checksum'].startswith('1220')
+
+
+def test_service_quicklook(mock_environ, monkeypatch, temp_dir, smap_data_operation_message, smap_stac):
+    """Test a quicklook of each COG is staged as a thumbnail asset when
+    enabled.
+    """
+    monkeypatch.setenv('QUICKLOOK', 'true')
+    monkeypatch.setenv('QUICKLOOK_SIZE', '64')
+    test_args = [
+        net2cog.netcdf_convert_harmony.__file__,
+        "--harmony-action", "invoke",
+        "--harmony-input-file", str(smap_data_operation_message),
+        "--harmony-sources", str(smap_stac),
+        "--harmony-metadata-dir", temp_dir,
+    ]
+
+    with patch.object(sys, 'argv', test_args):
+        net2cog.netcdf_convert_harmony.main()
+
+    output_item = next(Catalog.from_file(join(temp_dir, 'catalog.json')).get_items())
+    cog_asset, thumbnail = output_item.assets.values()
+    assert cog_asset.roles == ['visual']
+    assert thumbnail.roles == ['thumbnail']
+    assert thumbnail.media_type == 'image/png'
+    assert thumbnail.title == cog_asset.title.replace('.tif', '.png')
+    assert thumbnail.extra_fields['file:size'] > 0
+
 
 def test_service_multiple_variables(mock_environ, temp_dir, smap_data_operation_message, smap_stac):
     """Test service invocation when including multiple variables."""
@@ -108,3 +149,210 @@ def test_service_error(mock_environ, temp_dir, smap_data_operation_message, smap
     with patch.object(sys, 'argv', test_args):
         with pytest.raises(HarmonyException, match="No variable named 'thor'."):
             net2cog.netcdf_convert_harmony.main()
+
+
+def test_service_concurrent_items(mock_environ, monkeypatch, temp_dir, smap_data_operation_message, smap_stac, smap_item):
+    """Test service invocation with several granules in the input catalog,
+    processed concurrently. Each granule must be converted in its own work
+    directory, and all work directories must be removed afterwards.
+
+    """
+    item_count = 3
+    monkeypatch.setenv('ITEM_CONCURRENCY', str(item_count))
+
+    with open(smap_item, 'r', encoding='utf-8') as file_handler:
+        stac_item_json = json.load(file_handler)
+    with open(smap_stac, 'r', encoding='utf-8') as file_handler:
+        stac_catalog_json = json.load(file_handler)
+
+    for index in range(1, item_count):
+        stac_item_json['id'] = f'granule_{index}'
+        stac_item_basename = f'granule_{index}.json'
+        with open(join(temp_dir, stac_item_basename), 'w', encoding='utf-8') as file_handler:
+            json.dump(stac_item_json, file_handler, indent=2)
+        stac_catalog_json['links'].append({
+            'rel': 'item',
+            'href': f'./{stac_item_basename}',
+            'type': 'application/json',
+        })
+
+    with open(smap_stac, 'w', encoding='utf-8') as file_handler:
+        json.dump(stac_catalog_json, file_handler, indent=2)
+
+    # Every item must reach the barrier before any can finish, which can only
+    # happen when the items are converted concurrently.
+    barrier = threading.Barrier(item_count, timeout=60)
+    output_directories = []
+
+    def concurrent_netcdf_converter(input_nc_file, output_directory, *args, **kwargs):
+        output_directories.append(output_directory)
+        barrier.wait()
+        return netcdf_converter(input_nc_file, output_directory, *args, **kwargs)
+
+    metadata_dir = join(temp_dir, 'metadata')
+    test_args = [
+        net2cog.netcdf_convert_harmony.__file__,
+        "--harmony-action", "invoke",
+        "--harmony-input-file", str(smap_data_operation_message),
+        "--harmony-sources", str(smap_stac),
+        "--harmony-metadata-dir", metadata_dir,
+    ]
+
+    with patch.object(sys, 'argv', test_args), \
+            patch('net2cog.netcdf_convert.netcdf_converter', side_effect=concurrent_netcdf_converter):
+        net2cog.netcdf_convert_harmony.main()
+
+    output_catalog = Catalog.from_file(join(metadata_dir, 'catalog.json'))
+    assert len(list(output_catalog.get_items())) == item_count
+    assert len(set(output_directories)) == item_count
+    assert not any(output_directory.exists() for output_directory in output_directories)
+
+
+@pytest.mark.parametrize('item_concurrency', ['1', '2'])
+def test_service_child_catalogs(mock_environ, monkeypatch, temp_dir, smap_data_operation_message,
+                                smap_stac, smap_item, item_concurrency):
+    """Test the output catalog keeps the child catalog structure of the input
+    catalog, whether or not items are processed concurrently.
+
+    """
+    monkeypatch.setenv('ITEM_CONCURRENCY', item_concurrency)
+
+    with open(smap_item, 'r', encoding='utf-8') as file_handler:
+        stac_item_json = json.load(file_handler)
+
+    stac_item_json['id'] = 'child_granule'
+    stac_item_json['links'] = [
+        {'rel': 'root', 'href': '../catalog.json', 'type': 'application/json'},
+        {'rel': 'parent', 'href': './catalog.json', 'type': 'application/json'},
+    ]
+    child_dir = join(temp_dir, 'child')
+    os.makedirs(child_dir)
+    with open(join(child_dir, 'child_granule.json'), 'w', encoding='utf-8') as file_handler:
+        json.dump(stac_item_json, file_handler, indent=2)
+    with open(join(child_dir, 'catalog.json'), 'w', encoding='utf-8') as file_handler:
+        json.dump({
+            'type': 'Catalog',
+            'id': 'child',
+            'stac_version': '1.0.0',
+            'description': 'child',
+            'links': [
+                {'rel': 'root', 'href': '../catalog.json', 'type': 'application/json'},
+                {'rel': 'parent', 'href': '../catalog.json', 'type': 'application/json'},
+                {'rel': 'item', 'href': './child_granule.json', 'type': 'application/json'},
+            ],
+        }, file_handler, indent=2)
+
+    with open(smap_stac, 'r', encoding='utf-8') as file_handler:
+        stac_catalog_json = json.load(file_handler)
+    stac_catalog_json['links'].append({
+        'rel': 'child',
+        'href': './child/catalog.json',
+        'type': 'application/json',
+    })
+    with open(smap_stac, 'w', encoding='utf-8') as file_handler:
+        json.dump(stac_catalog_json, file_handler, indent=2)
+
+    metadata_dir = join(temp_dir, 'metadata')
+    test_args = [
+        net2cog.netcdf_convert_harmony.__file__,
+        "--harmony-action", "invoke",
+        "--harmony-input-file", str(smap_data_operation_message),
+        "--harmony-sources", str(smap_stac),
+        "--harmony-metadata-dir", metadata_dir,
+    ]
+
+    with patch.object(sys, 'argv', test_args):
+        net2cog.netcdf_convert_harmony.main()
+
+    output_catalog = Catalog.from_file(join(metadata_dir, 'catalog.json'))
+    output_children = list(output_catalog.get_children())
+    assert len(list(output_catalog.get_items())) == 1
+    assert len(output_children) == 1
+    assert len(list(output_children[0].get_items())) == 1
+
+
+def _concatenate_request(temp_dir, smap_data_operation_message, smap_stac, smap_item) -> list[str]:
+    """Ask to concatenate the SMAP granule with a copy of it, and return the
+    service arguments.
+    """
+    with open(smap_data_operation_message, 'r', encoding='utf-8') as file_handler:
+        smap_data_operation_json = json.load(file_handler)
+    smap_data_operation_json['concatenate'] = True
+    with open(smap_data_operation_message, 'w', encoding='utf-8') as file_handler:
+        json.dump(smap_data_operation_json, file_handler, indent=2)
+
+    with open(smap_item, 'r', encoding='utf-8') as file_handler:
+        stac_item_json = json.load(file_handler)
+    stac_item_json['id'] = 'next_granule'
+    stac_item_json['properties']['start_datetime'] = '2002-02-02T02:02:02Z'
+    stac_item_json['properties']['end_datetime'] = '2003-03-03T03:03:03Z'
+    with open(join(temp_dir, 'next_granule.json'), 'w', encoding='utf-8') as file_handler:
+        json.dump(stac_item_json, file_handler, indent=2)
+
+    with open(smap_stac, 'r', encoding='utf-8') as file_handler:
+        stac_catalog_json = json.load(file_handler)
+    stac_catalog_json['links'].append({'rel': 'item', 'href': './next_granule.json', 'type': 'application/json'})
+    with open(smap_stac, 'w', encoding='utf-8') as file_handler:
+        json.dump(stac_catalog_json, file_handler, indent=2)
+
+    return [
+        net2cog.netcdf_convert_harmony.__file__,
+        "--harmony-action", "invoke",
+        "--harmony-input-file", str(smap_data_operation_message),
+        "--harmony-sources", str(smap_stac),
+        "--harmony-metadata-dir", join(temp_dir, 'metadata'),
+    ]
+
+
+def test_service_concatenate(mock_environ, temp_dir, smap_data_operation_message, smap_stac, smap_item):
+    """Test a request to concatenate granules produces a single item with a
+    band per granule, covering the time range of all granules.
+
+    """
+    test_args = _concatenate_request(temp_dir, smap_data_operation_message, smap_stac, smap_item)
+    metadata_dir = join(temp_dir, 'metadata')
+
+    with patch.object(sys, 'argv', test_args):
+        net2cog.netcdf_convert_harmony.main()
+
+    output_item, = Catalog.from_file(join(metadata_dir, 'catalog.json')).get_items()
+    assert output_item.common_metadata.start_datetime.year == 2001
+    assert output_item.common_metadata.end_datetime.year == 2003
+    asset, = output_item.assets.values()
+    assert len(asset.extra_fields['raster:bands']) == 2
+
+
+def test_service_concatenate_quicklook(mock_environ, monkeypatch, temp_dir, smap_data_operation_message, smap_stac,
+                                       smap_item):
+    """Test a concatenated item has the quicklook of its COG as a
+    thumbnail.
+    """
+    monkeypatch.setenv('QUICKLOOK', 'true')
+    test_args = _concatenate_request(temp_dir, smap_data_operation_message, smap_stac, smap_item)
+
+    with patch.object(sys, 'argv', test_args):
+        net2cog.netcdf_convert_harmony.main()
+
+    output_item, = Catalog.from_file(join(temp_dir, 'metadata', 'catalog.json')).get_items()
+    cog_asset, thumbnail = output_item.assets.values()
+    assert thumbnail.roles == ['thumbnail']
+    assert thumbnail.title == cog_asset.title.replace('.tif', '.png')
+    assert '_stacked' in thumbnail.title
+
+
+@pytest.mark.parametrize('variable, value', [
+    ('CHECKPOINT_DIRECTORY', 'checkpoints'),
+    ('DEDUPE_INDEX', 'index.sqlite'),
+])
+def test_service_concatenate_unsupported(mock_environ, monkeypatch, temp_dir, smap_data_operation_message,
+                                         smap_stac, smap_item, variable, value):
+    """Test concatenating granules with checkpoints or deduplication enabled
+    is rejected.
+    """
+    monkeypatch.setenv(variable, join(temp_dir, value))
+    monkeypatch.setenv('DEDUPE_VARIABLES', 'gland')
+    test_args = _concatenate_request(temp_dir, smap_data_operation_message, smap_stac, smap_item)
+
+    with patch.object(sys, 'argv', test_args):
+        with pytest.raises(HarmonyException, match=f'cannot concatenate granules with {variable} set'):
+            net2cog.netcdf_convert_harmony.main()
@@ -0,0 +1,82 @@
+"""
+==============
+test_normalize.py
+==============
+
+Test grids are normalized north-up with longitudes in -180..180.
+"""
+import pathlib
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.normalize import GridLayout, normalize_grid
+
+
+@pytest.mark.parametrize('latitudes, longitudes, expected_layout', [
+    (np.linspace(89, -89, 90), np.linspace(-179, 179, 180), GridLayout()),
+    (np.linspace(-89, 89, 90), np.linspace(-179, 179, 180), GridLayout(flip_dim='lat')),
+    (np.linspace(89, -89, 90), np.linspace(1, 359, 180), GridLayout(wrap_dim='lon', wrap_shift=90)),
+    # Regional grid east of the antimeridian
+    (np.linspace(89, -89, 90), np.linspace(190, 200, 180), GridLayout(wrap_dim='lon', wrap_shift=180)),
+    # Regional grid across the antimeridian, which cannot be wrapped
+    (np.linspace(89, -89, 90), np.linspace(170, 190, 180), GridLayout()),
+])
+def test_grid_layout(latitudes, longitudes, expected_layout, logger):
+    """Verify ascending latitudes and longitudes east of 180 are detected."""
+    dataset = xr.Dataset(coords={'lat': latitudes, 'lon': longitudes})
+
+    assert GridLayout.detect(dataset, logger) == expected_layout
+
+
+def test_normalize_grid(logger):
+    """Verify the data moves with the normalized coordinates."""
+    longitudes = np.arange(0.5, 360, 1.0)
+    latitudes = np.arange(-89.5, 90, 1.0)
+    data = np.add.outer(latitudes * 1000, longitudes)
+    dataset = xr.Dataset({'sst': (('lat', 'lon'), data)}, coords={'lat': latitudes, 'lon': longitudes})
+    dataset['lon'].attrs['valid_max'] = 360.0
+
+    normalized = normalize_grid(dataset, logger)
+
+    assert normalized['lat'].values[0] == 89.5
+    assert normalized['lon'].values[0] == -179.5
+    assert normalized['lon'].values[-1] == 179.5
+    assert 'valid_max' not in normalized['lon'].attrs
+    # Each value still encodes its latitude and its longitude in 0..360
+    assert normalized['sst'].sel(lat=10.5, lon=-20.5).item() == 10.5 * 1000 + 339.5
+
+
+def test_normalized_cog(temp_dir, logger):
+    """
+    Verify a 0..360, south-up grid is written as a north-up COG in
+    -180..180, and a nested group with inherited coordinates is written on
+    the same grid.
+    """
+    input_file = pathlib.Path(temp_dir, 'global.nc')
+    with netCDF4.Dataset(input_file, 'w') as dataset:
+        dataset.createDimension('lat', 180)
+        dataset.createDimension('lon', 360)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = np.arange(-89.5, 90, 1.0)
+        dataset['lat'].standard_name = 'latitude'
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.arange(0.5, 360, 1.0)
+        dataset['lon'].standard_name = 'longitude'
+        # Positive in the north-east quadrant only
+        sst = np.zeros((180, 360), dtype='f4')
+        sst[90:, :180] = 1
+        dataset.createVariable('sst', 'f4', ('lat', 'lon'))[:] = sst
+        dataset.createGroup('ocean').createVariable('sst', 'f4', ('lat', 'lon'))[:] = sst
+
+    results = netcdf_converter(input_file, pathlib.Path(temp_dir), ['sst', 'ocean/sst'], logger)
+
+    for result in results:
+        with rasterio.open(result) as cog:
+            assert tuple(cog.bounds) == (-180, -90, 180, 90)
+            assert cog.transform.e < 0
+            data = cog.read(1)
+            assert (data[:90, 180:] == 1).all()
+            assert data.sum() == 90 * 180
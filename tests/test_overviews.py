@@ -0,0 +1,114 @@
+"""
+==============
+test_overviews.py
+==============
+
+Test overviews computed in memory by the numpy engine.
+"""
+import pathlib
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+from rio_cogeo.cogeo import cog_validate
+
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.overviews import OverviewConfig, reduce_levels
+
+
+@pytest.fixture(name='overview_file')
+def fixture_overview_file(temp_dir):
+    """A NetCDF file with a continuous variable with fill values, and a flag
+    variable.
+    """
+    overview_file_path = pathlib.Path(temp_dir) / 'overviews.nc'
+    rng = np.random.default_rng(1)
+    with netCDF4.Dataset(overview_file_path, 'w') as dataset:
+        dataset.createDimension('lat', 96)
+        dataset.createDimension('lon', 200)
+        lat = dataset.createVariable('lat', 'f4', ('lat',))
+        lat[:] = np.linspace(89.0625, -89.0625, 96)
+        lon = dataset.createVariable('lon', 'f4', ('lon',))
+        lon[:] = np.linspace(-179.1, 179.1, 200)
+
+        sst = dataset.createVariable('sst', 'f4', ('lat', 'lon'), fill_value=-999.0)
+        sst_data = rng.normal(15, 5, (96, 200)).astype('f4')
+        sst_data[:40, :50] = -999.0
+        sst_data[rng.random((96, 200)) < 0.1] = -999.0
+        sst.set_auto_maskandscale(False)
+        sst[:] = sst_data
+
+        quality = dataset.createVariable('quality', 'i1', ('lat', 'lon'), fill_value=-1)
+        quality.flag_values = np.array([0, 1, 2], dtype='i1')
+        quality.flag_meanings = 'good fair bad'
+        quality[:] = rng.choice(3, (96, 200)).astype('i1')
+
+    return overview_file_path
+
+
+def test_reduce_levels():
+    """
+    Verify means exclude invalid pixels at every level, modes are the most
+    common valid value, and odd sizes are rounded up.
+    """
+    data = np.array([[[1, 3, 5, 9, 4],
+                      [-1, -1, 7, 7, 4],
+                      [2, 2, -1, -1, 8]]], dtype='f4')
+    valid = data != -1
+
+    half, quarter = reduce_levels(data, valid, 2, 'mean', -1)
+    assert half.shape == (1, 2, 3)
+    assert half.tolist() == [[[2, 7, 4], [2, -1, 8]]]
+    # The mean of the valid full resolution pixels, not of the means
+    assert quarter.tolist() == [[[data[:, :, :4][valid[:, :, :4]].mean(), data[:, :, 4].mean()]]]
+
+    mode, = reduce_levels(data, valid, 1, 'mode', -1)
+    assert mode.tolist() == [[[1, 7, 4], [2, -1, 8]]]
+
+    nearest, = reduce_levels(data, valid, 1, 'nearest', -1)
+    assert nearest.tolist() == [[[1, 5, 4], [2, -1, 8]]]
+
+
+@pytest.mark.parametrize('config, width, height, expected', [
+    (OverviewConfig(), 4096, 3000, 3),
+    (OverviewConfig(max_levels=2), 4096, 3000, 2),
+    (OverviewConfig(), 512, 512, 0),
+    (OverviewConfig(min_size=16), 200, 96, 3),
+])
+def test_level_count(config, width, height, expected):
+    """Verify rasters are halved down to the blocksize, up to the cap."""
+    assert config.level_count(width, height, 512) == expected
+
+
+def test_numpy_overviews(overview_file, temp_dir, logger):
+    """
+    Verify COGs with numpy overviews are valid, and averaged overviews match
+    GDAL's, excluding nodata.
+    """
+    gdal_dir = pathlib.Path(temp_dir) / 'gdal'
+    numpy_dir = pathlib.Path(temp_dir) / 'numpy'
+    gdal_dir.mkdir()
+    numpy_dir.mkdir()
+    gdal_cogs = netcdf_converter(overview_file, gdal_dir, ['sst', 'quality'], logger,
+                                 overviews=OverviewConfig(min_size=16))
+    numpy_cogs = netcdf_converter(overview_file, numpy_dir, ['sst', 'quality'], logger,
+                                  overviews=OverviewConfig(engine='numpy', min_size=16, max_levels=2))
+
+    for numpy_cog in numpy_cogs:
+        assert cog_validate(numpy_cog, strict=True)[0]
+
+    with rasterio.open(gdal_cogs[0]) as gdal_sst, rasterio.open(numpy_cogs[0]) as numpy_sst:
+        assert numpy_sst.overviews(1) == [2, 4]
+        assert numpy_sst.nodata == -999.0
+        assert numpy_sst.tags()['OVR_RESAMPLING_ALG'] == 'AVERAGE'
+        assert numpy_sst.tags(1)['STATISTICS_MEAN'] == gdal_sst.tags(1)['STATISTICS_MEAN']
+        assert np.array_equal(numpy_sst.read(1), gdal_sst.read(1))
+        gdal_overview = gdal_sst.read(1, out_shape=(48, 100))
+        numpy_overview = numpy_sst.read(1, out_shape=(48, 100))
+        assert (numpy_overview[:20, :25] == -999.0).all()
+        np.testing.assert_allclose(numpy_overview, gdal_overview, rtol=1e-5)
+
+    with rasterio.open(numpy_cogs[1]) as numpy_quality:
+        assert numpy_quality.tags()['OVR_RESAMPLING_ALG'] == 'MODE'
+        assert set(np.unique(numpy_quality.read(1, out_shape=(24, 50)))) <= {0, 1, 2}
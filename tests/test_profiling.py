@@ -0,0 +1,138 @@
+"""
+=================
+test_profiling.py
+=================
+
+Test the opt-in profiling of conversions.
+"""
+import pathlib
+import pstats
+import sys
+import threading
+from unittest.mock import patch
+
+import pytest
+
+import net2cog.netcdf_convert_harmony
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.profiling import ProfileConfig, profile
+
+
+def test_profile_variables(smap_file, temp_dir, tmp_path, logger):
+    """
+    Verify a cProfile and tracemalloc file is written for each variable.
+    """
+    profile_config = ProfileConfig(str(tmp_path), scope='variable')
+
+    netcdf_converter(
+        smap_file,
+        pathlib.Path(temp_dir),
+        ['sss_smap', 'gland'],
+        logger,
+        profile_config=profile_config,
+    )
+
+    stats_files = sorted(tmp_path.glob('*.prof'))
+    assert len(stats_files) == 2
+    assert len(list(tmp_path.glob('*.tracemalloc.txt'))) == 2
+    assert 'gland' in stats_files[0].name
+    assert pstats.Stats(str(stats_files[0])).total_calls > 0
+
+
+def test_profile_item(smap_file, temp_dir, tmp_path, logger):
+    """
+    Verify one profile is written for the whole conversion in item scope.
+    """
+    netcdf_converter(
+        smap_file,
+        pathlib.Path(temp_dir),
+        ['sss_smap', 'gland'],
+        logger,
+        profile_config=ProfileConfig(str(tmp_path)),
+    )
+
+    assert len(list(tmp_path.glob('*.prof'))) == 1
+    assert len(list(tmp_path.glob('*.tracemalloc.txt'))) == 1
+
+
+def test_profile_concurrent(tmp_path, logger, caplog):
+    """
+    Verify a block starting while another is profiled is not profiled, and
+    the summary reports the memory traced in the process.
+    """
+    config = ProfileConfig(str(tmp_path))
+    started, done = threading.Event(), threading.Event()
+
+    def profiled():
+        with profile(config, 'item', 'first', logger):
+            started.set()
+            done.wait(10)
+
+    thread = threading.Thread(target=profiled)
+    thread.start()
+    started.wait(10)
+    with profile(config, 'item', 'second', logger):
+        sum(range(1000))
+    done.set()
+    thread.join()
+
+    assert 'Not profiling second' in caplog.text
+    stats_file, = tmp_path.glob('*.prof')
+    assert stats_file.name.startswith('first')
+    summary = next(tmp_path.glob('*.tracemalloc.txt')).read_text(encoding='utf-8').splitlines()
+    assert summary[0].startswith('Memory traced in the process while profiling first')
+    assert ' peak ' in summary[0]
+
+    # The lock is released after profiling
+    with profile(config, 'item', 'third', logger):
+        pass
+    assert len(list(tmp_path.glob('*.prof'))) == 2
+
+
+def test_profile_sampling(smap_file, temp_dir, tmp_path, logger):
+    """
+    Verify nothing is written when no requests are sampled.
+    """
+    netcdf_converter(
+        smap_file,
+        pathlib.Path(temp_dir),
+        ['sss_smap'],
+        logger,
+        profile_config=ProfileConfig(str(tmp_path), sample_rate=0),
+    )
+
+    assert not list(tmp_path.iterdir())
+
+
+def test_profile_disabled_by_default(monkeypatch):
+    """
+    Verify profiling is only enabled when a profile directory is configured.
+    """
+    monkeypatch.delenv('PROFILE_DIRECTORY', raising=False)
+    assert ProfileConfig.from_environment() is None
+
+    with pytest.raises(ValueError):
+        ProfileConfig('/tmp', scope='granule')
+
+
+def test_profile_service_item(mock_environ, monkeypatch, temp_dir, tmp_path, smap_data_operation_message, smap_stac):
+    """
+    Verify the Harmony service writes a profile per item when configured.
+    """
+    profile_dir = tmp_path / 'profiles'
+    monkeypatch.setenv('PROFILE_DIRECTORY', str(profile_dir))
+
+    test_args = [
+        net2cog.netcdf_convert_harmony.__file__,
+        "--harmony-action", "invoke",
+        "--harmony-input-file", str(smap_data_operation_message),
+        "--harmony-sources", str(smap_stac),
+        "--harmony-metadata-dir", temp_dir,
+    ]
+
+    with patch.object(sys, 'argv', test_args):
+        net2cog.netcdf_convert_harmony.main()
+
+    stats_files = list(profile_dir.glob('*.prof'))
+    assert len(stats_files) == 1
+    assert stats_files[0].name.startswith('RSS_smap_SSS_L3_8day_running_2020_005_FNL_v04.0')
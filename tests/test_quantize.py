@@ -0,0 +1,137 @@
+"""
+================
+test_quantize.py
+================
+
+Test lossy quantization of floating point variables.
+"""
+import importlib.util
+import pathlib
+from os.path import dirname, join
+
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.quantize import (BITS_KEY, DIGITS_KEY, MAX_ERROR_KEY, QuantizeConfig, bit_round, digit_round,
+                              quantize)
+
+
+def test_bit_round():
+    """
+    Verify dropped mantissa bits are zero, ties round to even, and the
+    relative error is at most half of the last kept bit.
+    """
+    values = np.array([1 + 2 ** -9, 1 + 3 * 2 ** -9, 1 + 2 ** -9 + 2 ** -12, -3.0], dtype='f4')
+    np.testing.assert_array_equal(bit_round(values, 8), [1, 1 + 2 ** -7, 1 + 2 ** -8, -3])
+
+    for dtype, mantissa_bits in [('f4', 23), ('f8', 52)]:
+        data = np.random.default_rng(0).normal(0, 100, 10000).astype(dtype)
+        rounded = bit_round(data, 10)
+        assert rounded.dtype == data.dtype
+        assert not (rounded.view(f'u{data.itemsize}') & ((1 << (mantissa_bits - 10)) - 1)).any()
+        assert (np.abs(rounded - data) <= np.abs(data) * 2.0 ** -11).all()
+
+
+@pytest.mark.parametrize('digits', [-1, 0, 2, 4])
+def test_digit_round(digits):
+    """Verify values are multiples of a power of two within half of the
+    least significant digit.
+    """
+    data = np.random.default_rng(1).normal(30, 5, 10000).astype('f4')
+    rounded = digit_round(data, digits)
+    step = 2.0 ** np.ceil(np.log2(10.0 ** digits))
+    assert (np.abs(rounded - data) <= 0.5 * 10.0 ** -digits).all()
+    np.testing.assert_array_equal(np.mod(rounded * step, 1), 0)
+
+
+def test_config(monkeypatch):
+    """Verify the configuration is read from the environment and
+    validated.
+    """
+    assert not QuantizeConfig.from_environment().enabled
+    monkeypatch.setenv('QUANTIZE_DIGITS', '2')
+    monkeypatch.setenv('QUANTIZE_VARIABLES', 'sss_smap, data_01/ku/ssha')
+    config = QuantizeConfig.from_environment()
+    assert config == QuantizeConfig(significant_digits=2, variables=['sss_smap', 'data_01/ku/ssha'])
+    assert config.applies('/data_01/ku/ssha')
+    assert not config.applies('gland')
+
+    with pytest.raises(ValueError, match='Only one of'):
+        QuantizeConfig(significant_bits=8, significant_digits=2)
+    with pytest.raises(ValueError, match='at least 1'):
+        QuantizeConfig(significant_bits=0)
+
+
+def test_quantized_cog(smap_file, temp_dir, logger):
+    """
+    Verify only the configured variables are quantized, nodata is kept, and
+    the precision and largest error are recorded.
+    """
+    exact_dir = pathlib.Path(temp_dir) / 'exact'
+    quantized_dir = pathlib.Path(temp_dir) / 'quantized'
+    exact_dir.mkdir()
+    quantized_dir.mkdir()
+    exact_cogs = netcdf_converter(smap_file, exact_dir, ['sss_smap', 'gland'], logger)
+    quantized_cogs = netcdf_converter(smap_file, quantized_dir, ['sss_smap', 'gland'], logger,
+                                      quantization=QuantizeConfig(significant_digits=2, variables=['sss_smap']))
+
+    with rasterio.open(exact_cogs[0]) as exact, rasterio.open(quantized_cogs[0]) as quantized:
+        exact_data, quantized_data = exact.read(1, masked=True), quantized.read(1, masked=True)
+        assert quantized.tags()[DIGITS_KEY] == '2'
+        assert BITS_KEY not in quantized.tags()
+        np.testing.assert_array_equal(quantized_data.mask, exact_data.mask)
+        errors = np.abs(quantized_data - exact_data)
+        assert 0 < errors.max() <= 0.005
+        assert float(quantized.tags()[MAX_ERROR_KEY]) == pytest.approx(errors.max())
+        # Statistics describe the quantized values
+        assert float(quantized.tags(1)['STATISTICS_MAXIMUM']) == quantized_data.max()
+        assert quantized.nodata == exact.nodata
+
+    with rasterio.open(exact_cogs[1]) as exact, rasterio.open(quantized_cogs[1]) as quantized:
+        assert MAX_ERROR_KEY not in quantized.tags()
+        assert np.array_equal(quantized.read(), exact.read())
+
+
+@pytest.mark.parametrize('config, values, expected', [
+    # Rounds to the fill value
+    (QuantizeConfig(significant_digits=0), [-9999.3, -9998.7, -9997.6, 12.4], [-9999.3, -9998.7, -9998.0, 12.0]),
+    # Carries into the exponent, to infinity
+    (QuantizeConfig(significant_bits=2), [np.finfo('f4').max, 1.2], [np.finfo('f4').max, 1.25]),
+    # Overflows when scaled
+    (QuantizeConfig(significant_digits=10), [3e38, 0.123456789], [3e38, 0.123456789]),
+])
+def test_rounding_kept_exact(temp_dir, logger, config, values, expected):
+    """Verify values that would round to nodata or overflow keep their
+    exact value.
+    """
+    path = pathlib.Path(temp_dir) / 'intermediate.tif'
+    data = np.array([values + [-9999.0]], dtype='f4')
+    with rasterio.open(path, 'w', driver='GTiff', width=data.shape[1], height=1, count=1, dtype='float32',
+                       nodata=-9999.0) as dataset:
+        dataset.write(data, 1)
+
+    with rasterio.open(path, 'r+') as dataset:
+        metadata = quantize(dataset, config, 'sst', logger)
+        quantized = dataset.read(1)
+
+    np.testing.assert_array_equal(quantized, np.array([expected + [-9999.0]], dtype='f4'))
+    assert np.isfinite(float(metadata[MAX_ERROR_KEY]))
+
+
+def test_benchmark(smap_file):
+    """Smoke test the benchmark in `benchmarks/quantization.py`."""
+    spec = importlib.util.spec_from_file_location(
+        'quantization', join(dirname(dirname(__file__)), 'benchmarks', 'quantization.py'))
+    quantization = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(quantization)
+
+    results = quantization.benchmark(smap_file, ['sss_smap'], [QuantizeConfig(significant_bits=8)],
+                                     quantization.CompressionConfig())
+
+    none, eight_bits = results['sss_smap']
+    assert none['precision'] == 'none' and none['gain'] == 1 and none['max_error'] == 0
+    assert eight_bits['precision'] == '8 bits'
+    assert eight_bits['gain'] > 1
+    assert 0 < eight_bits['max_error'] <= 0.1
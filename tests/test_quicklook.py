@@ -0,0 +1,85 @@
+"""
+=================
+test_quicklook.py
+=================
+
+Test quicklook PNG previews of converted variables.
+"""
+import pathlib
+from os.path import basename, exists
+
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.quicklook import COLORMAPS, QuicklookConfig, colormap_table, render
+
+
+def test_colormap_table():
+    """Verify colormaps are interpolated between their control points."""
+    for name, control_points in COLORMAPS.items():
+        table = colormap_table(name)
+        assert table.shape == (256, 3) and table.dtype == np.uint8
+        np.testing.assert_array_equal(table[[0, -1]], [control_points[0], control_points[-1]])
+    np.testing.assert_array_equal(colormap_table('gray')[128], [128, 128, 128])
+
+
+def test_render():
+    """Verify values are stretched through the colormap, and invalid pixels
+    are transparent.
+    """
+    data = np.ma.masked_equal(np.array([[-999.0, 0.0, 50.0], [100.0, np.nan, 75.0]]), -999.0)
+    rgba = render(data, 'gray')
+    assert rgba.shape == (4, 2, 3)
+    np.testing.assert_array_equal(rgba[3], [[0, 255, 255], [255, 0, 255]])
+    assert rgba[0, 0, 1] == 0 and rgba[0, 1, 0] == 255
+    assert rgba[0, 0, 1] < rgba[0, 0, 2] < rgba[0, 1, 2] < rgba[0, 1, 0]
+
+    assert not render(np.ma.masked_all((2, 2)), 'gray').any()
+    # Constant values map to the first color
+    np.testing.assert_array_equal(render(np.ma.masked_array(np.ones((1, 2))), 'viridis')[:, 0, 0],
+                                  [68, 1, 84, 255])
+
+
+def test_config(monkeypatch):
+    """Verify the configuration is read from the environment and
+    validated.
+    """
+    assert not QuicklookConfig.from_environment().enabled
+    monkeypatch.setenv('QUICKLOOK', 'true')
+    monkeypatch.setenv('QUICKLOOK_SIZE', '512')
+    monkeypatch.setenv('QUICKLOOK_COLORMAP', 'magma')
+    assert QuicklookConfig.from_environment() == QuicklookConfig(enabled=True, size=512, colormap='magma')
+
+    with pytest.raises(ValueError, match='Unknown quicklook colormap'):
+        QuicklookConfig(colormap='jet')
+    with pytest.raises(ValueError, match='at least 1'):
+        QuicklookConfig(size=0)
+
+
+def test_quicklook(smap_file, temp_dir, logger):
+    """
+    Verify a quicklook of the configured size is written next to each COG,
+    transparent where the COG is nodata.
+    """
+    output_dir = pathlib.Path(temp_dir) / 'output'
+    output_dir.mkdir()
+    cogs = netcdf_converter(smap_file, output_dir, ['sss_smap', 'gland'], logger,
+                            quicklook=QuicklookConfig(enabled=True, size=200))
+
+    for cog in cogs:
+        quicklook = output_dir / basename(cog).replace('.tif', '.png')
+        with rasterio.open(quicklook) as png, rasterio.open(cog) as dataset:
+            assert png.driver == 'PNG'
+            assert png.count == 4 and png.dtypes[0] == 'uint8'
+            assert max(png.shape) == 200
+            assert png.width / png.height == pytest.approx(dataset.width / dataset.height, rel=0.01)
+            alpha = png.read(4)
+            valid = ~dataset.read(1, out_shape=png.shape, masked=True).mask
+            np.testing.assert_array_equal(alpha == 255, valid)
+
+    other_dir = pathlib.Path(temp_dir) / 'other'
+    other_dir.mkdir()
+    cog, = netcdf_converter(smap_file, other_dir, ['sss_smap'], logger)
+    assert not exists(other_dir / basename(cog).replace('.tif', '.png'))
@@ -0,0 +1,111 @@
+"""
+==============
+test_scratch.py
+==============
+
+Test the scratch space backends used for intermediate and output files.
+"""
+import pathlib
+from os.path import basename
+from unittest.mock import patch
+
+import pytest
+
+from net2cog import netcdf_convert
+from net2cog.netcdf_convert import Net2CogError, netcdf_converter
+from net2cog.scratch import ScratchSpace
+
+
+@pytest.mark.parametrize('backend', ['disk', 'tmpfs', 'vsimem'])
+def test_scratch_backends(backend, smap_file, temp_dir, tmp_path, logger):
+    """
+    Verify a COG is produced for every backend, and in-memory files are
+    accounted for and released.
+    """
+    scratch = ScratchSpace(backend, memory_directory=str(tmp_path), logger=logger)
+
+    results = netcdf_converter(
+        smap_file,
+        pathlib.Path(temp_dir),
+        ['sss_smap'],
+        logger,
+        scratch=scratch,
+    )
+
+    assert [basename(result) for result in results] == ['sss_smap.tif']
+    assert pathlib.Path(results[0]).is_file()
+    assert scratch.usage.memory_fallbacks == 0
+
+    if backend == 'disk':
+        assert scratch.usage.memory_files == 0
+        assert scratch.usage.disk_files == 2
+    else:
+        assert scratch.usage.memory_files > 0
+        assert scratch.usage.memory_peak > 0
+
+    if backend == 'tmpfs':
+        # The output COG is held in memory until it is released
+        assert scratch.is_in_memory(results[0])
+        assert str(tmp_path) in results[0]
+    else:
+        assert not scratch.is_in_memory(results[0])
+
+    scratch.cleanup()
+    assert scratch.usage.memory_in_use == 0
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.parametrize('backend', ['tmpfs', 'vsimem'])
+def test_scratch_memory_budget_fallback(backend, smap_file, temp_dir, tmp_path, logger):
+    """
+    Verify files that would exceed the in-memory budget are written to disk.
+    """
+    scratch = ScratchSpace(backend, memory_directory=str(tmp_path), memory_budget=1024, logger=logger)
+
+    results = netcdf_converter(
+        smap_file,
+        pathlib.Path(temp_dir),
+        ['sss_smap'],
+        logger,
+        scratch=scratch,
+    )
+
+    assert pathlib.Path(results[0]).parent == pathlib.Path(temp_dir)
+    assert scratch.usage.memory_files == 0
+    assert scratch.usage.memory_fallbacks >= 1
+    assert scratch.usage.disk_files == 2
+
+
+def test_scratch_unknown_backend(logger):
+    """
+    Verify an unsupported backend is rejected.
+    """
+    with pytest.raises(ValueError):
+        ScratchSpace('floppy', logger=logger)
+
+
+def test_scratch_released_on_failure(smap_file, temp_dir, tmp_path, logger):
+    """
+    Verify in-memory outputs are released when a later variable fails, so
+    they do not shrink the budget for the rest of the job.
+    """
+    scratch = ScratchSpace('tmpfs', memory_directory=str(tmp_path), logger=logger)
+    write_cogtiff = netcdf_convert._write_cogtiff
+
+    def fail_second_variable(output_directory, nc_xarray, variable_name, *args):
+        if variable_name == 'gland':
+            raise Net2CogError(variable_name, 'failed')
+        return write_cogtiff(output_directory, nc_xarray, variable_name, *args)
+
+    with pytest.raises(Net2CogError), \
+            patch('net2cog.netcdf_convert._write_cogtiff', side_effect=fail_second_variable):
+        netcdf_converter(
+            smap_file,
+            pathlib.Path(temp_dir),
+            ['sss_smap', 'gland'],
+            logger,
+            scratch=scratch,
+        )
+
+    assert scratch.usage.memory_files > 0
+    assert scratch.usage.memory_in_use == 0
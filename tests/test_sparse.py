@@ -0,0 +1,118 @@
+"""
+==============
+test_sparse.py
+==============
+
+Test sparse COGs, without their empty tiles.
+"""
+import pathlib
+from os.path import getsize
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+from rio_cogeo.cogeo import cog_validate
+
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.overviews import OverviewConfig
+from net2cog.sparse import EMPTY_TILES_KEY, empty_tiles, sparse_from_environment
+
+
+def _write_file(path: pathlib.Path):
+    """Write a mostly fill 1000 x 2000 grid, with data in two patches and a
+    variable without any data.
+    """
+    rng = np.random.default_rng(3)
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('lat', 1000)
+        dataset.createDimension('lon', 2000)
+        dataset.createVariable('lat', 'f4', ('lat',))[:] = np.linspace(89.91, -89.91, 1000)
+        dataset.createVariable('lon', 'f4', ('lon',))[:] = np.linspace(-179.91, 179.91, 2000)
+
+        sst = dataset.createVariable('sst', 'f4', ('lat', 'lon'), fill_value=-999.0)
+        data = np.full((1000, 2000), -999.0, dtype='f4')
+        data[100:300, 200:600] = rng.normal(15, 5, (200, 400))
+        data[900:, :100] = rng.normal(15, 5, (100, 100))
+        sst[:] = data
+
+        flag = dataset.createVariable('flag', 'f4', ('lat', 'lon'), fill_value=-999.0)
+        flag[:] = np.ma.masked_all((1000, 2000), dtype='f4')
+
+
+def _tile_offsets(dataset: rasterio.io.DatasetReader) -> np.ndarray:
+    """Whether each tile of a COG band is written."""
+    rows, columns = (-(-size // dataset.block_shapes[0][0]) for size in dataset.shape)
+    return np.array([[dataset.get_tag_item(f'BLOCK_OFFSET_{column}_{row}', 'TIFF', bidx=1) is not None
+                      for column in range(columns)] for row in range(rows)])
+
+
+def test_empty_tiles(temp_dir):
+    """Verify tiles are empty if every pixel of every band, including past
+    the edge of the raster, is nodata.
+    """
+    data = np.zeros((2, 600, 700), dtype='f4')
+    data[0, :300, :] = np.nan
+    data[1, :256, :] = np.nan
+    data[:, 512:, 512:] = np.nan
+    profile = {'driver': 'GTiff', 'width': 700, 'height': 600, 'count': 2, 'dtype': 'float32'}
+    path = pathlib.Path(temp_dir) / 'tiles.tif'
+    with rasterio.open(path, 'w', nodata=np.nan, **profile) as dataset:
+        dataset.write(data)
+    with rasterio.open(path) as dataset:
+        assert empty_tiles(dataset, 256) == (4, 9)
+        assert empty_tiles(dataset, 512) == (1, 4)
+
+    with rasterio.open(path, 'w', **profile) as dataset:
+        dataset.write(data)
+    with rasterio.open(path) as dataset:
+        assert empty_tiles(dataset, 256) == (0, 9)
+
+
+def test_sparse_from_environment(monkeypatch):
+    """Verify sparse COGs are opt-in."""
+    assert not sparse_from_environment()
+    monkeypatch.setenv('SPARSE_TILES', 'True')
+    assert sparse_from_environment()
+
+
+@pytest.mark.parametrize('engine', ['gdal', 'numpy'])
+def test_sparse_cog(temp_dir, logger, engine):
+    """
+    Verify empty tiles are not written at full resolution or in the
+    overviews, the COG reads the same as a dense COG, and is smaller.
+    """
+    path = pathlib.Path(temp_dir) / 'granule.nc'
+    _write_file(path)
+    dense_dir = pathlib.Path(temp_dir) / 'dense'
+    sparse_dir = pathlib.Path(temp_dir) / 'sparse'
+    dense_dir.mkdir()
+    sparse_dir.mkdir()
+    overviews = OverviewConfig(engine=engine)
+    dense_cogs = netcdf_converter(path, dense_dir, ['sst', 'flag'], logger, overviews=overviews)
+    sparse_cogs = netcdf_converter(path, sparse_dir, ['sst', 'flag'], logger, overviews=overviews, sparse=True)
+
+    for dense_cog, sparse_cog in zip(dense_cogs, sparse_cogs):
+        assert getsize(sparse_cog) < getsize(dense_cog)
+        with rasterio.open(dense_cog) as dense, rasterio.open(sparse_cog) as sparse:
+            assert EMPTY_TILES_KEY not in dense.tags()
+            assert sparse.overviews(1) == dense.overviews(1)
+            assert sparse.overviews(1)
+            np.testing.assert_array_equal(sparse.read(), dense.read())
+            assert _tile_offsets(dense).all()
+            for factor in sparse.overviews(1):
+                with rasterio.open(sparse_cog, overview_level=int(np.log2(factor)) - 1) as overview, \
+                        rasterio.open(dense_cog, overview_level=int(np.log2(factor)) - 1) as dense_overview:
+                    np.testing.assert_array_equal(overview.read(), dense_overview.read())
+                    assert not _tile_offsets(overview).all()
+
+    # rio-cogeo cannot validate COGs without any tile written
+    assert cog_validate(sparse_cogs[0], strict=True)[0]
+    with rasterio.open(sparse_cogs[0]) as sst:
+        written = _tile_offsets(sst)
+        # The patches span the first two tiles, and the edge tile below
+        np.testing.assert_array_equal(written, [[True, True, False, False], [True, False, False, False]])
+        assert sst.tags()[EMPTY_TILES_KEY] == '5'
+    with rasterio.open(sparse_cogs[1]) as flag:
+        assert not _tile_offsets(flag).any()
+        assert (flag.read() == flag.nodata).all()
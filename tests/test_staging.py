@@ -0,0 +1,155 @@
+"""
+==============
+test_staging.py
+==============
+
+Test the checksum and size computed while staging COGs.
+"""
+import hashlib
+import logging
+import os
+from unittest.mock import patch
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from harmony_service_lib.util import config
+from moto import mock_aws
+
+from net2cog import staging
+from net2cog.staging import MIN_PART_SIZE, ChecksumReader, MultipartConfig, stage_file
+
+
+@pytest.mark.parametrize('algorithm, prefix', [('sha256', '1220'), ('md5', 'd50110'), ('sha512', '1340')])
+def test_checksum_reader(tmp_path, algorithm, prefix):
+    """
+    Verify the checksum is a multihash of the bytes read, and the size
+    counts them.
+    """
+    data = bytes(range(256)) * 1000
+    local_file = tmp_path / 'data.bin'
+    local_file.write_bytes(data)
+
+    with open(local_file, 'rb') as file_handler:
+        reader = ChecksumReader(file_handler, algorithm)
+        while reader.read(1000):
+            pass
+
+    assert reader.size == len(data)
+    assert reader.checksum == prefix + hashlib.new(algorithm, data).hexdigest()
+
+
+def test_unknown_checksum_algorithm(tmp_path):
+    """Verify an unsupported checksum algorithm is rejected."""
+    with pytest.raises(ValueError):
+        ChecksumReader(None, 'crc32')
+
+
+def test_stage_file(mock_environ, tmp_path):
+    """Verify the staged URL matches Harmony's, with the file size and
+    checksum.
+    """
+    local_file = tmp_path / 'sst.tif'
+    local_file.write_bytes(b'cog')
+
+    staged_file = stage_file(str(local_file), 'sst.tif', 'image/tiff', 's3://bucket/path/',
+                             logging.getLogger(), config(validate=False))
+
+    assert staged_file.url == 'http://example.com/path/sst.tif'
+    assert staged_file.size == 3
+    assert staged_file.checksum == '1220' + hashlib.sha256(b'cog').hexdigest()
+
+
+@pytest.fixture(name='s3_config')
+def fixture_s3_config(monkeypatch):
+    """Harmony configuration that stages to a moto S3 bucket."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-west-2')
+    with mock_aws():
+        boto3.client('s3', region_name='us-west-2').create_bucket(
+            Bucket='staging', CreateBucketConfiguration={'LocationConstraint': 'us-west-2'}
+        )
+        yield config(validate=False)._replace(env='prod', aws_default_region='us-west-2')
+
+
+@pytest.fixture(name='large_file')
+def fixture_large_file(tmp_path):
+    """A file of two and a half parts."""
+    large_file = tmp_path / 'global.tif'
+    large_file.write_bytes(os.urandom(MIN_PART_SIZE * 5 // 2))
+    return large_file
+
+
+def test_multipart_upload(s3_config, large_file):
+    """
+    Verify a large file is uploaded in parallel parts, with the checksum of
+    the whole file.
+    """
+    multipart = MultipartConfig(threshold=MIN_PART_SIZE, part_size=MIN_PART_SIZE, concurrency=3)
+
+    staged_file = stage_file(str(large_file), 'global.tif', 'image/tiff', 's3://staging/job/',
+                             logging.getLogger(), s3_config, multipart=multipart)
+
+    data = large_file.read_bytes()
+    assert staged_file.url == 's3://staging/job/global.tif'
+    assert staged_file.size == len(data)
+    assert staged_file.checksum == '1220' + hashlib.sha256(data).hexdigest()
+
+    staged_object = boto3.client('s3').get_object(Bucket='staging', Key='job/global.tif')
+    assert staged_object['ETag'].endswith('-3"')
+    assert staged_object['ContentType'] == 'image/tiff'
+    assert staged_object['Body'].read() == data
+
+
+def test_small_file_single_upload(s3_config, tmp_path):
+    """Verify files below the threshold are uploaded in a single request."""
+    small_file = tmp_path / 'small.tif'
+    small_file.write_bytes(b'cog')
+
+    stage_file(str(small_file), 'small.tif', 'image/tiff', 's3://staging/job/',
+               logging.getLogger(), s3_config, multipart=MultipartConfig(threshold=MIN_PART_SIZE))
+
+    staged_object = boto3.client('s3').get_object(Bucket='staging', Key='job/small.tif')
+    assert '-' not in staged_object['ETag']
+
+
+def _failing_client(cfg, failures):
+    """An S3 client whose part uploads fail the given number of times."""
+    client = staging.s3_client(cfg)
+    upload_part = client.upload_part
+    attempts = []
+
+    def flaky_upload_part(**kwargs):
+        attempts.append(kwargs['PartNumber'])
+        if kwargs['PartNumber'] == 2 and attempts.count(2) <= failures:
+            raise ClientError({'Error': {'Code': 'SlowDown', 'Message': 'Slow down'}}, 'UploadPart')
+        return upload_part(**kwargs)
+
+    client.upload_part = flaky_upload_part
+    return client, attempts
+
+
+@pytest.mark.parametrize('failures, succeeds', [(2, True), (3, False)])
+def test_multipart_part_retries(s3_config, large_file, failures, succeeds):
+    """
+    Verify a failed part is retried on its own, and the upload is aborted
+    when a part fails every attempt.
+    """
+    multipart = MultipartConfig(threshold=MIN_PART_SIZE, part_size=MIN_PART_SIZE,
+                                concurrency=2, max_attempts=3, retry_backoff=0)
+    client, attempts = _failing_client(s3_config, failures)
+
+    with patch('net2cog.staging.s3_client', return_value=client):
+        if succeeds:
+            stage_file(str(large_file), 'global.tif', 'image/tiff', 's3://staging/job/',
+                       logging.getLogger(), s3_config, multipart=multipart)
+        else:
+            with pytest.raises(ClientError):
+                stage_file(str(large_file), 'global.tif', 'image/tiff', 's3://staging/job/',
+                           logging.getLogger(), s3_config, multipart=multipart)
+
+    assert attempts.count(1) == 1
+    assert attempts.count(2) == min(failures + 1, 3)
+    assert bool(client.list_objects_v2(Bucket='staging').get('Contents')) == succeeds
+    assert not client.list_multipart_uploads(Bucket='staging').get('Uploads')
@@ -0,0 +1,104 @@
+"""
+==================
+test_statistics.py
+==================
+
+Test the band statistics written to output COGs.
+"""
+import pathlib
+
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog import statistics
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.statistics import BandStatistics, compute_statistics, read_statistics
+
+
+@pytest.fixture(name='raster_file')
+def fixture_raster_file(tmp_path):
+    """A float32 GeoTIFF with NaN and nodata pixels."""
+    data = np.arange(100, dtype='float32').reshape(10, 10)
+    data[0, 0] = np.nan
+    data[9, 9] = -9999
+    raster_file = str(tmp_path / 'raster.tif')
+    with rasterio.open(raster_file, 'w', driver='GTiff', width=10, height=10, count=1,
+                       dtype='float32', nodata=-9999) as dataset:
+        dataset.write(data, 1)
+    return raster_file, data
+
+
+def test_compute_statistics(raster_file, monkeypatch):
+    """
+    Verify statistics exclude NaN and nodata pixels, and combining windows
+    gives the same result as a single pass.
+    """
+    raster_file, data = raster_file
+    valid = data[np.isfinite(data) & (data != -9999)].astype(np.float64)
+
+    # Read two rows at a time
+    monkeypatch.setattr(statistics, 'WINDOW_BYTES', 2 * 10 * 4)
+    with rasterio.open(raster_file) as dataset:
+        band_statistics, = compute_statistics(dataset, histogram_bins=4)
+
+    assert band_statistics.valid_count == 98
+    assert band_statistics.valid_percent == pytest.approx(98.0)
+    assert (band_statistics.minimum, band_statistics.maximum) == (1.0, 98.0)
+    assert band_statistics.mean == pytest.approx(valid.mean())
+    assert band_statistics.stddev == pytest.approx(valid.std())
+    assert band_statistics.histogram['buckets'] == np.histogram(valid, bins=4)[0].tolist()
+    assert BandStatistics.from_tags(band_statistics.to_tags()) == band_statistics
+
+
+@pytest.mark.parametrize('dtype', ['uint8', 'int16'])
+def test_integer_histogram(tmp_path, monkeypatch, dtype):
+    """Verify histograms of small integers are exact, reading one row at a
+    time.
+    """
+    data = np.random.default_rng(7).integers(0, 200, (20, 30)).astype(dtype)
+    raster_file = str(tmp_path / 'integers.tif')
+    with rasterio.open(raster_file, 'w', driver='GTiff', width=30, height=20, count=1, dtype=dtype) as dataset:
+        dataset.write(data, 1)
+
+    monkeypatch.setattr(statistics, 'WINDOW_BYTES', 1)
+    with rasterio.open(raster_file) as dataset:
+        band_statistics, = compute_statistics(dataset, histogram_bins=7)
+    assert band_statistics.histogram['buckets'] == np.histogram(data, bins=7)[0].tolist()
+
+
+def test_float_histogram(tmp_path, monkeypatch):
+    """Verify histograms of floats whose range grows from window to window
+    only differ from the exact histogram at the edges of the buckets.
+    """
+    data = (np.random.default_rng(3).normal(0, 1, (50, 40)) * np.arange(1, 51)[:, None]).astype('float32')
+    raster_file = str(tmp_path / 'floats.tif')
+    with rasterio.open(raster_file, 'w', driver='GTiff', width=40, height=50, count=1,
+                       dtype='float32') as dataset:
+        dataset.write(data, 1)
+
+    monkeypatch.setattr(statistics, 'WINDOW_BYTES', 40 * 4)
+    with rasterio.open(raster_file) as dataset:
+        band_statistics, = compute_statistics(dataset, histogram_bins=10)
+
+    buckets = np.array(band_statistics.histogram['buckets'])
+    expected = np.histogram(data, bins=10)[0]
+    assert buckets.sum() == data.size
+    # The largest fine bin is 2 / 64 of a bucket
+    assert np.abs(buckets - expected).max() <= 0.05 * expected.max()
+    assert (band_statistics.histogram['min'], band_statistics.histogram['max']) == (data.min(), data.max())
+
+
+def test_cog_statistics(smap_file, temp_dir, logger):
+    """
+    Verify the statistics are written to the COG band metadata, where GDAL
+    reads them.
+    """
+    results = netcdf_converter(smap_file, pathlib.Path(temp_dir), ['sss_smap'], logger, histogram_bins=0)
+
+    band_statistics, = read_statistics(results[0])
+    assert band_statistics.valid_count > 0
+    assert band_statistics.histogram is None
+
+    with rasterio.open(results[0]) as dataset:
+        assert dataset.statistics(1, approx=True).max == pytest.approx(band_statistics.maximum)
@@ -0,0 +1,201 @@
+"""
+=============
+test_swath.py
+=============
+
+Test gridding of swath variables on 2D latitude and longitude coordinates.
+"""
+import pathlib
+
+import netCDF4
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+
+from net2cog.netcdf_convert import inspect, netcdf_converter
+from net2cog.swath import (METHOD_ATTRIBUTE, SwathGrid, SwathGridConfig, bin_swath, estimate_resolution,
+                           swath_coordinates)
+
+
+def _swath(along: int = 300, cross: int = 80) -> tuple[np.ndarray, np.ndarray]:
+    """Coordinates of a swath crossing the equator at an angle, with
+    spacings of about 0.1 degree.
+    """
+    rows, columns = np.meshgrid(np.arange(along), np.arange(cross), indexing='ij')
+    return -15 + 0.1 * rows + 0.02 * columns, 20 + 0.03 * rows + 0.1 * columns
+
+
+def _write_file(path: pathlib.Path):
+    """Write a swath file with a masked variable, a flag variable and an
+    along track variable.
+    """
+    latitudes, longitudes = _swath()
+    with netCDF4.Dataset(path, 'w') as dataset:
+        dataset.createDimension('along_track', latitudes.shape[0])
+        dataset.createDimension('cross_track', latitudes.shape[1])
+        dataset.createVariable('latitude', 'f4', ('along_track', 'cross_track'))[:] = latitudes
+        dataset.createVariable('longitude', 'f4', ('along_track', 'cross_track'))[:] = longitudes
+        dataset.createVariable('time', 'f8', ('along_track',))[:] = np.arange(latitudes.shape[0])
+
+        sst = dataset.createVariable('sst', 'f4', ('along_track', 'cross_track'), fill_value=-999.0)
+        sst.coordinates = 'latitude longitude'
+        sst.units = 'kelvin'
+        data = (290 + latitudes / 10).astype('f4')
+        data[:, :5] = -999.0
+        sst[:] = data
+
+        quality = dataset.createVariable('quality', 'i1', ('along_track', 'cross_track'))
+        quality.coordinates = 'latitude longitude'
+        quality[:] = (np.arange(latitudes.size) % 4).reshape(latitudes.shape)
+
+
+def _brute_force(values, latitudes, longitudes, grid, method):
+    """Bin samples one at a time."""
+    samples = {}
+    for value, lat, lon in zip(values.ravel(), latitudes.ravel(), longitudes.ravel()):
+        if np.isnan(value):
+            continue
+        row = min(int(np.floor((grid.north - lat) / grid.resolution)), grid.height - 1)
+        column = min(int(np.floor((lon - grid.west) / grid.resolution)), grid.width - 1)
+        center = (grid.north - (row + 0.5) * grid.resolution, grid.west + (column + 0.5) * grid.resolution)
+        samples.setdefault((row, column), []).append(((lat - center[0]) ** 2 + (lon - center[1]) ** 2, value))
+
+    expected = np.full((grid.height, grid.width), 0.0 if method == 'count' else np.nan)
+    for (row, column), cell in samples.items():
+        if method == 'count':
+            expected[row, column] = len(cell)
+        elif method == 'mean':
+            expected[row, column] = np.mean([value for _, value in cell])
+        else:
+            expected[row, column] = min(cell, key=lambda sample: sample[0])[1]
+    return expected
+
+
+@pytest.mark.parametrize('method', ['mean', 'count', 'nearest'])
+def test_bin_swath(method):
+    """
+    Verify each method matches binning the samples one at a time, whatever
+    the size of the chunks.
+    """
+    rng = np.random.default_rng(4)
+    latitudes = xr.DataArray(rng.uniform(-2, 2, (40, 30)), dims=('along', 'cross'))
+    longitudes = xr.DataArray(rng.uniform(178, 182, (40, 30)), dims=('along', 'cross'))
+    values = rng.normal(0, 1, (40, 30)).astype('f4')
+    values[rng.random((40, 30)) < 0.2] = np.nan
+    values = xr.DataArray(values, dims=('along', 'cross'))
+
+    grid = SwathGrid.covering(latitudes, longitudes, 0.5, 100)
+    # Longitudes east of the antimeridian are wrapped, so the grid is global
+    assert grid.west == -180 and grid.width == 720 and grid.height == 8
+    expected = _brute_force(values.values, latitudes.values, ((longitudes.values + 180) % 360) - 180, grid, method)
+
+    for chunk_pixels in [1, 100, 10000]:
+        gridded = bin_swath(values, latitudes, longitudes, grid, SwathGridConfig(method=method, chunk_pixels=chunk_pixels))
+        assert gridded.dtype == (np.int32 if method == 'count' else np.float32)
+        np.testing.assert_allclose(gridded, expected, rtol=1e-6, atol=1e-7)
+
+
+def test_grid():
+    """Verify the grid is aligned on the resolution and covers the swath, and
+    the resolution is estimated from the pixel spacing.
+    """
+    latitudes, longitudes = (xr.DataArray(array, dims=('along', 'cross')) for array in _swath())
+    assert estimate_resolution(latitudes, longitudes) == 0.1
+
+    grid = SwathGrid.covering(latitudes, longitudes, 0.25, 1000)
+    assert (grid.north, grid.west) == (16.5, 20.0)
+    assert grid.north - grid.height * grid.resolution <= latitudes.min()
+    assert grid.west + grid.width * grid.resolution >= longitudes.max()
+    np.testing.assert_allclose(grid.latitudes()[:2], [16.375, 16.125])
+
+
+def test_inspect_metadata_only(tmp_path, logger, monkeypatch):
+    """Verify inspecting a swath file does not read its coordinates, and
+    unknown variables are not found.
+    """
+    path = tmp_path / 'swath.nc'
+    _write_file(path)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('swath coordinates were read')
+
+    monkeypatch.setattr(SwathGrid, 'covering', fail)
+    monkeypatch.setattr('net2cog.swath.estimate_resolution', fail)
+    plan = inspect(path, ['sst', 'quality', 'missing'], logger)
+    assert plan.convertible_variables == ['sst', 'quality']
+    assert [variable.dtype for variable in plan.variables[:2]] == ['float32', 'int8']
+    assert not plan.variables[2].found
+
+
+def test_config(monkeypatch):
+    """Verify the configuration is read from the environment and
+    validated.
+    """
+    assert SwathGridConfig.from_environment() == SwathGridConfig()
+    flags = xr.DataArray(np.zeros(2, 'f4'), attrs={'flag_values': [0, 1]})
+    packed = xr.DataArray(np.zeros(2, 'f4'))
+    packed.encoding.update(dtype=np.dtype('i2'), scale_factor=0.01)
+    masked = xr.DataArray(np.zeros(2, 'f4'))
+    masked.encoding.update(dtype=np.dtype('u1'), _FillValue=255)
+    assert [SwathGridConfig().method_for(variable) for variable in [flags, packed, masked]] == \
+        ['nearest', 'mean', 'nearest']
+    assert SwathGridConfig(method='mean').method_for(flags) == 'mean'
+    monkeypatch.setenv('SWATH_RESOLUTION', '0.05')
+    monkeypatch.setenv('SWATH_METHOD', 'nearest')
+    monkeypatch.setenv('SWATH_CHUNK_PIXELS', '1000')
+    assert SwathGridConfig.from_environment() == SwathGridConfig(0.05, 'nearest', 1000)
+
+    with pytest.raises(ValueError, match='Unknown swath gridding method'):
+        SwathGridConfig(method='median')
+    with pytest.raises(ValueError, match='positive'):
+        SwathGridConfig(resolution=0)
+
+
+def test_swath_conversion(tmp_path, logger):
+    """
+    Verify swath variables are planned and converted on the grid, and other
+    variables of the swath are skipped.
+    """
+    path = tmp_path / 'swath.nc'
+    _write_file(path)
+    config = SwathGridConfig(resolution=0.2, chunk_pixels=5000)
+
+    with xr.open_dataset(path) as dataset:
+        assert swath_coordinates(dataset) == ('latitude', 'longitude')
+        grid = SwathGrid.covering(dataset['latitude'], dataset['longitude'], 0.2, 5000)
+        expected = bin_swath(dataset['sst'], dataset['latitude'], dataset['longitude'], grid, config)
+        nearest = bin_swath(dataset['sst'].fillna(0), dataset['latitude'], dataset['longitude'], grid,
+                            SwathGridConfig(method='nearest'))
+
+    plan = inspect(path, [], logger, config)
+    assert plan.convertible_variables == ['sst', 'quality']
+    assert {variable.name: variable.skip_reason for variable in plan.variables}['time'] is not None
+    # Planned with the shape of the swath, as the grid is not computed
+    assert {variable.name: variable.shape for variable in plan.variables}['sst'] == [300, 80]
+
+    sst_cog, quality_cog = netcdf_converter(path, tmp_path, [], logger, swath_grid=config)
+    with rasterio.open(sst_cog) as dataset:
+        assert dataset.shape == (grid.height, grid.width)
+        assert dataset.bounds.left == pytest.approx(grid.west)
+        assert dataset.bounds.top == pytest.approx(grid.north)
+        assert dataset.res == pytest.approx((0.2, 0.2))
+        assert np.isnan(dataset.nodata)
+        assert dataset.tags()[METHOD_ATTRIBUTE] == 'mean'
+        assert dataset.tags()['units'] == 'kelvin'
+        np.testing.assert_array_equal(dataset.read(1), expected)
+        assert 0.1 < np.isfinite(expected).mean() < 1
+
+    # Integer variables are gridded with the nearest sample, keeping their type
+    with rasterio.open(quality_cog) as dataset:
+        assert dataset.dtypes[0] == 'int8' and dataset.nodata == -127
+        assert dataset.tags()[METHOD_ATTRIBUTE] == 'nearest'
+        data = dataset.read(1, masked=True)
+        assert set(np.unique(data.compressed())) == {0, 1, 2, 3}
+        np.testing.assert_array_equal(data.mask, np.isnan(nearest))
+
+    count_cog, = netcdf_converter(path, tmp_path, ['sst'], logger,
+                                  swath_grid=SwathGridConfig(resolution=0.2, method='count'))
+    with rasterio.open(count_cog) as dataset:
+        assert dataset.dtypes[0] == 'int32' and dataset.nodata is None
+        assert dataset.read(1).sum() == 300 * 75
@@ -0,0 +1,120 @@
+"""
+========================================
+test_validate_cloud_optimized_geotiff.py
+========================================
+
+Test the batch mode of the COG validator.
+"""
+import json
+import pathlib
+
+import numpy as np
+import pytest
+import rasterio
+
+from net2cog import validate_cloud_optimized_geotiff
+from net2cog.netcdf_convert import netcdf_converter
+from net2cog.validate_cloud_optimized_geotiff import ValidateCloudOptimizedGeoTIFFException
+
+
+def _fake_validate(filename, full_check=False):
+    """Validate files by name: `bad` files are not COGs, and `broken` files
+    cannot be read.
+    """
+    name = pathlib.Path(filename).name
+    if name.startswith('broken'):
+        raise RuntimeError(f'{filename}: not recognized as a supported file format')
+    if name.startswith('bad'):
+        raise ValidateCloudOptimizedGeoTIFFException('The file is not a GeoTIFF')
+    return [], [], {'ifd_offsets': {'main': 8}, 'data_offsets': {'main': 512}, 'full_check': full_check}
+
+
+def test_expand_filenames(tmp_path):
+    """Verify glob patterns are expanded recursively and sorted, and names
+    that match nothing are kept.
+    """
+    (tmp_path / 'sub').mkdir()
+    for name in ['b.tif', 'a.tif', 'sub/c.tif', 'notes.txt']:
+        (tmp_path / name).touch()
+
+    assert validate_cloud_optimized_geotiff.expand_filenames([f'{tmp_path}/*.tif']) == [
+        f'{tmp_path}/a.tif', f'{tmp_path}/b.tif']
+    assert validate_cloud_optimized_geotiff.expand_filenames([f'{tmp_path}/**/c.tif', 'missing.tif',
+                                                              f'{tmp_path}/*.png']) == [
+        f'{tmp_path}/sub/c.tif', 'missing.tif', f'{tmp_path}/*.png']
+
+
+@pytest.mark.parametrize('argv', [[], ['--bogus', 'a.tif'], ['-j', '0', 'a.tif']])
+def test_usage(argv, capsys):
+    """Verify invalid arguments print the usage and fail."""
+    assert validate_cloud_optimized_geotiff.main(argv) == 1
+    assert capsys.readouterr().out.startswith('Usage:')
+
+
+def test_json_report_shape(monkeypatch, tmp_path, capsys):
+    """
+    Verify the JSON report of a batch, with an exception of any type recorded
+    as an error of its file, and the exit code failing if any file is invalid.
+    """
+    monkeypatch.setattr(validate_cloud_optimized_geotiff, 'validate', _fake_validate)
+    for name in ['good.tif', 'bad.tif', 'broken.tif']:
+        (tmp_path / name).touch()
+
+    exit_code = validate_cloud_optimized_geotiff.main(['--json', '-j', '3', '--full-check=no', f'{tmp_path}/*.tif'])
+
+    report = json.loads(capsys.readouterr().out)
+    assert exit_code == 1
+    assert set(report) == {'valid', 'files', 'invalid', 'results'}
+    assert (report['valid'], report['files'], report['invalid']) == (False, 3, 2)
+    results = {pathlib.Path(result['file']).name: result for result in report['results']}
+    assert list(results) == ['bad.tif', 'broken.tif', 'good.tif']
+    assert set(results['good.tif']) == {'file', 'valid', 'warnings', 'errors', 'details'}
+    assert results['good.tif']['valid'] and results['good.tif']['details']['full_check'] is False
+    assert results['bad.tif']['errors'] == ['The file is not a GeoTIFF']
+    assert results['broken.tif']['errors'][0].startswith('RuntimeError: ')
+    assert results['broken.tif']['details'] == {}
+
+    assert validate_cloud_optimized_geotiff.main(['-q', f'{tmp_path}/good.tif']) == 0
+    assert not capsys.readouterr().out
+
+
+def test_full_check_auto(monkeypatch, tmp_path):
+    """Verify only local and in-memory files are fully checked by default."""
+    monkeypatch.setattr(validate_cloud_optimized_geotiff, 'validate', _fake_validate)
+    (tmp_path / 'good.tif').touch()
+
+    results = validate_cloud_optimized_geotiff.validate_files(
+        [str(tmp_path / 'good.tif'), '/vsimem/good.tif', '/vsis3/bucket/good.tif'])
+
+    assert [result['details']['full_check'] for result in results] == [True, True, False]
+
+
+def test_batch_json_report(smap_file, temp_dir, logger, capsys):
+    """
+    Verify a glob is validated concurrently, with a JSON result for each
+    file and a failing exit code when any file is not a COG.
+    """
+    pytest.importorskip('osgeo')
+    netcdf_converter(smap_file, pathlib.Path(temp_dir), ['sss_smap', 'gland'], logger)
+    with rasterio.open(pathlib.Path(temp_dir, 'striped.tif'), 'w', driver='GTiff', width=2048, height=16,
+                       count=1, dtype='uint8') as dataset:
+        dataset.write(np.zeros((1, 16, 2048), dtype='uint8'))
+
+    exit_code = validate_cloud_optimized_geotiff.main(['--json', '-j', '2', f'{temp_dir}/*.tif'])
+
+    report = json.loads(capsys.readouterr().out)
+    results = {pathlib.Path(result['file']).name: result for result in report['results']}
+    assert exit_code == 1
+    assert report['files'] == 3
+    assert report['invalid'] == 1
+    assert not results['striped.tif']['valid']
+    assert results['sss_smap.tif']['valid']
+    assert results['sss_smap.tif']['details']['ifd_offsets']['main'] > 0
+    assert 'main' in results['gland.tif']['details']['data_offsets']
+
+
+def test_missing_file(capsys):
+    """Verify a file that cannot be opened is reported as invalid."""
+    pytest.importorskip('osgeo')
+    assert validate_cloud_optimized_geotiff.main(['-q', '/does/not/exist.tif']) == 1
+    assert not capsys.readouterr().out
@@ -0,0 +1,107 @@
+"""
+==================
+test_zarr_input.py
+==================
+
+Test kerchunk reference files and Zarr stores as input.
+"""
+import json
+import pathlib
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import rasterio
+import xarray as xr
+
+from net2cog.netcdf_convert import inspect, netcdf_converter
+from net2cog.zarr_input import is_zarr_input
+
+pytest.importorskip('zarr')
+SingleHdf5ToZarr = pytest.importorskip('kerchunk.hdf').SingleHdf5ToZarr
+
+
+def _reference_file(netcdf_file: pathlib.Path) -> pathlib.Path:
+    """Write kerchunk references to the chunks of a NetCDF file."""
+    reference_file = netcdf_file.with_suffix('.json')
+    with open(netcdf_file, 'rb') as file_handler:
+        references = SingleHdf5ToZarr(file_handler, str(netcdf_file)).translate()
+    reference_file.write_text(json.dumps(references), encoding='utf-8')
+    return reference_file
+
+
+def test_is_zarr_input(tmp_path):
+    """Verify reference files and Zarr stores are recognized."""
+    (tmp_path / 'store.zarr').mkdir()
+    (tmp_path / 'store').mkdir()
+    (tmp_path / 'store' / '.zgroup').write_text('{"zarr_format": 2}', encoding='utf-8')
+    (tmp_path / 'directory').mkdir()
+
+    assert is_zarr_input(str(tmp_path / 'granule.json'))
+    assert is_zarr_input(str(tmp_path / 'store.zarr'))
+    assert is_zarr_input(str(tmp_path / 'store'))
+    assert not is_zarr_input(str(tmp_path / 'directory'))
+    assert not is_zarr_input(str(tmp_path / 'granule.nc'))
+
+
+def test_reference_input(smap_file, temp_dir, logger):
+    """
+    Verify COGs converted through kerchunk references match the COGs of the
+    NetCDF file, without the file being opened with netCDF4.
+    """
+    reference_file = _reference_file(smap_file)
+    netcdf_dir = pathlib.Path(temp_dir) / 'netcdf'
+    reference_dir = pathlib.Path(temp_dir) / 'reference'
+    netcdf_dir.mkdir()
+    reference_dir.mkdir()
+
+    netcdf_cogs = netcdf_converter(smap_file, netcdf_dir, ['sss_smap', 'gland'], logger)
+    with patch('netCDF4.Dataset', side_effect=AssertionError('opened with netCDF4')):
+        plan = inspect(reference_file, [], logger)
+        reference_cogs = netcdf_converter(reference_file, reference_dir, ['sss_smap', 'gland'], logger)
+
+    assert 'sss_smap' in plan.convertible_variables
+    assert plan.variables[plan.convertible_variables.index('sss_smap')].chunks is not None
+    assert [pathlib.Path(cog).name for cog in reference_cogs] == [pathlib.Path(cog).name for cog in netcdf_cogs]
+    for netcdf_cog, reference_cog in zip(netcdf_cogs, reference_cogs):
+        with rasterio.open(netcdf_cog) as expected, rasterio.open(reference_cog) as actual:
+            assert actual.profile == expected.profile
+            assert actual.tags(1) == expected.tags(1)
+            assert np.array_equal(actual.read(), expected.read())
+
+
+def test_grouped_reference_input(grouped_file, temp_dir, logger):
+    """Verify variables in nested groups of a reference file are found and
+    converted with the coordinates of the root group.
+    """
+    reference_file = _reference_file(grouped_file)
+
+    results = netcdf_converter(reference_file, pathlib.Path(temp_dir), [], logger)
+
+    assert [pathlib.Path(result).name for result in results] == [
+        'sst.tif', 'data_01_ku_ssha.tif', 'data_02_c_ssha.tif'
+    ]
+    with rasterio.open(results[2]) as cog:
+        assert cog.bounds.left == pytest.approx(-180)
+        assert (cog.read(1) == 1).all()
+
+
+def test_zarr_store_input(smap_file, temp_dir, logger):
+    """Verify a Zarr store is converted like the NetCDF file it was written
+    from.
+    """
+    zarr_store = pathlib.Path(temp_dir) / 'smap.zarr'
+    with xr.open_dataset(smap_file) as dataset:
+        dataset.to_zarr(zarr_store)
+    netcdf_dir = pathlib.Path(temp_dir) / 'netcdf'
+    zarr_dir = pathlib.Path(temp_dir) / 'zarr'
+    netcdf_dir.mkdir()
+    zarr_dir.mkdir()
+
+    netcdf_cog, = netcdf_converter(smap_file, netcdf_dir, ['sss_smap'], logger)
+    zarr_cog, = netcdf_converter(zarr_store, zarr_dir, ['sss_smap'], logger)
+
+    with rasterio.open(netcdf_cog) as expected, rasterio.open(zarr_cog) as actual:
+        assert actual.nodata == expected.nodata
+        assert actual.tags(1) == expected.tags(1)
+        assert np.array_equal(actual.read(), expected.read())